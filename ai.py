@@ -1,107 +1,387 @@
+import os
 import json
+import asyncio
+import time
+import hashlib
 import httpx
-from typing import List, Dict, Any
-
-class GLMClient:
-    """GLM API client for habit insights."""
-
-    def __init__(self, api_key: str):
-        self.api_key = api_key
-        self.base_url = "https://open.bigmodel.cn/api/anthropic/v1/messages"
-
-    async def get_habit_insights(self, habit_data: Dict[str, Any]) -> str:
-        """Generate AI insights from habit data."""
+from collections import OrderedDict
+from datetime import date
+from typing import List, Dict, Any, Optional, Callable, Awaitable, AsyncIterator
+
+from database import run_db, current_db_path, get_cached_insight, put_cached_insight, utc_today
+from features import summarize_habit_data
+from metrics import ai_insights_seconds, ai_upstream_seconds
+
+INSIGHTS_UNAVAILABLE = "Unable to generate insights at this time."
+
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key into one in-flight execution.
+
+    The first caller for a key starts the work as its own task; callers that
+    arrive while it runs await the same task and share its result. A waiter
+    being cancelled does not cancel the shared work.
+    """
+
+    def __init__(self):
+        self._in_flight: Dict[Any, asyncio.Task] = {}
+        self.calls = 0
+        self.executions = 0
+
+    async def do(self, key: Any, func: Callable[[], Awaitable[Any]]) -> Any:
+        """Run func() for key, or join the run already in flight."""
+        self.calls += 1
+        task = self._in_flight.get(key)
+        if task is None:
+            self.executions += 1
+            task = asyncio.ensure_future(func())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        return await asyncio.shield(task)
+
+    def running(self, key: Any) -> bool:
+        """Whether a run for key is in flight and can be joined."""
+        return key in self._in_flight
+
+    def _forget(self, key: Any, task: asyncio.Task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if not task.cancelled():
+            task.exception()  # Mark as retrieved; waiters already received it
+
+    def metrics(self) -> Dict[str, int]:
+        """Counts of calls, executions actually run, and calls served by joining one."""
+        return {
+            "calls": self.calls,
+            "executions": self.executions,
+            "deduplicated": self.calls - self.executions,
+            "in_flight": len(self._in_flight),
+        }
+
+
+class _SharedStream:
+    """An async iterator consumed by its own task, replayed to every subscriber."""
+
+    def __init__(self, source: AsyncIterator[Any]):
+        self.items: List[Any] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self._changed = asyncio.Event()
+        self.task = asyncio.ensure_future(self._pump(source))
+
+    async def _pump(self, source: AsyncIterator[Any]):
+        try:
+            async for item in source:
+                self.items.append(item)
+                self._notify()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._notify()
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def subscribe(self) -> AsyncIterator[Any]:
+        index = 0
+        while True:
+            # Taken before draining, so items added while we yield still wake us
+            changed = self._changed
+            while index < len(self.items):
+                yield self.items[index]
+                index += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await changed.wait()
+
+
+class StreamFlight(SingleFlight):
+    """Coalesce concurrent streams with the same key into one in-flight stream.
+
+    The first caller for a key starts consuming func()'s stream as its own
+    task; every caller, including ones that arrive while it runs, gets all
+    of its items from the start. A subscriber leaving does not stop the
+    shared stream.
+    """
+
+    async def stream(self, key: Any, func: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        """Yield the items of func()'s stream for key, or of the stream already in flight."""
+        self.calls += 1
+        shared = self._in_flight.get(key)
+        if shared is None:
+            self.executions += 1
+            shared = self._in_flight[key] = _SharedStream(func())
+            shared.task.add_done_callback(lambda done: self._forget_stream(key, shared))
+        async for item in shared.subscribe():
+            yield item
+
+    def _forget_stream(self, key: Any, shared: _SharedStream):
+        if self._in_flight.get(key) is shared:
+            del self._in_flight[key]
+
+
+class InsightsCache:
+    """LRU + TTL cache of generated insights, keyed by a hash of provider, model and prompt.
+
+    With persist enabled, entries are also written to the insight_cache
+    table so they survive restarts. The key last produced for each data
+    version is remembered too, so a repeat request with no writes in
+    between can skip gathering data and building the prompt.
+    """
+
+    def __init__(self, max_entries: int = 128, ttl_seconds: float = 6 * 3600, persist: bool = False):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.persist = persist
+        self._entries = OrderedDict()       # key -> (created_at, insights)
+        self._version_keys = OrderedDict()  # (database, provider, model, data_version, local day, UTC day) -> key
+        self.flight = SingleFlight()        # one upstream call per prompt at a time
+        self.streams = StreamFlight()       # one upstream stream per prompt at a time
+
+    @staticmethod
+    def make_key(provider: str, model: str, prompt: str) -> str:
+        """Hash everything that determines the model's answer."""
+        return hashlib.sha256(f"{provider}\0{model}\0{prompt}".encode()).hexdigest()
+
+    def _version_key(self, provider: str, model: str, data_version: int) -> tuple:
+        # Versions count writes per database; streaks and date windows are
+        # relative to today, local and UTC, so a new day in either is new data
+        return (current_db_path(), provider, model, data_version, date.today().isoformat(), utc_today().isoformat())
+
+    def _lookup(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        created_at, insights = entry
+        if time.time() - created_at >= self.ttl_seconds:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return insights
+
+    def _store(self, key: str, insights: str, created_at: float):
+        self._entries[key] = (created_at, insights)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get_for_version(self, provider: str, model: str, data_version: int) -> Optional[str]:
+        """Get the cached answer for data that has not been written to since it was built."""
+        key = self._version_keys.get(self._version_key(provider, model, data_version))
+        return self._lookup(key) if key else None
+
+    async def get(self, key: str) -> Optional[str]:
+        """Get cached insights by key from memory, then from disk when persisting."""
+        insights = self._lookup(key)
+        if insights is None and self.persist:
+            stored = await run_db(get_cached_insight, key, time.time() - self.ttl_seconds)
+            if stored is not None:
+                insights = stored[0]
+                self._store(key, insights, stored[1])
+        return insights
+
+    async def put(self, key: str, insights: str):
+        """Cache insights under key, in memory and on disk when persisting."""
+        now = time.time()
+        self._store(key, insights, now)
+        if self.persist:
+            await run_db(put_cached_insight, key, insights, now, now - self.ttl_seconds)
+
+    def remember_version(self, provider: str, model: str, data_version: int, key: str):
+        """Record which prompt key answers the data as of data_version."""
+        self._version_keys[self._version_key(provider, model, data_version)] = key
+        while len(self._version_keys) > self.max_entries:
+            self._version_keys.popitem(last=False)
+
+    async def get_or_generate(self, provider: str, model: str, prompt: str,
+                              generate: Callable[[str], Awaitable[str]],
+                              data_version: int = None) -> str:
+        """Return cached insights for this prompt, calling generate(prompt) on a miss."""
+        key = self.make_key(provider, model, prompt)
+        insights = await self.get(key)
+
+        if insights is None:
+            async def produce():
+                generated = await generate(prompt)
+                if not generated or generated == INSIGHTS_UNAVAILABLE:
+                    return None
+                await self.put(key, generated)
+                return generated
+
+            insights = await self.flight.do(key, produce)
+            if insights is None:
+                return INSIGHTS_UNAVAILABLE
+
+        if data_version is not None:
+            self.remember_version(provider, model, data_version, key)
+        return insights
+
+    def clear(self):
+        """Drop every in-memory entry."""
+        self._entries.clear()
+        self._version_keys.clear()
+
+
+insights_cache = InsightsCache(
+    max_entries=int(os.getenv("INSIGHTS_CACHE_SIZE", "128")),
+    ttl_seconds=float(os.getenv("INSIGHTS_CACHE_TTL", str(6 * 3600))),
+    persist=os.getenv("INSIGHTS_CACHE_PERSIST", "0") == "1",
+)
+
+
+# Upstream HTTP settings
+AI_HTTP_TIMEOUT = float(os.getenv("AI_HTTP_TIMEOUT", "30"))
+AI_HTTP_MAX_CONNECTIONS = int(os.getenv("AI_HTTP_MAX_CONNECTIONS", "20"))
+AI_HTTP_MAX_KEEPALIVE = int(os.getenv("AI_HTTP_MAX_KEEPALIVE", "10"))
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", "8"))  # in-flight calls per provider
+AI_HTTP2 = os.getenv("AI_HTTP2", "1") == "1"
+
+# Budget for the data section of the insight prompt, in estimated tokens
+INSIGHTS_PROMPT_TOKENS = int(os.getenv("INSIGHTS_PROMPT_TOKENS", "600"))
+
+try:
+    import h2  # noqa: F401  (httpx needs it for HTTP/2)
+    _HTTP2_AVAILABLE = True
+except ImportError:
+    _HTTP2_AVAILABLE = False
+
+
+class _PooledAIClient:
+    """Base for provider clients: one long-lived, keep-alive HTTP pool per client.
+
+    The pool is opened lazily (or by open() at startup) and reused for every
+    call, so requests skip DNS, TCP and TLS setup. A semaphore caps how many
+    calls are in flight upstream at once.
+    """
+
+    prompt_intro = "Analyze the user's habit tracking data and provide personalized insights."
+
+    def __init__(self):
+        self._http: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def open(self):
+        """Create the HTTP pool if it is not open yet."""
+        if self._http is None:
+            self._http = httpx.AsyncClient(
+                timeout=AI_HTTP_TIMEOUT,
+                http2=AI_HTTP2 and _HTTP2_AVAILABLE,
+                limits=httpx.Limits(
+                    max_connections=AI_HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=AI_HTTP_MAX_KEEPALIVE,
+                ),
+            )
+            self._semaphore = asyncio.Semaphore(AI_MAX_CONCURRENCY)
+
+    async def aclose(self):
+        """Close the HTTP pool and its connections."""
+        if self._http is not None:
+            http, self._http = self._http, None
+            await http.aclose()
+
+    async def _post(self, url: str, headers: Dict[str, str], payload: Dict[str, Any]) -> httpx.Response:
+        """POST through the shared pool, waiting for a concurrency slot."""
+        await self.open()
+        async with self._semaphore:
+            return await self._http.post(url, headers=headers, json=payload)
+
+    async def _post_sse(self, url: str, headers: Dict[str, str], payload: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        """POST through the shared pool and yield each JSON `data:` event of the SSE reply."""
+        await self.open()
+        async with self._semaphore:
+            async with self._http.stream("POST", url, headers=headers, json=payload) as response:
+                if response.status_code != 200:
+                    body = await response.aread()
+                    raise RuntimeError(f"{response.status_code} - {body.decode(errors='replace')}")
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if not data or data == "[DONE]":
+                        continue
+                    yield json.loads(data)
+
+    async def get_habit_insights(self, habit_data: Dict[str, Any], data_version: int = None) -> str:
+        """Generate AI insights from habit data, served from cache when the prompt is unchanged."""
+        started = time.perf_counter()
+        try:
+            prompt = self._build_insight_prompt(habit_data)
+            return await insights_cache.get_or_generate(
+                self.provider, self.model, prompt, self._timed_generate, data_version
+            )
+        finally:
+            ai_insights_seconds.observe(time.perf_counter() - started, self.provider)
+
+    async def _timed_generate(self, prompt: str) -> str:
+        """Call _generate, recording the upstream call's duration and outcome."""
+        started = time.perf_counter()
+        insights = await self._generate(prompt)
+        outcome = "ok" if insights and insights != INSIGHTS_UNAVAILABLE else "error"
+        ai_upstream_seconds.observe(time.perf_counter() - started, self.provider, outcome)
+        return insights
+
+    async def stream_habit_insights(self, habit_data: Dict[str, Any], data_version: int = None) -> AsyncIterator[str]:
+        """Yield insight text as the provider generates it; cached answers come back whole.
+
+        Concurrent calls for the same prompt share one upstream stream.
+        """
         prompt = self._build_insight_prompt(habit_data)
-
+        key = insights_cache.make_key(self.provider, self.model, prompt)
+
+        insights = await insights_cache.get(key)
+        if insights is None and insights_cache.flight.running(key):
+            # A non-streaming call is already generating this answer
+            insights = await insights_cache.get_or_generate(self.provider, self.model, prompt, self._timed_generate)
+            yield insights
+            if insights == INSIGHTS_UNAVAILABLE:
+                return
+        elif insights is None:
+            async for text in insights_cache.streams.stream(key, lambda: self._stream_and_cache(prompt, key)):
+                yield text
+            # Only a completed answer was cached
+            if await insights_cache.get(key) is None:
+                return
+        else:
+            yield insights
+
+        if data_version is not None:
+            insights_cache.remember_version(self.provider, self.model, data_version, key)
+
+    async def _stream_and_cache(self, prompt: str, key: str) -> AsyncIterator[str]:
+        """Stream _generate_stream's text, recording the upstream call and caching the complete answer."""
+        parts = []
+        started = time.perf_counter()
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(
-                    self.base_url,
-                    headers={
-                        "Authorization": f"Bearer {self.api_key}",
-                        "Content-Type": "application/json",
-                        "anthropic-version": "2023-06-01"
-                    },
-                    json={
-                        "model": "glm-4.7",
-                        "max_tokens": 1000,
-                        "messages": [
-                            {
-                                "role": "user",
-                                "content": prompt
-                            }
-                        ]
-                    }
-                )
-
-                if response.status_code == 200:
-                    result = response.json()
-                    return result.get("content", [{}])[0].get("text", "No insights generated")
-                else:
-                    print(f"GLM API error: {response.status_code} - {response.text}")
-                    return "Unable to generate insights at this time."
-
+            async for text in self._generate_stream(prompt):
+                parts.append(text)
+                yield text
         except Exception as e:
-            print(f"Error calling GLM API: {e}")
-            return "Unable to generate insights at this time."
+            ai_upstream_seconds.observe(time.perf_counter() - started, self.provider, "error")
+            print(f"Error streaming {self.provider} API: {e}")
+            if not parts:
+                yield INSIGHTS_UNAVAILABLE
+            return
+        ai_upstream_seconds.observe(time.perf_counter() - started, self.provider, "ok")
+        insights = "".join(parts)
+        if insights:
+            await insights_cache.put(key, insights)
 
     def _build_insight_prompt(self, habit_data: Dict[str, Any]) -> str:
         """Build the prompt for AI analysis."""
-        habits = habit_data.get("habits", [])
-        stats = habit_data.get("stats", {})
-        logs = habit_data.get("logs", [])
-        streaks = habit_data.get("streaks", [])
-        weekly_goals = habit_data.get("weekly_goals", [])
-
-        prompt = """You are a helpful habit coach. Analyze the user's habit tracking data and provide personalized insights.
+        data = summarize_habit_data(habit_data, INSIGHTS_PROMPT_TOKENS)
+        return f"""{self.prompt_intro}
 
 DATA:
-"""
-
-        # Add habit names
-        if habits:
-            habit_names = ", ".join([h["name"] for h in habits])
-            prompt += f"\nActive habits: {habit_names}\n"
-
-        # Add overall stats
-        if stats:
-            prompt += f"\nOverall completion rate: {stats.get('completion_rate', 0)}%\n"
-            prompt += f"Total logged activities: {stats.get('total_logs', 0)}\n"
-            prompt += f"Completed activities: {stats.get('completed', 0)}\n"
-
-        # Add streaks
-        if streaks:
-            prompt += "\nCurrent streaks:\n"
-            for s in streaks:
-                if s.get("current_streak", 0) > 0:
-                    prompt += f"- {s['name']}: {s['current_streak']} days\n"
-
-        # Add recent activity patterns
-        if logs:
-            prompt += "\nRecent activity patterns:\n"
-            for log in logs[:10]:  # Last 10 activities
-                date = log.get("date", "")
-                habit = log.get("habit_name", "Unknown")
-                completed = "✓" if log.get("completed") else "✗"
-                prompt += f"- {date}: {completed} {habit}\n"
-
-        # Add weekly goals
-        if weekly_goals:
-            prompt += "\nWeekly goals:\n"
-            for goal in weekly_goals:
-                habit_name = goal.get("habit_name", "Unknown")
-                goal_date = goal.get("goal_date", "")
-                target = goal.get("target", 0)
-                completed = goal.get("completed", 0)
-                achieved = "✓" if goal.get("achieved") else "✗"
-                prompt += f"- {goal_date}: {achieved} {habit_name} (Target: {completed}/{target})\n"
-
-        prompt += """
+{data}
 TASK:
 Based on this data, provide a concise, actionable analysis. Include:
 
 1. **Strengths**: What patterns show good consistency?
-2. **Patterns**: Any noticeable trends (day-of-week, time-based)?
+2. **Patterns**: Any noticeable trends (day-of-week, recent direction)?
 3. **Goal Progress**: How well are you meeting your weekly goals?
 4. **Recommendations**: 2-3 specific suggestions to improve goal achievement.
 5. **Encouragement**: A brief motivational note.
@@ -110,124 +390,167 @@ Keep it friendly, concise, and action-oriented. Avoid generic advice.
 
 Format your response with clear headings and bullet points."""
 
-        return prompt
 
+class GLMClient(_PooledAIClient):
+    """GLM API client for habit insights."""
 
-class QwenClient:
-    """Qwen API client for habit insights."""
+    provider = "glm"
+    prompt_intro = "You are a helpful habit coach. Analyze the user's habit tracking data and provide personalized insights."
 
-    def __init__(self, api_key: str, model: str = "qwen-plus"):
+    def __init__(self, api_key: str, model: str = "glm-4.7"):
+        super().__init__()
         self.api_key = api_key
         self.model = model
-        self.base_url = "https://dashscope.aliyuncs.com/api/v1/services/aigc/text-generation/generation"
-
-    async def get_habit_insights(self, habit_data: Dict[str, Any]) -> str:
-        """Generate AI insights from habit data."""
-        prompt = self._build_insight_prompt(habit_data)
+        self.base_url = "https://open.bigmodel.cn/api/anthropic/v1/messages"
 
+    async def _generate(self, prompt: str) -> str:
+        """Call the GLM API for a prompt."""
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(
-                    self.base_url,
-                    headers={
-                        "Authorization": f"Bearer {self.api_key}",
-                        "Content-Type": "application/json"
-                    },
-                    json={
-                        "model": self.model,
-                        "input": {
-                            "messages": [
-                                {
-                                    "role": "system",
-                                    "content": "You are a helpful habit coach. Analyze the user's habit tracking data and provide personalized insights. Be concise and action-oriented. Keep it friendly and encouraging."
-                                },
-                                {
-                                    "role": "user",
-                                    "content": prompt
-                                }
-                            ]
-                        },
-                        "parameters": {
-                            "result_format": "message"
+            response = await self._post(
+                self.base_url,
+                headers={
+                    "Authorization": f"Bearer {self.api_key}",
+                    "Content-Type": "application/json",
+                    "anthropic-version": "2023-06-01"
+                },
+                payload={
+                    "model": self.model,
+                    "max_tokens": 1000,
+                    "messages": [
+                        {
+                            "role": "user",
+                            "content": prompt
                         }
-                    }
-                )
+                    ]
+                }
+            )
 
-                if response.status_code == 200:
-                    result = response.json()
-                    output = result.get("output", {}).get("text", "")
-                    return output
-                else:
-                    print(f"Qwen API error: {response.status_code} - {response.text}")
-                    return "Unable to generate insights at this time."
+            if response.status_code == 200:
+                result = response.json()
+                return result.get("content", [{}])[0].get("text", "No insights generated")
+            else:
+                print(f"GLM API error: {response.status_code} - {response.text}")
+                return INSIGHTS_UNAVAILABLE
 
         except Exception as e:
-            print(f"Error calling Qwen API: {e}")
-            return "Unable to generate insights at this time."
+            print(f"Error calling GLM API: {e}")
+            return INSIGHTS_UNAVAILABLE
+
+    async def _generate_stream(self, prompt: str) -> AsyncIterator[str]:
+        """Stream text deltas from the GLM API (Anthropic-style SSE)."""
+        events = self._post_sse(
+            self.base_url,
+            headers={
+                "Authorization": f"Bearer {self.api_key}",
+                "Content-Type": "application/json",
+                "anthropic-version": "2023-06-01"
+            },
+            payload={
+                "model": self.model,
+                "max_tokens": 1000,
+                "stream": True,
+                "messages": [
+                    {
+                        "role": "user",
+                        "content": prompt
+                    }
+                ]
+            }
+        )
+        async for event in events:
+            if event.get("type") == "content_block_delta":
+                text = event.get("delta", {}).get("text")
+                if text:
+                    yield text
 
-    def _build_insight_prompt(self, habit_data: Dict[str, Any]) -> str:
-        """Build the prompt for AI analysis."""
-        habits = habit_data.get("habits", [])
-        stats = habit_data.get("stats", {})
-        logs = habit_data.get("logs", [])
-        streaks = habit_data.get("streaks", [])
-        weekly_goals = habit_data.get("weekly_goals", [])
-
-        prompt = "Analyze the user's habit tracking data and provide personalized insights.\n\nDATA:\n\n"
-
-        # Add habit names
-        if habits:
-            habit_names = ", ".join([h["name"] for h in habits])
-            prompt += f"Active habits: {habit_names}\n"
-
-        # Add overall stats
-        if stats:
-            prompt += f"Overall completion rate: {stats.get('completion_rate', 0)}%\n"
-            prompt += f"Total logged activities: {stats.get('total_logs', 0)}\n"
-            prompt += f"Completed activities: {stats.get('completed', 0)}\n"
-
-        # Add streaks
-        if streaks:
-            prompt += "Current streaks:\n"
-            for s in streaks:
-                if s.get("current_streak", 0) > 0:
-                    prompt += f"- {s['name']}: {s['current_streak']} days\n"
-
-        # Add recent activity patterns
-        if logs:
-            prompt += "Recent activity patterns:\n"
-            for log in logs[:10]:  # Last 10 activities
-                date = log.get("date", "")
-                habit = log.get("habit_name", "Unknown")
-                completed = "✓" if log.get("completed") else "✗"
-                prompt += f"- {date}: {completed} {habit}\n"
-
-        # Add weekly goals
-        if weekly_goals:
-            prompt += "Weekly goals:\n"
-            for goal in weekly_goals:
-                habit_name = goal.get("habit_name", "Unknown")
-                goal_date = goal.get("goal_date", "")
-                target = goal.get("target", 0)
-                completed = goal.get("completed", 0)
-                achieved = "✓" if goal.get("achieved") else "✗"
-                prompt += f"- {goal_date}: {achieved} {habit_name} (Target: {completed}/{target})\n"
-
-        prompt += """
-TASK:
-Based on this data, provide a concise, actionable analysis. Include:
 
-1. **Strengths**: What patterns show good consistency?
-2. **Patterns**: Any noticeable trends (day-of-week, time-based)?
-3. **Goal Progress**: How well are you meeting your weekly goals?
-4. **Recommendations**: 2-3 specific suggestions to improve goal achievement.
-5. **Encouragement**: A brief motivational note.
+class QwenClient(_PooledAIClient):
+    """Qwen API client for habit insights."""
 
-Keep it friendly, concise, and action-oriented. Avoid generic advice.
+    provider = "qwen"
 
-Format your response with clear headings and bullet points."""
+    def __init__(self, api_key: str, model: str = "qwen-plus"):
+        super().__init__()
+        self.api_key = api_key
+        self.model = model
+        self.base_url = "https://dashscope.aliyuncs.com/api/v1/services/aigc/text-generation/generation"
+
+    async def _generate(self, prompt: str) -> str:
+        """Call the Qwen API for a prompt."""
+        try:
+            response = await self._post(
+                self.base_url,
+                headers={
+                    "Authorization": f"Bearer {self.api_key}",
+                    "Content-Type": "application/json"
+                },
+                payload={
+                    "model": self.model,
+                    "input": {
+                        "messages": [
+                            {
+                                "role": "system",
+                                "content": "You are a helpful habit coach. Analyze the user's habit tracking data and provide personalized insights. Be concise and action-oriented. Keep it friendly and encouraging."
+                            },
+                            {
+                                "role": "user",
+                                "content": prompt
+                            }
+                        ]
+                    },
+                    "parameters": {
+                        "result_format": "message"
+                    }
+                }
+            )
+
+            if response.status_code == 200:
+                result = response.json()
+                output = result.get("output", {}).get("text", "")
+                return output
+            else:
+                print(f"Qwen API error: {response.status_code} - {response.text}")
+                return INSIGHTS_UNAVAILABLE
 
-        return prompt
+        except Exception as e:
+            print(f"Error calling Qwen API: {e}")
+            return INSIGHTS_UNAVAILABLE
+
+    async def _generate_stream(self, prompt: str) -> AsyncIterator[str]:
+        """Stream incremental output from the Qwen API (DashScope SSE)."""
+        events = self._post_sse(
+            self.base_url,
+            headers={
+                "Authorization": f"Bearer {self.api_key}",
+                "Content-Type": "application/json",
+                "X-DashScope-SSE": "enable"
+            },
+            payload={
+                "model": self.model,
+                "input": {
+                    "messages": [
+                        {
+                            "role": "system",
+                            "content": "You are a helpful habit coach. Analyze the user's habit tracking data and provide personalized insights. Be concise and action-oriented. Keep it friendly and encouraging."
+                        },
+                        {
+                            "role": "user",
+                            "content": prompt
+                        }
+                    ]
+                },
+                "parameters": {
+                    "result_format": "message",
+                    "incremental_output": True
+                }
+            }
+        )
+        async for event in events:
+            output = event.get("output", {})
+            choices = output.get("choices")
+            text = choices[0].get("message", {}).get("content") if choices else output.get("text")
+            if text:
+                yield text
 
 # Unified client - chooses between GLM and Qwen
 _ai_client = None
@@ -237,8 +560,6 @@ def get_ai_client():
     """Get or create the AI client singleton (auto-detects provider)."""
     global _ai_client, _provider
     if _ai_client is None:
-        import os
-        
         # Check for explicit provider preference
         provider = os.getenv("AI_PROVIDER", "auto").lower()
         
@@ -266,7 +587,7 @@ def get_ai_client():
                         api_key = glm_config.get("apiKey")
                         model = glm_config.get("defaultModel", "glm-4.7")
                         if api_key:
-                            _ai_client = GLMClient(api_key)
+                            _ai_client = GLMClient(api_key, model)
                             _provider = "glm"
                             print(f"Using GLM provider with model: {model}")
                             return _ai_client
@@ -284,3 +605,8 @@ def get_ai_client():
 def get_active_provider():
     """Get the name of the active AI provider."""
     return _provider or "unknown"
+
+async def close_ai_client():
+    """Close the active client's HTTP pool (call on application shutdown)."""
+    if _ai_client is not None:
+        await _ai_client.aclose()
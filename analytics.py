@@ -0,0 +1,224 @@
+import os
+import base64
+import threading
+from collections import OrderedDict
+from datetime import date
+from typing import List, Dict, Any
+
+import numpy as np
+
+from database import current_db_path, get_completed_days, get_completion_history, get_data_version, read_snapshot
+from features import completion_matrix, completed_days_matrix, completion_rate, ratio, rolling_sum, round_floats, WEEKDAYS
+
+# Correlations need at least this many days on which both habits were tracked
+MIN_CORRELATION_DAYS = 14
+
+
+class HabitMatrix:
+    """Every habit's full history as dense habits×days boolean matrices.
+
+    `done[i, j]` is True when habit i was completed on day start_day + j and
+    `tracked[i, j]` when the habit existed by then. Rows follow `ids`, which
+    are ordered by habit name.
+    """
+
+    def __init__(self, history: Dict[str, Any], data_version: int):
+        self.data_version = data_version
+        self.start_day = history["start_day"]
+        self.end_day = history["end_day"]
+        self.ids = [h[0] for h in history["habits"]]
+        self.names = [h[1] for h in history["habits"]]
+        self.done, self.tracked = completion_matrix(history)
+        self._row_of = {habit_id: i for i, habit_id in enumerate(self.ids)}
+
+    def rows(self, habit_ids: List[int] = None) -> List[int]:
+        """Matrix rows for habit_ids (all habits when None), skipping unknown ids."""
+        if habit_ids is None:
+            return list(range(len(self.ids)))
+        return [self._row_of[habit_id] for habit_id in habit_ids if habit_id in self._row_of]
+
+    def columns(self, days: int = None) -> slice:
+        """Columns covering the last `days` days (all history when None)."""
+        if days is None:
+            return slice(None)
+        return slice(max(self.done.shape[1] - days, 0), None)
+
+    def day(self, column: int) -> str:
+        return date.fromordinal(self.start_day + column).isoformat()
+
+    def habit(self, row: int) -> Dict[str, Any]:
+        return {"id": self.ids[row], "name": self.names[row]}
+
+
+# One matrix per database, rebuilt when its data version or the day changes;
+# the least recently used are dropped beyond ANALYTICS_CACHE_SIZE databases
+ANALYTICS_CACHE_SIZE = int(os.getenv("ANALYTICS_CACHE_SIZE", "16"))
+_matrices: Dict[str, HabitMatrix] = OrderedDict()
+_matrix_lock = threading.Lock()
+
+def _is_current(matrix: HabitMatrix, data_version: int) -> bool:
+    return matrix.end_day == date.today().toordinal() and matrix.data_version == data_version
+
+def get_matrix() -> HabitMatrix:
+    """Get the current database's habit matrix, loading it again only after a write or at midnight."""
+    path = current_db_path()
+    matrix = _matrices.get(path)
+    if matrix is None or not _is_current(matrix, get_data_version()):
+        with _matrix_lock:
+            with read_snapshot():
+                data_version = get_data_version()
+                matrix = _matrices.get(path)
+                if matrix is None or not _is_current(matrix, data_version):
+                    matrix = HabitMatrix(get_completion_history(days=None), data_version)
+                    _matrices[path] = matrix
+    with _matrix_lock:
+        if path in _matrices:
+            _matrices.move_to_end(path)
+        while len(_matrices) > ANALYTICS_CACHE_SIZE:
+            _matrices.popitem(last=False)
+    return matrix
+
+
+# Queries; each answers from the cached matrix without touching SQL
+def completion_rates(days: int = 30, habit_ids: List[int] = None) -> List[Dict[str, Any]]:
+    """Per-habit completed and tracked days, and their ratio, over the last `days` days."""
+    m = get_matrix()
+    rows, cols = m.rows(habit_ids), m.columns(days)
+    done, tracked = m.done[rows, cols], m.tracked[rows, cols]
+    completed, total = done.sum(axis=1), tracked.sum(axis=1)
+    rates = round_floats(completion_rate(done, tracked))
+    return [
+        dict(m.habit(row), completed=int(completed[i]), tracked=int(total[i]), rate=rates[i])
+        for i, row in enumerate(rows)
+    ]
+
+
+def year_heatmap(year: int, habit_id: int = None) -> Dict[str, Any]:
+    """Completions per day of a calendar year, for one habit or summed over all habits.
+
+    Days are listed from January 1st; `tracked` counts the habits that
+    existed on each day, so the two lists give a daily completion rate.
+    """
+    m = get_matrix()
+    first = date(year, 1, 1).toordinal()
+    n_days = date(year, 12, 31).toordinal() - first + 1
+    completed = np.zeros(n_days, dtype=np.int64)
+    tracked = np.zeros(n_days, dtype=np.int64)
+
+    # Overlap of the year with the matrix's columns
+    lo, hi = max(first, m.start_day), min(first + n_days - 1, m.end_day)
+    rows = m.rows([habit_id] if habit_id is not None else None)
+    if lo <= hi and rows:
+        cols = slice(lo - m.start_day, hi - m.start_day + 1)
+        completed[lo - first:hi - first + 1] = m.done[rows, cols].sum(axis=0)
+        tracked[lo - first:hi - first + 1] = m.tracked[rows, cols].sum(axis=0)
+
+    return {
+        "year": year,
+        "start": date(year, 1, 1).isoformat(),
+        "habit_id": habit_id,
+        "completed": completed.tolist(),
+        "tracked": tracked.tolist()
+    }
+
+
+def rolling_rates(window: int = 7, days: int = 90, habit_ids: List[int] = None) -> Dict[str, Any]:
+    """Trailing `window`-day completion rate for each of the last `days` days, per habit."""
+    m = get_matrix()
+    rows = m.rows(habit_ids)
+    # Sum over window + days columns so the first reported day has a full window
+    cols = m.columns(days + window - 1)
+    done = m.done[rows, cols].astype(np.float64)
+    tracked = m.tracked[rows, cols].astype(np.float64)
+    rates = ratio(rolling_sum(done, window)[:, -days:], rolling_sum(tracked, window)[:, -days:])
+    first_column = m.done.shape[1] - rates.shape[1]
+    return {
+        "window": window,
+        "start": m.day(first_column),
+        "habits": [dict(m.habit(row), rates=round_floats(rates[i])) for i, row in enumerate(rows)]
+    }
+
+
+def weekday_profile(days: int = None, habit_ids: List[int] = None) -> Dict[str, Any]:
+    """Completion rate by day of week, per habit and across the selected habits."""
+    m = get_matrix()
+    rows, cols = m.rows(habit_ids), m.columns(days)
+    done, tracked = m.done[rows, cols].astype(np.float64), m.tracked[rows, cols].astype(np.float64)
+
+    # Day numbers are ordinals, and ordinal 1 was a Monday
+    n_days = done.shape[1]
+    weekday = (m.start_day + m.done.shape[1] - n_days + np.arange(n_days) - 1) % 7
+    onehot = (weekday[:, None] == np.arange(7)).astype(np.float64)
+    done_by_weekday, tracked_by_weekday = done @ onehot, tracked @ onehot
+    rates = ratio(done_by_weekday, tracked_by_weekday)
+    overall = ratio(done_by_weekday.sum(axis=0), tracked_by_weekday.sum(axis=0))
+    return {
+        "weekdays": WEEKDAYS,
+        "overall": round_floats(overall),
+        "habits": [dict(m.habit(row), rates=round_floats(rates[i])) for i, row in enumerate(rows)]
+    }
+
+
+def correlations(days: int = 90, habit_ids: List[int] = None, limit: int = 20) -> Dict[str, Any]:
+    """Pearson correlation of daily completion between every pair of habits.
+
+    Each pair is compared only over days on which both were tracked, using
+    matrix products, so all pairs come out of a handful of BLAS calls.
+    Returns the `limit` strongest pairs by absolute correlation.
+    """
+    m = get_matrix()
+    rows, cols = m.rows(habit_ids), m.columns(days)
+    x = m.done[rows, cols].astype(np.float32)
+    t = m.tracked[rows, cols].astype(np.float32)
+
+    # For binary data sum(x^2) == sum(x), so three products give every pairwise sum
+    n = t @ t.T
+    sx = x @ t.T            # sx[i, j]: days i was done while j was tracked
+    sy = sx.T
+    sxy = x @ x.T
+    var_x = n * sx - sx * sx
+    var_y = n * sy - sy * sy
+    denom = np.sqrt(np.maximum(var_x * var_y, 0))
+    valid = (n >= MIN_CORRELATION_DAYS) & (denom > 0)
+    r = np.divide(n * sxy - sx * sy, denom, out=np.zeros_like(denom), where=valid)
+
+    upper = np.triu(valid, k=1)
+    i, j = np.nonzero(upper)
+    order = np.argsort(-np.abs(r[i, j]), kind="stable")[:limit]
+    return {
+        "days": days,
+        "pairs": [
+            {
+                "habit_a": m.habit(rows[i[k]]),
+                "habit_b": m.habit(rows[j[k]]),
+                "correlation": round(float(r[i[k], j[k]]), 3),
+                "days_compared": int(n[i[k], j[k]])
+            }
+            for k in order
+        ]
+    }
+
+
+def calendar_bitmaps(start: date, end: date) -> Dict[str, Any]:
+    """Every habit's completions from start to end as a base64 bitmap, one bit per day.
+
+    Bit i (least significant bit first within each byte) is set when the
+    habit was completed on start + i days. Habit metadata is listed once.
+    Only the requested range is read, rather than the full-history matrix,
+    so drawing a week right after a write stays cheap.
+    """
+    history = get_completed_days(start.isoformat(), end.isoformat())
+    habits = history["habits"]
+    n_days = history["end_day"] - history["start_day"] + 1
+    ids = np.array([h[0] for h in habits], dtype=np.int64)
+    bits = completed_days_matrix(ids, history["completed"], history["start_day"], n_days)
+    packed = np.packbits(bits, axis=1, bitorder="little")
+    return {
+        "start": start.isoformat(),
+        "days": n_days,
+        "habits": [
+            {"id": habit_id, "name": name, "color": color,
+             "completed": base64.b64encode(packed[row].tobytes()).decode("ascii")}
+            for row, (habit_id, name, color) in enumerate(habits)
+        ]
+    }
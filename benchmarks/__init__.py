@@ -0,0 +1,11 @@
+"""Reproducible benchmarks for the Habit Tracker API.
+
+generate.py fills a database with seeded synthetic data at a chosen scale;
+harness.py drives every route of main.app against it in-process and
+compares the latencies with a stored baseline. Run both from the
+repository root:
+
+    python -m benchmarks.generate --db bench.db --habits 50 --years 3 --goals 2000
+    python -m benchmarks.harness --db bench.db --save-baseline benchmarks/baseline.json
+    python -m benchmarks.harness --db bench.db --baseline benchmarks/baseline.json
+"""
@@ -0,0 +1,139 @@
+"""Seeded synthetic data generator for benchmarks.
+
+Fills a fresh database with N habits, M years of daily habit_logs and K
+goals. The same seed, scale and end date always produce the same rows, so
+benchmark runs on different machines or commits see identical data.
+"""
+import os
+import sys
+import random
+import argparse
+from datetime import date, timedelta
+from typing import Dict, Any, Iterator, Tuple
+
+import database
+from database import use_database, get_connection, rebuild_streaks, archive_cold_logs
+
+COLORS = ["#007bff", "#28a745", "#dc3545", "#ffc107", "#17a2b8", "#6f42c1", "#fd7e14", "#20c997"]
+NAMES = ["Exercise", "Read", "Meditate", "Code", "Journal", "Walk", "Stretch", "Study",
+         "Cook", "Sleep early", "Drink water", "Practice guitar", "Language lesson", "No sugar"]
+
+LOGGED_RATE = 0.85    # share of days with a log row for a habit
+NOTES_RATE = 0.05     # share of log rows with a note
+
+
+def _habit_profile(rng: random.Random) -> Tuple[float, list]:
+    """Base completion probability and a per-weekday multiplier for one habit."""
+    base = rng.uniform(0.2, 0.9)
+    weekdays = [rng.uniform(0.6, 1.2) for _ in range(7)]
+    return base, weekdays
+
+
+def _log_rows(rng: random.Random, habit_ids: list, start: date, n_days: int) -> Iterator[tuple]:
+    """Yield (habit_id, date, completed, notes) rows day by day for every habit."""
+    for habit_id in habit_ids:
+        base, weekdays = _habit_profile(rng)
+        # Habits drift slowly up or down over the period
+        drift = rng.uniform(-0.2, 0.2) / max(n_days, 1)
+        for offset in range(n_days):
+            if rng.random() >= LOGGED_RATE:
+                continue
+            day = start + timedelta(days=offset)
+            p = min(max((base + drift * offset) * weekdays[day.weekday()], 0.0), 1.0)
+            completed = int(rng.random() < p)
+            notes = f"note {rng.randrange(1000)}" if rng.random() < NOTES_RATE else None
+            yield habit_id, day.isoformat(), completed, notes
+
+
+def _goal_rows(rng: random.Random, habit_ids: list, start: date, end: date, count: int) -> Iterator[tuple]:
+    """Yield (habit_id, goal_date, target_count, notes) rows, including the week after end."""
+    span = (end - start).days + 8
+    for _ in range(count):
+        goal_date = start + timedelta(days=rng.randrange(span))
+        yield rng.choice(habit_ids), goal_date.isoformat(), 1, None
+
+
+def generate(path: str, habits: int = 20, years: float = 2, goals: int = 500,
+             seed: int = 0, end: date = None, archive_after_days: int = None) -> Dict[str, Any]:
+    """Create the database at path and fill it; returns the row counts written.
+
+    The path must not exist yet. Logs run up to `end` (today by default).
+    With archive_after_days, logs older than that many days before `end`
+    are then compacted into the cold-history archive by archive_cold_logs().
+    """
+    if os.path.exists(path):
+        raise FileExistsError(f"{path} already exists")
+    rng = random.Random(seed)
+    end = end or date.today()
+    n_days = max(int(years * 365), 1)
+    start = end - timedelta(days=n_days - 1)
+    created_at = f"{start.isoformat()} 00:00:00"
+
+    with use_database(path):
+        database.init_db()
+        conn = get_connection()
+        with conn:
+            conn.executemany(
+                "INSERT INTO habits (id, name, color, created_at) VALUES (?, ?, ?, ?)",
+                [
+                    (i, f"{NAMES[(i - 1) % len(NAMES)]} {(i - 1) // len(NAMES) + 1}",
+                     COLORS[(i - 1) % len(COLORS)], created_at)
+                    for i in range(1, habits + 1)
+                ]
+            )
+        habit_ids = list(range(1, habits + 1))
+        with conn:
+            cursor = conn.executemany(
+                "INSERT INTO habit_logs (habit_id, date, completed, notes) VALUES (?, ?, ?, ?)",
+                _log_rows(rng, habit_ids, start, n_days)
+            )
+            n_logs = cursor.rowcount
+        with conn:
+            conn.executemany(
+                "INSERT INTO goals (habit_id, goal_date, target_count, notes) VALUES (?, ?, ?, ?)",
+                _goal_rows(rng, habit_ids, start, end, goals) if habit_ids else []
+            )
+        rebuild_streaks()
+        archived = 0
+        if archive_after_days is not None:
+            horizon = archive_after_days + (date.today() - end).days
+            archived = archive_cold_logs(max(horizon, 0))["archived_logs"]
+            conn.execute("VACUUM")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    return {"habits": habits, "logs": n_logs, "goals": goals if habit_ids else 0, "archived": archived,
+            "start": start.isoformat(), "end": end.isoformat()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fill a database with seeded synthetic habit data.")
+    parser.add_argument("--db", default="bench.db", help="database file to create (default: bench.db)")
+    parser.add_argument("--habits", type=int, default=20, help="number of habits (N)")
+    parser.add_argument("--years", type=float, default=2, help="years of daily logs per habit (M)")
+    parser.add_argument("--goals", type=int, default=500, help="number of goals (K)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--end-date", type=date.fromisoformat, default=None,
+                        help="last logged day, YYYY-MM-DD (default: today)")
+    parser.add_argument("--archive-after-days", type=int, default=None,
+                        help="archive logs older than this many days before the end date (default: none)")
+    parser.add_argument("--force", action="store_true", help="replace the database if it exists")
+    args = parser.parse_args(argv)
+
+    if args.force:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(args.db + suffix):
+                os.remove(args.db + suffix)
+    try:
+        counts = generate(args.db, args.habits, args.years, args.goals, args.seed, args.end_date,
+                          args.archive_after_days)
+    except FileExistsError as e:
+        sys.exit(f"{e}; pass --force to replace it")
+    database.close_connections()
+    print(f"Wrote {counts['habits']} habits, {counts['logs']} logs and {counts['goals']} goals "
+          f"({counts['start']} to {counts['end']}) to {args.db}")
+    if args.archive_after_days is not None:
+        print(f"Archived {counts['archived']} logs older than {args.archive_after_days} days")
+
+
+if __name__ == "__main__":
+    main()
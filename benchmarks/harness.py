@@ -0,0 +1,377 @@
+"""Benchmark every API route in-process and check for regressions.
+
+The app runs in this process behind httpx's ASGI transport, against a
+private copy of a generated database, with StubAIClient as the AI
+provider. Each route gets a warmup, then a fixed number of requests at the
+chosen concurrency; the report lists p50/p95/p99 latency, throughput and
+the process's peak RSS. With --baseline, a p95 latency or throughput worse
+than the baseline by more than --threshold fails the run (exit status 1).
+"""
+import io
+import math
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import resource
+import tempfile
+import contextlib
+from datetime import date, timedelta
+from typing import List, Dict, Any, Callable, Awaitable, Optional
+
+# The app reads these at import time: no background insight refreshes
+# competing with measured requests, and a single database
+os.environ.setdefault("INSIGHTS_REFRESH_POLL", "0")
+os.environ.pop("TENANT_DIR", None)
+
+import httpx
+
+import database
+from benchmarks import stub_ai
+
+BULK_ROWS = 100   # rows per /api/logs/bulk request
+
+
+class Scenario:
+    """One benchmarked request shape for a route.
+
+    build(ctx, i) returns the keyword arguments for client.request() for the
+    i-th request. prepare(client, ctx, n), when given, runs before timing
+    and returns n items (e.g. ids to delete) that build finds in ctx["items"].
+    """
+
+    def __init__(self, name: str, method: str, route: str,
+                 build: Callable[[Dict[str, Any], int], Dict[str, Any]],
+                 prepare: Callable[[httpx.AsyncClient, Dict[str, Any], int], Awaitable[list]] = None,
+                 expect: int = 200):
+        self.name = name
+        self.method = method
+        self.route = route
+        self.build = build
+        self.prepare = prepare
+        self.expect = expect
+
+
+def _get(path: str, **params) -> Callable[[Dict[str, Any], int], Dict[str, Any]]:
+    """Build a fixed GET request; callable params are evaluated against ctx."""
+    def build(ctx, i):
+        values = {k: v(ctx) if callable(v) else v for k, v in params.items()}
+        return {"method": "GET", "url": path, "params": values}
+    return build
+
+
+def _days_ago(days: int) -> Callable[[Dict[str, Any]], str]:
+    return lambda ctx: (ctx["today"] - timedelta(days=days)).isoformat()
+
+
+def _random_habit(ctx) -> int:
+    return ctx["rng"].choice(ctx["habit_ids"])
+
+
+def _random_day(ctx) -> str:
+    return (ctx["today"] - timedelta(days=ctx["rng"].randrange(365))).isoformat()
+
+
+async def _current_etag(client, ctx, n):
+    response = await client.get("/api/habits")
+    return [response.headers["etag"]] * n
+
+
+async def _new_habits(client, ctx, n):
+    return [(await client.post("/api/habits", json={"name": f"bench {i}"})).json()["id"] for i in range(n)]
+
+
+async def _new_goals(client, ctx, n):
+    today = ctx["today"].isoformat()
+    return [
+        (await client.post("/api/goals", json={"habit_id": _random_habit(ctx), "goal_date": today})).json()["id"]
+        for _ in range(n)
+    ]
+
+
+def _bulk_body(ctx, i):
+    rows = [{"habit_id": _random_habit(ctx), "date": _random_day(ctx), "completed": ctx["rng"].random() < 0.7}
+            for _ in range(BULK_ROWS)]
+    return {"method": "POST", "url": "/api/logs/bulk", "json": rows}
+
+
+# Reads run first, against unchanged data; writes follow
+SCENARIOS = [
+    Scenario("index", "GET", "/", _get("/")),
+    Scenario("dashboard", "GET", "/api/dashboard", _get("/api/dashboard")),
+    Scenario("habits", "GET", "/api/habits", _get("/api/habits")),
+    Scenario("habits 304", "GET", "/api/habits",
+             lambda ctx, i: {"method": "GET", "url": "/api/habits",
+                             "headers": {"If-None-Match": ctx["items"][i]}},
+             prepare=_current_etag, expect=304),
+    Scenario("logs", "GET", "/api/logs", _get("/api/logs", days=30, limit=100)),
+    Scenario("habit logs", "GET", "/api/habits/{habit_id}/logs",
+             lambda ctx, i: _get(f"/api/habits/{_random_habit(ctx)}/logs", days=30, limit=100)(ctx, i)),
+    Scenario("habit logs all time", "GET", "/api/habits/{habit_id}/logs",
+             lambda ctx, i: _get(f"/api/habits/{_random_habit(ctx)}/logs", days=36500, limit=1000)(ctx, i)),
+    Scenario("goals", "GET", "/api/goals", _get("/api/goals", start_date=_days_ago(30), end_date=_days_ago(0))),
+    Scenario("weekly goals", "GET", "/api/goals/weekly", _get("/api/goals/weekly")),
+    Scenario("goals progress", "GET", "/api/goals/progress",
+             _get("/api/goals/progress", start_date=_days_ago(30), end_date=_days_ago(0))),
+    Scenario("goal progress", "GET", "/api/goals/{goal_id}/progress",
+             lambda ctx, i: _get(f"/api/goals/{ctx['rng'].choice(ctx['goal_ids'])}/progress")(ctx, i)),
+    Scenario("export", "GET", "/api/export", _get("/api/export", format="ndjson")),
+    Scenario("analytics rates", "GET", "/api/analytics/rates", _get("/api/analytics/rates", days=30)),
+    Scenario("analytics heatmap", "GET", "/api/analytics/heatmap",
+             _get("/api/analytics/heatmap", year=lambda ctx: ctx["today"].year)),
+    Scenario("analytics rolling", "GET", "/api/analytics/rolling", _get("/api/analytics/rolling", window=7, days=90)),
+    Scenario("analytics weekdays", "GET", "/api/analytics/weekdays", _get("/api/analytics/weekdays")),
+    Scenario("analytics correlations", "GET", "/api/analytics/correlations",
+             _get("/api/analytics/correlations", days=90)),
+    Scenario("calendar", "GET", "/api/calendar", _get("/api/calendar", start=_days_ago(27), end=_days_ago(0))),
+    Scenario("stats", "GET", "/api/stats", _get("/api/stats", days=30)),
+    Scenario("stats all time", "GET", "/api/stats", _get("/api/stats", days=36500)),
+    Scenario("stats weekly", "GET", "/api/stats/{period}", _get("/api/stats/week")),
+    Scenario("streaks", "GET", "/api/streaks", _get("/api/streaks")),
+    Scenario("insights", "GET", "/api/insights", _get("/api/insights")),
+    Scenario("insights stream", "GET", "/api/insights/stream", _get("/api/insights/stream")),
+    Scenario("insights metrics", "GET", "/api/insights/metrics", _get("/api/insights/metrics")),
+    Scenario("metrics", "GET", "/metrics", _get("/metrics")),
+    Scenario("log habit", "POST", "/api/logs",
+             lambda ctx, i: {"method": "POST", "url": "/api/logs",
+                             "json": {"habit_id": _random_habit(ctx), "date": _random_day(ctx),
+                                      "completed": ctx["rng"].random() < 0.7}}),
+    Scenario("bulk logs", "POST", "/api/logs/bulk", _bulk_body),
+    Scenario("create habit", "POST", "/api/habits",
+             lambda ctx, i: {"method": "POST", "url": "/api/habits", "json": {"name": f"new {i}"}}),
+    Scenario("create goal", "POST", "/api/goals",
+             lambda ctx, i: {"method": "POST", "url": "/api/goals",
+                             "json": {"habit_id": _random_habit(ctx), "goal_date": _days_ago(0)(ctx)}}),
+    Scenario("delete goal", "DELETE", "/api/goals/{goal_id}",
+             lambda ctx, i: {"method": "DELETE", "url": f"/api/goals/{ctx['items'][i]}"},
+             prepare=_new_goals),
+    Scenario("delete habit", "DELETE", "/api/habits/{habit_id}",
+             lambda ctx, i: {"method": "DELETE", "url": f"/api/habits/{ctx['items'][i]}"},
+             prepare=_new_habits),
+]
+
+
+def uncovered_routes(app, scenarios: List[Scenario]) -> List[str]:
+    """Routes of app that no scenario exercises."""
+    from fastapi.routing import APIRoute
+    covered = {(s.method, s.route) for s in scenarios}
+    return [
+        f"{method} {route.path}"
+        for route in app.routes if isinstance(route, APIRoute)
+        for method in sorted(route.methods) if (method, route.path) not in covered
+    ]
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return float("nan")
+    rank = max(math.ceil(q / 100 * len(sorted_values)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process so far (ru_maxrss is KiB on Linux, bytes on macOS)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+async def measure(client: httpx.AsyncClient, scenario: Scenario, ctx: Dict[str, Any],
+                  requests: int, concurrency: int, warmup: int) -> Dict[str, Any]:
+    """Run one scenario and summarise its latencies."""
+    ctx = dict(ctx, rng=random.Random(f"{ctx['seed']}:{scenario.name}"))
+    if scenario.prepare:
+        ctx["items"] = await scenario.prepare(client, ctx, warmup + requests)
+    for i in range(warmup):
+        await client.request(**scenario.build(ctx, i))
+
+    latencies: List[float] = []
+    errors = 0
+    indexes = iter(range(warmup, warmup + requests))
+
+    async def worker():
+        nonlocal errors
+        for i in indexes:
+            kwargs = scenario.build(ctx, i)
+            started = time.perf_counter()
+            response = await client.request(**kwargs)
+            latencies.append((time.perf_counter() - started) * 1000)
+            if response.status_code != scenario.expect:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": requests,
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "rps": round(requests / elapsed, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+async def run(db: str, scenarios: List[Scenario], requests: int, concurrency: int, warmup: int,
+              repeat: int, seed: int, ai_latency: float, verbose: bool = False) -> Dict[str, Any]:
+    """Benchmark scenarios against a copy of db; returns the results document.
+
+    Each scenario is measured `repeat` times and the run with the lowest p95
+    is kept, which filters out most interference from the rest of the machine.
+    """
+    import main  # Imported here so the environment above is in place first
+
+    missing = uncovered_routes(main.app, SCENARIOS)
+    if missing:
+        print(f"warning: routes without a scenario: {', '.join(missing)}", file=sys.stderr)
+
+    workdir = tempfile.mkdtemp(prefix="habit-bench-")
+    database.DB_PATH = os.path.join(workdir, "bench.db")
+    shutil.copyfile(db, database.DB_PATH)
+    stub_ai.install(ai_latency)
+
+    results: Dict[str, Any] = {}
+    # The app prints on some paths (e.g. the active AI provider); keep the report readable
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    try:
+        with output:
+            await main.app.router.startup()
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+                habits = (await client.get("/api/habits")).json()["habits"]
+                goals = (await client.get("/api/goals")).json()["goals"]
+                ctx = {
+                    "seed": seed,
+                    "today": date.today(),
+                    "habit_ids": [h["id"] for h in habits],
+                    "goal_ids": [g["id"] for g in goals],
+                }
+                if not ctx["habit_ids"] or not ctx["goal_ids"]:
+                    raise ValueError(f"{db} needs at least one habit and one goal; see benchmarks.generate")
+                for scenario in scenarios:
+                    runs = [await measure(client, scenario, ctx, requests, concurrency, warmup)
+                            for _ in range(repeat)]
+                    results[scenario.name] = min(runs, key=lambda r: r["p95_ms"])
+                    print(f"{scenario.name}: done", file=sys.stderr)
+            await main.app.router.shutdown()
+    finally:
+        database.close_connections()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "config": {
+            "habits": len(ctx["habit_ids"]),
+            "goals": len(ctx["goal_ids"]),
+            "requests": requests,
+            "concurrency": concurrency,
+            "warmup": warmup,
+            "repeat": repeat,
+            "seed": seed,
+            "ai_latency": ai_latency,
+            "group_commit": database.GROUP_COMMIT,
+        },
+        "routes": results,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], threshold: float,
+            min_delta_ms: float) -> List[str]:
+    """Describe every route whose p95 latency or throughput regressed past the threshold.
+
+    Latency changes smaller than min_delta_ms are ignored, so sub-millisecond
+    routes do not fail on timer noise.
+    """
+    regressions = []
+    if results["config"] != baseline.get("config"):
+        print("warning: benchmark configuration differs from the baseline's", file=sys.stderr)
+    for name, base in baseline.get("routes", {}).items():
+        current = results["routes"].get(name)
+        if current is None:
+            continue
+        p95, base_p95 = current["p95_ms"], base["p95_ms"]
+        if p95 > base_p95 * (1 + threshold) and p95 - base_p95 > min_delta_ms:
+            regressions.append(f"{name}: p95 {base_p95:.2f} -> {p95:.2f} ms")
+        if current["rps"] < base["rps"] * (1 - threshold):
+            regressions.append(f"{name}: throughput {base['rps']:.0f} -> {current['rps']:.0f} req/s")
+    base_rss = baseline.get("peak_rss_mb")
+    if base_rss and results["peak_rss_mb"] > base_rss * (1 + threshold):
+        regressions.append(f"peak RSS {base_rss:.0f} -> {results['peak_rss_mb']:.0f} MB")
+    return regressions
+
+
+def format_report(results: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None) -> str:
+    """Render results as a fixed-width table, with the baseline p95 when given."""
+    base_routes = (baseline or {}).get("routes", {})
+    header = f"{'route':<24} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/s':>9} {'errors':>6} {'rss MB':>7}"
+    if baseline:
+        header += f" {'base p95':>9}"
+    lines = [header]
+    for name, r in results["routes"].items():
+        line = (f"{name:<24} {r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} {r['p99_ms']:>8.2f} "
+                f"{r['rps']:>9.1f} {r['errors']:>6} {r['peak_rss_mb']:>7.1f}")
+        if name in base_routes:
+            line += f" {base_routes[name]['p95_ms']:>9.2f}"
+        lines.append(line)
+    lines.append(f"peak RSS {results['peak_rss_mb']:.1f} MB")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark every API route in-process.")
+    parser.add_argument("--db", default="bench.db", help="database made by benchmarks.generate (left unchanged)")
+    parser.add_argument("--requests", type=int, default=100, help="measured requests per route")
+    parser.add_argument("--concurrency", type=int, default=8, help="requests in flight at once")
+    parser.add_argument("--warmup", type=int, default=10, help="unmeasured requests per route first")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per route; the best p95 is reported")
+    parser.add_argument("--routes", default=None, help="only scenarios whose name contains one of these, comma-separated")
+    parser.add_argument("--seed", type=int, default=0, help="seed for request parameters")
+    parser.add_argument("--ai-latency", type=float, default=0.2, help="stub AI provider latency in seconds")
+    parser.add_argument("--json", dest="json_path", help="write the results document here")
+    parser.add_argument("--baseline", help="compare with this results document")
+    parser.add_argument("--save-baseline", help="write the results here as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.5, help="allowed relative regression (default 0.5)")
+    parser.add_argument("--min-delta-ms", type=float, default=0.5, help="ignore latency changes below this")
+    parser.add_argument("--verbose", action="store_true", help="show the app's own output")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        sys.exit(f"{args.db} not found; create it with python -m benchmarks.generate --db {args.db}")
+    scenarios = SCENARIOS
+    if args.routes:
+        wanted = [w.strip() for w in args.routes.split(",") if w.strip()]
+        scenarios = [s for s in SCENARIOS if any(w in s.name for w in wanted)]
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    results = asyncio.run(run(args.db, scenarios, args.requests, args.concurrency, args.warmup,
+                              args.repeat, args.seed, args.ai_latency, args.verbose))
+    print(format_report(results, baseline))
+
+    for path in filter(None, (args.json_path, args.save_baseline)):
+        with open(path, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+
+    failed = any(r["errors"] for r in results["routes"].values())
+    if failed:
+        print("FAIL: some requests returned an unexpected status", file=sys.stderr)
+    if baseline:
+        regressions = compare(results, baseline, args.threshold, args.min_delta_ms)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        failed = failed or bool(regressions)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
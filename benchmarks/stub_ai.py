@@ -0,0 +1,53 @@
+"""Local stand-in for the GLM/Qwen providers.
+
+StubAIClient goes through the real client's prompt building, caching and
+concurrency limit, but answers after a fixed simulated latency instead of
+calling an API, so insight routes can be benchmarked offline.
+"""
+import asyncio
+from typing import AsyncIterator
+
+import ai
+from ai import GLMClient
+
+STUB_CHUNKS = 20   # streamed answers arrive in this many pieces
+
+
+class StubAIClient(GLMClient):
+    """GLM-shaped client whose upstream is a timer."""
+
+    provider = "stub"
+
+    def __init__(self, latency: float = 0.2, model: str = "stub-1"):
+        super().__init__(api_key="stub", model=model)
+        self.latency = latency
+        self.calls = 0
+
+    def _answer(self, prompt: str) -> str:
+        return (f"**Strengths**: steady habits.\n**Patterns**: {len(prompt)} prompt characters analysed.\n"
+                "**Recommendations**: keep going.\n")
+
+    async def _generate(self, prompt: str) -> str:
+        await self.open()
+        async with self._semaphore:
+            self.calls += 1
+            await asyncio.sleep(self.latency)
+            return self._answer(prompt)
+
+    async def _generate_stream(self, prompt: str) -> AsyncIterator[str]:
+        await self.open()
+        async with self._semaphore:
+            self.calls += 1
+            answer = self._answer(prompt)
+            size = len(answer) // STUB_CHUNKS + 1
+            for start in range(0, len(answer), size):
+                await asyncio.sleep(self.latency / STUB_CHUNKS)
+                yield answer[start:start + size]
+
+
+def install(latency: float = 0.2) -> StubAIClient:
+    """Make the stub the active AI provider for this process."""
+    client = StubAIClient(latency)
+    ai._ai_client = client
+    ai._provider = client.provider
+    return client
@@ -1,14 +1,349 @@
+import os
+import time
+import queue
+import hashlib
+import asyncio
 import sqlite3
-from datetime import datetime, date, timedelta
-from typing import List, Dict, Any
+import threading
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar, copy_context
+from functools import lru_cache, partial, wraps
+from concurrent.futures import ThreadPoolExecutor, Future, TimeoutError as FutureTimeoutError
+from datetime import datetime, date, timedelta, timezone
+from typing import List, Dict, Any, Iterable, Iterator, Tuple
 import json
 
+from metrics import db_call_seconds, db_query_seconds
+from profiling import PROFILING_ENABLED, current_profile
+
 # Database setup
 DB_PATH = "habits.db"
 
+# Multi-tenant mode: with TENANT_DIR set, each tenant gets its own database
+# file under it, selected per request with use_tenant()
+TENANT_DIR = os.getenv("TENANT_DIR")
+
+# Connection settings
+BUSY_TIMEOUT_MS = 5000        # wait this long for a competing writer before "database is locked"
+STATEMENT_CACHE_SIZE = 256    # prepared statements kept per connection
+MAX_CONNECTIONS_PER_THREAD = int(os.getenv("MAX_CONNECTIONS_PER_THREAD", "8"))  # LRU of databases per thread
+DB_WORKERS = int(os.getenv("DB_WORKERS", "8"))  # threads serving run_db() calls
+# Upper bound on concurrently open connections. A thread can only evict its
+# own idle connections, so there is room for every DB worker's full LRU plus
+# the group-commit writer's and the main thread's; otherwise the workers
+# could take every slot and starve the writer.
+MAX_CONNECTIONS = max(int(os.getenv("MAX_CONNECTIONS", "64")), (DB_WORKERS + 2) * MAX_CONNECTIONS_PER_THREAD)
+MIGRATION_LOCK_TIMEOUT_S = 600  # wait this long for another process to finish migrating
+
+# Group commit (write-behind): queue small writes and commit them together
+GROUP_COMMIT = os.getenv("GROUP_COMMIT", "0") == "1"
+GROUP_COMMIT_MAX_LATENCY_MS = float(os.getenv("GROUP_COMMIT_MAX_LATENCY_MS", "5"))
+GROUP_COMMIT_BATCH_SIZE = int(os.getenv("GROUP_COMMIT_BATCH_SIZE", "256"))
+GROUP_COMMIT_TIMEOUT_S = float(os.getenv("GROUP_COMMIT_TIMEOUT_S", "30"))  # longest a caller waits for its commit
+
+# Day numbers are proleptic Gregorian ordinals, matching date.toordinal()
+_DAY_SQL = "CAST(julianday(date) - 1721424.5 AS INTEGER)"
+
+# Recompute streak_runs and habit_streaks from the logs in source for the
+# habits matching habit_filter. Each run of consecutive completed days
+# shares the same (day - row number) value.
+def _rebuild_streaks_sql(habit_filter: str = "1=1", source: str = "habit_logs") -> str:
+    return f"""
+    DELETE FROM streak_runs WHERE {habit_filter};
+    DELETE FROM habit_streaks WHERE {habit_filter};
+    INSERT INTO streak_runs (habit_id, start_day, end_day)
+    SELECT habit_id, MIN(day), MAX(day)
+    FROM (
+        SELECT habit_id,
+               {_DAY_SQL} as day,
+               {_DAY_SQL} - ROW_NUMBER() OVER (PARTITION BY habit_id ORDER BY date) as grp
+        FROM {source}
+        WHERE completed = 1 AND julianday(date) IS NOT NULL AND {habit_filter}
+    )
+    GROUP BY habit_id, grp;
+    INSERT INTO habit_streaks (habit_id, current_streak, longest_streak, last_completed_date)
+    SELECT r.habit_id,
+           (SELECT last.end_day - last.start_day + 1 FROM streak_runs last
+            WHERE last.habit_id = r.habit_id ORDER BY last.start_day DESC LIMIT 1),
+           MAX(r.end_day - r.start_day + 1),
+           date(MAX(r.end_day) + 1721424.5)
+    FROM streak_runs r
+    WHERE {habit_filter}
+    GROUP BY r.habit_id;
+"""
+
+# log_rollups holds each habit's logged and completed counts per ISO week
+# (keyed by its Monday) and per month (keyed by its first day). Triggers
+# on habit_logs apply every insert, update and delete as it happens, so
+# every write path keeps them current.
+_ROLLUP_PERIODS = {
+    "week": "date({d}, 'weekday 0', '-6 days')",
+    "month": "date({d}, 'start of month')",
+}
+
+def _rollup_add_sql(row: str, sign: str, done: str = None) -> str:
+    """Add (sign '') or subtract (sign '-') one log of row to its week and month."""
+    done = done or f"CASE WHEN {row}.completed = 1 THEN {sign}1 ELSE 0 END"
+    values = ",\n               ".join(
+        f"('{period}', {row}.habit_id, {start.format(d=row + '.date')}, {sign}1, {done})"
+        for period, start in _ROLLUP_PERIODS.items()
+    )
+    return f"""
+        INSERT INTO log_rollups (period, habit_id, start_date, logged, completed)
+        VALUES {values}
+        ON CONFLICT (period, habit_id, start_date) DO UPDATE
+        SET logged = logged + excluded.logged, completed = completed + excluded.completed;"""
+
+def _rollup_triggers_sql() -> str:
+    same_key = "OLD.habit_id = NEW.habit_id AND OLD.date = NEW.date"
+    valid = "julianday({row}.date) IS NOT NULL"
+    flip = "\n".join(
+        f"""
+        UPDATE log_rollups SET completed = completed + (CASE WHEN NEW.completed = 1 THEN 1 ELSE 0 END)
+                                                    - (CASE WHEN OLD.completed = 1 THEN 1 ELSE 0 END)
+        WHERE period = '{period}' AND habit_id = NEW.habit_id AND start_date = {start.format(d='NEW.date')};"""
+        for period, start in _ROLLUP_PERIODS.items()
+    )
+    return f"""
+    CREATE TRIGGER IF NOT EXISTS habit_logs_rollup_insert AFTER INSERT ON habit_logs
+    WHEN {valid.format(row='NEW')}
+    BEGIN{_rollup_add_sql('NEW', '')}
+    END;
+    CREATE TRIGGER IF NOT EXISTS habit_logs_rollup_delete AFTER DELETE ON habit_logs
+    WHEN {valid.format(row='OLD')}
+    BEGIN{_rollup_add_sql('OLD', '-')}
+    END;
+    CREATE TRIGGER IF NOT EXISTS habit_logs_rollup_flip AFTER UPDATE OF completed ON habit_logs
+    WHEN {same_key} AND {valid.format(row='NEW')} AND (OLD.completed = 1) IS NOT (NEW.completed = 1)
+    BEGIN{flip}
+    END;
+    CREATE TRIGGER IF NOT EXISTS habit_logs_rollup_move_old AFTER UPDATE OF habit_id, date ON habit_logs
+    WHEN NOT ({same_key}) AND {valid.format(row='OLD')}
+    BEGIN{_rollup_add_sql('OLD', '-')}
+    END;
+    CREATE TRIGGER IF NOT EXISTS habit_logs_rollup_move_new AFTER UPDATE OF habit_id, date ON habit_logs
+    WHEN NOT ({same_key}) AND {valid.format(row='NEW')}
+    BEGIN{_rollup_add_sql('NEW', '')}
+    END;
+"""
+
+# log_archive holds cold history. archive_cold_logs() folds each habit's
+# logs of a month older than ARCHIVE_AFTER_DAYS into one row whose logged
+# and completed bitmaps have bit d - 1 set for day d of the month, and
+# moves their notes to log_archive_notes. Archived logs keep counting in
+# log_rollups and streak_runs, and the readers merge them back in, as
+# rows with a NULL id.
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "730"))
+
+_DAY_BIT_SQL = "(CAST(strftime('%d', {d}) AS INTEGER) - 1)"
+_ARCHIVED_DATE_SQL = "substr(a.month, 1, 8) || d.day"
+_ARCHIVED_DAY_SQL = "CAST(julianday(a.month) - 1721424.5 AS INTEGER) + d.n"  # day numbers, without building dates
+
+def _archived_bit_sql(column: str, habit_id: str, day: str) -> str:
+    """Bit `column` of log_archive for a habit and day: 0, 1, or NULL when the month is not archived."""
+    return f"""(SELECT ({column} >> {_DAY_BIT_SQL.format(d=day)}) & 1 FROM log_archive
+            WHERE habit_id = {habit_id} AND month = date({day}, 'start of month'))"""
+
+def _archived_logs_sql(where: str) -> str:
+    """The logs archived in the log_archive rows `a` matching where, as habit_logs rows without notes."""
+    return f"""
+        SELECT NULL AS id, a.habit_id, {_ARCHIVED_DATE_SQL} AS date, (a.completed >> d.n) & 1 AS completed,
+               NULL AS notes
+        FROM log_archive a JOIN month_days d ON (a.logged >> d.n) & 1
+        WHERE {where}"""
+
+def _with_notes_sql(logs_sql: str) -> str:
+    """The rows of logs_sql with the notes of the archived ones filled in."""
+    return f"""
+        SELECT l.id, l.habit_id, l.date, l.completed,
+               CASE WHEN l.id IS NULL THEN (SELECT notes FROM log_archive_notes n
+                                            WHERE n.habit_id = l.habit_id AND n.date = l.date)
+                    ELSE l.notes END AS notes
+        FROM ({logs_sql}) l"""
+
+# Every log, hot or archived, without the archived notes
+_ALL_LOGS_SQL = f"(SELECT id, habit_id, date, completed, notes FROM habit_logs UNION ALL {_archived_logs_sql('1=1')})"
+
+_ARCHIVE_TRIGGERS_SQL = f"""
+    -- Rows deleted by archive_cold_logs are in log_archive by then and keep counting
+    DROP TRIGGER IF EXISTS habit_logs_rollup_delete;
+    CREATE TRIGGER habit_logs_rollup_delete AFTER DELETE ON habit_logs
+    WHEN julianday(OLD.date) IS NOT NULL AND {_archived_bit_sql('logged', 'OLD.habit_id', 'OLD.date')} IS NOT 1
+    BEGIN{_rollup_add_sql('OLD', '-')}
+    END;
+    -- A log written for an archived day replaces the archived one
+    CREATE TRIGGER IF NOT EXISTS habit_logs_unarchive AFTER INSERT ON habit_logs
+    WHEN {_archived_bit_sql('logged', 'NEW.habit_id', 'NEW.date')} = 1
+    BEGIN{_rollup_add_sql('NEW', '-', '-' + _archived_bit_sql('completed', 'NEW.habit_id', 'NEW.date'))}
+        UPDATE log_archive
+        SET logged = logged & ~(1 << {_DAY_BIT_SQL.format(d='NEW.date')}),
+            completed = completed & ~(1 << {_DAY_BIT_SQL.format(d='NEW.date')})
+        WHERE habit_id = NEW.habit_id AND month = date(NEW.date, 'start of month');
+        DELETE FROM log_archive
+        WHERE habit_id = NEW.habit_id AND month = date(NEW.date, 'start of month') AND logged = 0;
+        DELETE FROM log_archive_notes WHERE habit_id = NEW.habit_id AND date = NEW.date;
+    END;
+"""
+
+# Schema migrations applied on top of the base tables, in order. PRAGMA
+# user_version records how many have run, so each one runs exactly once.
+MIGRATIONS = [
+    # 1: covering indexes for date-range scans of logs and goals
+    """
+    CREATE INDEX IF NOT EXISTS idx_habit_logs_date ON habit_logs (date, habit_id, completed);
+    CREATE INDEX IF NOT EXISTS idx_goals_goal_date ON goals (goal_date, habit_id);
+    """,
+    # 2: materialized streak state, maintained incrementally by log_habit
+    """
+    CREATE TABLE IF NOT EXISTS streak_runs (
+        habit_id INTEGER NOT NULL,
+        start_day INTEGER NOT NULL,
+        end_day INTEGER NOT NULL,
+        PRIMARY KEY (habit_id, start_day)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_streak_runs_end ON streak_runs (habit_id, end_day);
+    CREATE INDEX IF NOT EXISTS idx_streak_runs_length ON streak_runs (habit_id, end_day - start_day);
+    CREATE TABLE IF NOT EXISTS habit_streaks (
+        habit_id INTEGER PRIMARY KEY,
+        current_streak INTEGER NOT NULL,
+        longest_streak INTEGER NOT NULL,
+        last_completed_date DATE NOT NULL
+    );
+    """ + _rebuild_streaks_sql(),
+    # 3: data version bumped by every write, and persisted AI insights
+    """
+    CREATE TABLE IF NOT EXISTS data_version (
+        id INTEGER PRIMARY KEY CHECK (id = 0),
+        version INTEGER NOT NULL
+    );
+    INSERT OR IGNORE INTO data_version (id, version) VALUES (0, 0);
+    CREATE TABLE IF NOT EXISTS insight_cache (
+        key TEXT PRIMARY KEY,
+        insights TEXT NOT NULL,
+        created_at REAL NOT NULL
+    );
+    """,
+    # 4: latest precomputed insights, served while a newer answer is generated
+    """
+    CREATE TABLE IF NOT EXISTS latest_insights (
+        id INTEGER PRIMARY KEY CHECK (id = 0),
+        insights TEXT NOT NULL,
+        data_version INTEGER NOT NULL,
+        generated_at REAL NOT NULL
+    );
+    """,
+    # 5: per-habit weekly and monthly log counts, kept current by triggers
+    """
+    CREATE TABLE IF NOT EXISTS log_rollups (
+        period TEXT NOT NULL,
+        habit_id INTEGER NOT NULL,
+        start_date DATE NOT NULL,
+        logged INTEGER NOT NULL,
+        completed INTEGER NOT NULL,
+        PRIMARY KEY (period, habit_id, start_date)
+    ) WITHOUT ROWID;
+    """ + _rollup_triggers_sql() + """
+    INSERT OR REPLACE INTO log_rollups (period, habit_id, start_date, logged, completed)
+    SELECT p.period, l.habit_id,
+           CASE p.period WHEN 'week' THEN date(l.date, 'weekday 0', '-6 days')
+                         ELSE date(l.date, 'start of month') END,
+           COUNT(*), SUM(CASE WHEN l.completed = 1 THEN 1 ELSE 0 END)
+    FROM habit_logs l, (SELECT 'week' AS period UNION ALL SELECT 'month') p
+    WHERE julianday(l.date) IS NOT NULL
+    GROUP BY 1, 2, 3;
+    """,
+    # 6: cold history folded into per-month bitmaps by archive_cold_logs
+    """
+    CREATE TABLE IF NOT EXISTS log_archive (
+        habit_id INTEGER NOT NULL,
+        month DATE NOT NULL,
+        logged INTEGER NOT NULL,
+        completed INTEGER NOT NULL,
+        PRIMARY KEY (habit_id, month)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_log_archive_month ON log_archive (month);
+    CREATE TABLE IF NOT EXISTS log_archive_notes (
+        habit_id INTEGER NOT NULL,
+        date DATE NOT NULL,
+        notes TEXT NOT NULL,
+        PRIMARY KEY (habit_id, date)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS month_days (n INTEGER PRIMARY KEY, day TEXT NOT NULL);
+    INSERT OR IGNORE INTO month_days (n, day) VALUES """ + ", ".join(f"({n}, '{n + 1:02d}')" for n in range(31)) + ";\n"
+    + _ARCHIVE_TRIGGERS_SQL,
+    # 7: archived history left behind by habits deleted before delete_habit cleared it
+    """
+    DELETE FROM log_archive WHERE habit_id NOT IN (SELECT id FROM habits);
+    DELETE FROM log_archive_notes WHERE habit_id NOT IN (SELECT id FROM habits);
+    """,
+    # 8: logs left behind by habits deleted before delete_habit removed them
+    """
+    DELETE FROM habit_logs WHERE habit_id NOT IN (SELECT id FROM habits);
+    DELETE FROM log_rollups WHERE habit_id NOT IN (SELECT id FROM habits);
+    DELETE FROM log_archive WHERE habit_id NOT IN (SELECT id FROM habits);
+    DELETE FROM log_archive_notes WHERE habit_id NOT IN (SELECT id FROM habits);
+    """,
+]
+
+_local = threading.local()
+_connections_lock = threading.Lock()
+_connection_maps: Dict[int, Dict[str, sqlite3.Connection]] = {}
+_connection_slots = threading.BoundedSemaphore(MAX_CONNECTIONS)
+
+# Database file used by the current request or task; DB_PATH when unset
+_db_path: ContextVar[str] = ContextVar("db_path", default=None)
+
+# Database files whose schema this process has already brought up to date
+_initialized_paths = set()
+_initialized_lock = threading.Lock()
+
+class _ThreadConnections:
+    """Holds one thread's connections, most recently used last, and closes them when the thread exits."""
+
+    def __init__(self):
+        self.connections: Dict[str, sqlite3.Connection] = OrderedDict()
+        weakref.finalize(self, _release_connections, self.connections)
+
+def current_db_path() -> str:
+    """Path of the database the calling context reads and writes."""
+    return _db_path.get() or DB_PATH
+
+@contextmanager
+def use_database(path: str):
+    """Direct every data-access call made in the enclosed block to the database at path."""
+    token = _db_path.set(path)
+    try:
+        yield path
+    finally:
+        _db_path.reset(token)
+
+def tenant_db_path(tenant_id: str) -> str:
+    """Map a tenant id to its database file under TENANT_DIR.
+
+    The file name is a hash of the id, so any id is safe to use, and files
+    are spread over 256 subdirectories to keep directories small.
+    """
+    if not TENANT_DIR:
+        raise ValueError("multi-tenant mode is off; set TENANT_DIR")
+    if not tenant_id:
+        raise ValueError("tenant id must not be empty")
+    digest = hashlib.sha256(tenant_id.encode("utf-8")).hexdigest()
+    return os.path.join(TENANT_DIR, digest[:2], f"{digest}.db")
+
+def use_tenant(tenant_id: str):
+    """Direct the enclosed block's data access to the tenant's own database."""
+    return use_database(tenant_db_path(tenant_id))
+
 def init_db():
     """Initialize database with tables."""
-    conn = sqlite3.connect(DB_PATH)
+    path = current_db_path()
+    _initialized_paths.discard(path)
+    _initialize_path(path)
+
+def _create_schema(conn: sqlite3.Connection):
+    """Create the base tables and apply pending migrations."""
     cursor = conn.cursor()
 
     # Habits table
@@ -48,104 +383,823 @@ def init_db():
     """)
 
     conn.commit()
-    conn.close()
+    _migrate(conn)
+
+def _migrate(conn: sqlite3.Connection):
+    """Apply pending schema migrations, tracked by PRAGMA user_version.
 
-def get_connection():
-    """Get a database connection."""
-    conn = sqlite3.connect(DB_PATH)
+    Each migration runs in its own BEGIN IMMEDIATE transaction that first
+    re-reads user_version, so processes opening an outdated database at
+    the same time apply every migration once, one after another.
+    """
+    deadline = time.monotonic() + MIGRATION_LOCK_TIMEOUT_S
+    while True:
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError as e:
+            # Another process may hold the lock for longer than busy_timeout while it migrates
+            if "locked" not in str(e) or time.monotonic() > deadline:
+                raise
+            continue
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version >= len(MIGRATIONS):
+                conn.commit()
+                return
+            for statement in _script_statements(MIGRATIONS[version]):
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {version + 1}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+def _script_statements(script: str) -> Iterator[str]:
+    """Split an SQL script into statements, keeping trigger bodies whole."""
+    statement = ""
+    for part in script.split(";"):
+        statement += part + ";"
+        if sqlite3.complete_statement(statement):
+            if statement.strip(" \n;"):
+                yield statement
+            statement = ""
+
+def _open_connection(path: str) -> sqlite3.Connection:
+    """Open a connection tuned for concurrent readers and a single writer."""
+    conn = sqlite3.connect(
+        path,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        cached_statements=STATEMENT_CACHE_SIZE,
+        check_same_thread=False,
+    )
     conn.row_factory = sqlite3.Row
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
     return conn
 
+def get_connection() -> sqlite3.Connection:
+    """Get the calling thread's persistent connection to the current database.
+
+    Connections are opened lazily, once per thread and database path, and
+    reused for every later call instead of being closed after each query.
+    Each thread keeps at most MAX_CONNECTIONS_PER_THREAD of them, closing
+    the least recently used, and at most MAX_CONNECTIONS are open at once
+    across all threads. A database's schema is created or migrated the
+    first time this process opens it.
+    """
+    holder = getattr(_local, "holder", None)
+    if holder is None:
+        holder = _local.holder = _ThreadConnections()
+    connections = holder.connections
+    path = current_db_path()
+
+    conn = connections.get(path)
+    if conn is not None:
+        connections.move_to_end(path)
+        return conn
+
+    if len(connections) >= MAX_CONNECTIONS_PER_THREAD:
+        _evict_idle_connection(connections)
+    if not _connection_slots.acquire(blocking=False):
+        # Make room from this thread's own idle connections before waiting on others
+        _evict_idle_connection(connections)
+        if not _connection_slots.acquire(timeout=BUSY_TIMEOUT_MS / 1000):
+            raise sqlite3.OperationalError("too many open database connections")
+    try:
+        if path not in _initialized_paths:
+            _initialize_path(path)
+        conn = _open_connection(path)
+    except Exception:
+        _connection_slots.release()
+        raise
+    with _connections_lock:
+        connections[path] = conn
+        _connection_maps[id(connections)] = connections
+    return conn
+
+def _initialize_path(path: str):
+    """Create a database's directory and schema once per process, before first use."""
+    with _initialized_lock:
+        if path in _initialized_paths:
+            return
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = _open_connection(path)
+        try:
+            _create_schema(conn)
+        finally:
+            conn.close()
+        _initialized_paths.add(path)
+
+def _evict_idle_connection(connections: Dict[str, sqlite3.Connection]):
+    """Close the thread's least recently used connection that is not inside a transaction."""
+    with _connections_lock:
+        for path, conn in connections.items():
+            if not conn.in_transaction:
+                del connections[path]
+                break
+        else:
+            return
+    try:
+        conn.close()
+    except sqlite3.Error:
+        pass
+    _connection_slots.release()
+
+def _release_connections(connections: Dict[str, sqlite3.Connection]):
+    """Close a thread's connections and free their pool slots."""
+    with _connections_lock:
+        _connection_maps.pop(id(connections), None)
+        for conn in connections.values():
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+            _connection_slots.release()
+        connections.clear()
+
+def close_connections():
+    """Close every pooled connection (call on application shutdown)."""
+    with _connections_lock:
+        maps = list(_connection_maps.values())
+    for connections in maps:
+        _release_connections(connections)
+
+@contextmanager
+def read_snapshot():
+    """Run the enclosed reads in one transaction so they see a single consistent snapshot.
+
+    Every data-access function uses the calling thread's connection, so any
+    of them called inside this block reads from the same snapshot.
+    """
+    conn = get_connection()
+    if conn.in_transaction:
+        yield conn
+        return
+
+    conn.execute("BEGIN")
+    try:
+        yield conn
+    finally:
+        conn.execute("COMMIT")
+
+# Async access
+_db_executor = None
+_db_executor_lock = threading.Lock()
+
+async def run_db(func, *args, **kwargs):
+    """Run a blocking data-access function on the DB worker pool and await it.
+
+    Keeps slow queries off the event loop. The pool has DB_WORKERS threads,
+    each with its own persistent connection, so at most DB_WORKERS queries
+    run at once and the rest wait in the executor's queue.
+    """
+    global _db_executor
+    # Queued writes wait on the group commit without holding a worker thread
+    transaction = getattr(func, "transaction", None)
+    write_queue = _write_queue
+    if transaction is not None and write_queue is not None:
+        started = time.perf_counter()
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(write_queue.submit(transaction, args, kwargs)),
+                                          GROUP_COMMIT_TIMEOUT_S)
+        except asyncio.TimeoutError:
+            raise _group_commit_timeout() from None
+        finally:
+            db_call_seconds.observe(time.perf_counter() - started, func.__name__)
+
+    if _db_executor is None:
+        with _db_executor_lock:
+            if _db_executor is None:
+                _db_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="db")
+    loop = asyncio.get_running_loop()
+    # Run in a copy of the caller's context so the worker uses the caller's database
+    call = _profiled_call if PROFILING_ENABLED else _timed_call
+    return await loop.run_in_executor(_db_executor, partial(copy_context().run, call, func, args, kwargs))
+
+def _timed_call(func, args: tuple, kwargs: dict):
+    """Call func on a DB worker, recording its duration under its name."""
+    started = time.perf_counter()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        db_call_seconds.observe(time.perf_counter() - started, getattr(func, "__name__", "unknown"))
+
+def _profiled_call(func, args: tuple, kwargs: dict):
+    """_timed_call, also traced into the request's profile when it is being profiled."""
+    profile = current_profile()
+    if profile is None:
+        return _timed_call(func, args, kwargs)
+    with profile.db_call(get_connection(), getattr(func, "__name__", "unknown")):
+        return _timed_call(func, args, kwargs)
+
+def _timed_query(func):
+    """Record every call of a data-access function under its name in db_query_seconds.
+
+    Unlike run_db's timing this includes calls made inside other
+    data-access functions, so a composite such as get_dashboard also
+    shows up as the queries it is made of.
+    """
+    name = func.__name__
+
+    @wraps(func)
+    def timed(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            db_query_seconds.observe(time.perf_counter() - started, name)
+    return timed
+
+def shutdown_db_workers():
+    """Stop the DB worker pool after letting queued calls finish."""
+    global _db_executor
+    with _db_executor_lock:
+        executor, _db_executor = _db_executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
+
+# Group commit
+class GroupCommitQueue:
+    """A single writer thread that commits queued write transactions in batches.
+
+    The writer takes the first pending write plus whatever else is queued.
+    Until the batch is as large as the previous one it keeps waiting for
+    more, for at most max_latency_ms, so bursts are grouped while a lone
+    write is committed at once. Batches never exceed batch_size.
+    The batch runs in one transaction, each write inside its own savepoint
+    so a failing write is rolled back alone. Callers' futures resolve only
+    after the COMMIT, so an acknowledged write is durable.
+    """
+
+    def __init__(self, max_latency_ms: float = GROUP_COMMIT_MAX_LATENCY_MS,
+                 batch_size: int = GROUP_COMMIT_BATCH_SIZE):
+        self.max_latency = max_latency_ms / 1000
+        self.batch_size = batch_size
+        self.commits = 0
+        self.writes = 0
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, transaction, args: tuple = (), kwargs: dict = None) -> Future:
+        """Queue transaction(cursor, *args, **kwargs) against the current database.
+
+        The returned future holds its result.
+        """
+        future = Future()
+        self._queue.put((current_db_path(), transaction, args, kwargs or {}, future))
+        return future
+
+    def close(self):
+        """Commit everything already queued, then stop the writer."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        running = True
+        last_batch = 0
+        while running:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.max_latency
+            while len(batch) < self.batch_size:
+                # Wait only while the batch is smaller than the last one
+                try:
+                    if len(batch) < last_batch:
+                        item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                    else:
+                        item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    running = False
+                    break
+                batch.append(item)
+            # One transaction per database the batch touches
+            by_path: Dict[str, list] = {}
+            for path, *write in batch:
+                by_path.setdefault(path, []).append(write)
+            for path, writes in by_path.items():
+                try:
+                    with use_database(path):
+                        self._commit(get_connection(), writes)
+                except Exception as e:
+                    # The database could not be opened; fail its writes and keep serving the others
+                    for *_, future in writes:
+                        if not future.done() and (future.running() or future.set_running_or_notify_cancel()):
+                            future.set_exception(e)
+            last_batch = len(batch)
+
+    def _commit(self, conn: sqlite3.Connection, batch: list):
+        # Writes whose caller already gave up are dropped, not committed
+        batch = [item for item in batch if item[3].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        outcomes = []
+        try:
+            # Acknowledged writes survive power loss; one fsync covers the whole batch
+            conn.execute("PRAGMA synchronous = FULL")
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            for transaction, args, kwargs, future in batch:
+                cursor.execute("SAVEPOINT queued_write")
+                try:
+                    outcomes.append((future, transaction(cursor, *args, **kwargs), None))
+                except Exception as e:
+                    cursor.execute("ROLLBACK TO queued_write")
+                    outcomes.append((future, None, e))
+                cursor.execute("RELEASE queued_write")
+            conn.commit()
+        except Exception as e:
+            if conn.in_transaction:
+                conn.rollback()
+            for *_, future in batch:
+                future.set_exception(e)
+            return
+
+        self.commits += 1
+        self.writes += len(batch)
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "commits": self.commits,
+            "writes": self.writes,
+            "writes_per_commit": round(self.writes / self.commits, 2) if self.commits else 0
+        }
+
+_write_queue: GroupCommitQueue = None
+
+def start_group_commit(max_latency_ms: float = GROUP_COMMIT_MAX_LATENCY_MS,
+                       batch_size: int = GROUP_COMMIT_BATCH_SIZE) -> GroupCommitQueue:
+    """Route log_habit/create_goal through a group-commit writer from now on."""
+    global _write_queue
+    if _write_queue is None:
+        _write_queue = GroupCommitQueue(max_latency_ms, batch_size)
+    return _write_queue
+
+def stop_group_commit():
+    """Flush queued writes and go back to one transaction per write."""
+    global _write_queue
+    write_queue, _write_queue = _write_queue, None
+    if write_queue is not None:
+        write_queue.close()
+
+def group_commit_metrics() -> Dict[str, Any]:
+    """Counters of the active group-commit writer, or None when it is off."""
+    write_queue = _write_queue
+    return write_queue.metrics() if write_queue is not None else None
+
+def _group_commit_timeout() -> sqlite3.OperationalError:
+    # A write still pending is cancelled and dropped by the writer; one already
+    # in a batch may yet commit
+    return sqlite3.OperationalError(f"group commit did not complete within {GROUP_COMMIT_TIMEOUT_S:g} s")
+
+def _write_transaction(transaction):
+    """Make a write function from transaction(cursor, ...).
+
+    Called directly it runs in its own BEGIN IMMEDIATE transaction, or in
+    the next group commit when that is enabled, waiting at most
+    GROUP_COMMIT_TIMEOUT_S for it. run_db() recognises it by its
+    `transaction` attribute and awaits the group commit directly.
+    """
+    @wraps(transaction)
+    def write(*args, **kwargs):
+        write_queue = _write_queue
+        if write_queue is not None:
+            future = write_queue.submit(transaction, args, kwargs)
+            try:
+                return future.result(timeout=GROUP_COMMIT_TIMEOUT_S)
+            except FutureTimeoutError:
+                future.cancel()
+                raise _group_commit_timeout() from None
+        conn = get_connection()
+        with conn:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            return transaction(cursor, *args, **kwargs)
+    write.transaction = transaction
+    return write
+
+# Data version
+_BUMP_DATA_VERSION_SQL = "UPDATE data_version SET version = version + 1 WHERE id = 0"
+
+def _bump_data_version(cursor):
+    """Record a write; call inside the write's transaction."""
+    cursor.execute(_BUMP_DATA_VERSION_SQL)
+
+@_timed_query
+def get_data_version() -> int:
+    """Get the database's write counter, shared by every process using the file."""
+    conn = get_connection()
+    row = conn.execute("SELECT version FROM data_version WHERE id = 0").fetchone()
+    return row['version']
+
+# Insight cache persistence
+@_timed_query
+def get_cached_insight(key: str, min_created_at: float) -> Tuple[str, float]:
+    """Get persisted (insights, created_at) for a cache key, if stored after min_created_at."""
+    conn = get_connection()
+    row = conn.execute(
+        "SELECT insights, created_at FROM insight_cache WHERE key = ? AND created_at >= ?",
+        (key, min_created_at)
+    ).fetchone()
+    return (row['insights'], row['created_at']) if row else None
+
+@_timed_query
+def put_cached_insight(key: str, insights: str, created_at: float, expire_before: float):
+    """Persist insights for a cache key and drop entries older than expire_before."""
+    conn = get_connection()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO insight_cache (key, insights, created_at) VALUES (?, ?, ?)",
+            (key, insights, created_at)
+        )
+        conn.execute("DELETE FROM insight_cache WHERE created_at < ?", (expire_before,))
+
+@_timed_query
+def get_latest_insights() -> Dict[str, Any]:
+    """Get the last generated insights with their data version and generation time."""
+    conn = get_connection()
+    row = conn.execute(
+        "SELECT insights, data_version, generated_at FROM latest_insights WHERE id = 0"
+    ).fetchone()
+    return dict(row) if row else None
+
+@_timed_query
+def save_latest_insights(insights: str, data_version: int, generated_at: float):
+    """Store insights as the latest answer unless a newer one is already stored."""
+    conn = get_connection()
+    with conn:
+        conn.execute(
+            """
+            INSERT INTO latest_insights (id, insights, data_version, generated_at)
+            VALUES (0, ?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET
+                insights = excluded.insights,
+                data_version = excluded.data_version,
+                generated_at = excluded.generated_at
+            WHERE excluded.data_version >= latest_insights.data_version
+            """,
+            (insights, data_version, generated_at)
+        )
+
 # Habit operations
+@_timed_query
 def create_habit(name: str, color: str = '#007bff') -> int:
     """Create a new habit."""
     conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT INTO habits (name, color) VALUES (?, ?)",
-        (name, color)
-    )
-    habit_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+    with conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT INTO habits (name, color) VALUES (?, ?)",
+            (name, color)
+        )
+        habit_id = cursor.lastrowid
+        _bump_data_version(cursor)
     return habit_id
 
+@_timed_query
 def get_habits() -> List[Dict[str, Any]]:
     """Get all habits."""
     conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT * FROM habits ORDER BY name")
     habits = [dict(row) for row in cursor.fetchall()]
-    conn.close()
     return habits
 
+@_timed_query
 def delete_habit(habit_id: int) -> bool:
     """Delete a habit."""
     conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM habits WHERE id = ?", (habit_id,))
-    success = cursor.rowcount > 0
-    conn.commit()
-    conn.close()
+    with conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM habits WHERE id = ?", (habit_id,))
+        success = cursor.rowcount > 0
+        # Foreign keys are off, so the logs do not cascade; the rollups they touch are dropped below
+        cursor.execute("DELETE FROM habit_logs WHERE habit_id = ?", (habit_id,))
+        cursor.execute("DELETE FROM streak_runs WHERE habit_id = ?", (habit_id,))
+        cursor.execute("DELETE FROM habit_streaks WHERE habit_id = ?", (habit_id,))
+        cursor.execute("DELETE FROM log_rollups WHERE period IN ('week', 'month') AND habit_id = ?", (habit_id,))
+        cursor.execute("DELETE FROM log_archive WHERE habit_id = ?", (habit_id,))
+        cursor.execute("DELETE FROM log_archive_notes WHERE habit_id = ?", (habit_id,))
+        _bump_data_version(cursor)
     return success
 
 # Habit log operations
-def log_habit(habit_id: int, completed: bool, date: str = None, notes: str = None) -> bool:
+BULK_CHUNK_SIZE = 5000        # rows written per transaction by bulk_log_habits
+
+# Log dates must fall within this window around today; anything outside is a typo
+MAX_HISTORY_DAYS = 7305       # about 20 years back
+MAX_FUTURE_DAYS = 366
+
+@lru_cache(maxsize=4096)
+def _parse_day(log_date: str) -> int:
+    """Parse a YYYY-MM-DD date into its day number, rejecting any other format."""
+    try:
+        day = date.fromisoformat(log_date)
+    except ValueError:
+        day = None
+    if day is None or day.isoformat() != log_date:
+        raise ValueError(f"date must be YYYY-MM-DD, got {log_date!r}")
+    return day.toordinal()
+
+def _day_number(log_date: str) -> int:
+    """Parse a log date into its day number, rejecting other formats and implausible dates."""
+    day = _parse_day(log_date)
+    today = date.today().toordinal()
+    if not today - MAX_HISTORY_DAYS <= day <= today + MAX_FUTURE_DAYS:
+        raise ValueError(f"date must be within {MAX_HISTORY_DAYS} days before and "
+                         f"{MAX_FUTURE_DAYS} days after today, got {log_date!r}")
+    return day
+
+@_write_transaction
+@_timed_query
+def log_habit(cursor, habit_id: int, completed: bool, log_date: str = None, notes: str = None) -> bool:
     """Log a habit completion for a specific date (defaults to today)."""
-    if date is None:
-        date = date.today().isoformat()
-    conn = get_connection()
-    cursor = conn.cursor()
+    if log_date is None:
+        log_date = date.today().isoformat()
+    day = _day_number(log_date)
+    # The previous log may be an archived one
+    log_day = date.fromordinal(day)
+    bit, month = log_day.day - 1, log_day.replace(day=1).isoformat()
+    cursor.execute("""
+        SELECT completed FROM habit_logs WHERE habit_id = ? AND date = ?
+        UNION ALL
+        SELECT (completed >> ?) & 1 FROM log_archive WHERE habit_id = ? AND month = ? AND (logged >> ?) & 1
+    """, (habit_id, log_date, bit, habit_id, month, bit))
+    previous = cursor.fetchone()
+    was_completed = bool(previous and previous['completed'])
+
+    # An upsert rather than INSERT OR REPLACE: REPLACE's implicit delete
+    # would skip the rollup delete trigger
     cursor.execute("""
-        INSERT OR REPLACE INTO habit_logs (habit_id, date, completed, notes)
+        INSERT INTO habit_logs (habit_id, date, completed, notes)
         VALUES (?, ?, ?, ?)
-    """, (habit_id, date, completed, notes))
-    conn.commit()
-    conn.close()
+        ON CONFLICT (habit_id, date) DO UPDATE
+        SET completed = excluded.completed, notes = excluded.notes
+    """, (habit_id, log_date, completed, notes))
+
+    if completed and not was_completed:
+        _add_streak_day(cursor, habit_id, day)
+    elif was_completed and not completed:
+        _remove_streak_day(cursor, habit_id, day)
+    _bump_data_version(cursor)
     return True
 
-def get_habit_logs(habit_id: int, days: int = 30) -> List[Dict[str, Any]]:
-    """Get habit logs for last N days."""
+def _validate_log_row(row: Any, habit_ids: set, today: str) -> Tuple[int, str, bool, str]:
+    """Check one bulk log row and return it as an insert tuple."""
+    if not isinstance(row, dict):
+        raise ValueError("row must be a JSON object")
+    habit_id = row.get("habit_id")
+    if type(habit_id) is not int:
+        raise ValueError("habit_id must be an integer")
+    if habit_id not in habit_ids:
+        raise ValueError(f"habit {habit_id} not found")
+    completed = row.get("completed")
+    if type(completed) is not bool:
+        raise ValueError("completed must be true or false")
+    log_date = row.get("date") or today
+    if not isinstance(log_date, str):
+        raise ValueError("date must be YYYY-MM-DD")
+    _day_number(log_date)
+    notes = row.get("notes")
+    if notes is not None and not isinstance(notes, str):
+        raise ValueError("notes must be a string")
+    return habit_id, log_date, completed, notes
+
+@_timed_query
+def bulk_log_habits(rows: Iterable[Any], first_row: int = 0, committed: set = None) -> Dict[str, Any]:
+    """Upsert many habit logs, BULK_CHUNK_SIZE rows per transaction.
+
+    Invalid rows are skipped and reported by position; valid rows are still
+    written. Streaks are not updated here: call rebuild_streaks() with the
+    returned habit_ids once the whole batch is in. The ids of habits whose
+    logs were committed are also added to `committed` as each chunk commits,
+    so a caller can rebuild them even if a later chunk fails.
+    """
+    conn = get_connection()
+    habit_ids = {row['id'] for row in conn.execute("SELECT id FROM habits")}
+    today = date.today().isoformat()
+    written = 0
+    errors = []
+    touched = set()
+    chunk = []
+
+    def flush():
+        with conn:
+            conn.executemany("""
+                INSERT INTO habit_logs (habit_id, date, completed, notes)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (habit_id, date) DO UPDATE
+                SET completed = excluded.completed, notes = excluded.notes
+            """, chunk)
+            _bump_data_version(conn)
+        if committed is not None:
+            committed.update(values[0] for values in chunk)
+
+    for index, row in enumerate(rows, start=first_row):
+        try:
+            values = _validate_log_row(row, habit_ids, today)
+        except ValueError as e:
+            errors.append({"row": index, "error": str(e)})
+            continue
+        chunk.append(values)
+        touched.add(values[0])
+        if len(chunk) >= BULK_CHUNK_SIZE:
+            flush()
+            written += len(chunk)
+            chunk = []
+    if chunk:
+        flush()
+        written += len(chunk)
+
+    return {"written": written, "errors": errors, "habit_ids": sorted(touched)}
+
+def utc_today() -> date:
+    """Today's date in UTC, which the `days` windows of log and stats queries count back from.
+
+    Streaks, goals and completion history use the local date.today().
+    """
+    return datetime.now(timezone.utc).date()
+
+def _days_ago(days: int) -> str:
+    """The UTC date `days` days before today, clamped to the supported range."""
+    today = utc_today()
+    days = min(max(days, (today - date.max).days), (today - date.min).days)
+    return (today - timedelta(days=days)).isoformat()
+
+def _archive_filter(start: str = None, end: str = None, habit_id: int = None) -> Tuple[str, list]:
+    """WHERE terms on log_archive `a` selecting the months that overlap [start, end), and their parameters."""
+    terms, params = [], []
+    if habit_id:
+        terms.append("a.habit_id = ?")
+        params.append(habit_id)
+    if start:
+        terms.append("a.month >= date(?, 'start of month')")
+        params.append(start)
+    if end:
+        terms.append("a.month < ?")
+        params.append(end)
+    return " AND ".join(terms) or "1=1", params
+
+def _has_archived(cursor: sqlite3.Cursor, where: str, params: list) -> bool:
+    cursor.execute(f"SELECT 1 FROM log_archive a WHERE {where} LIMIT 1", params)
+    return cursor.fetchone() is not None
+
+def _logs_source(cursor: sqlite3.Cursor, start: str = None, end: str = None,
+                 habit_id: int = None) -> Tuple[str, list]:
+    """A FROM source, with its parameters, for the logs dated from start and before end.
+
+    That is habit_logs itself unless an archived month overlaps the range;
+    then it is habit_logs merged with those months' archived logs, whose
+    id and notes are NULL. Callers still filter on date and habit.
+    """
+    where, params = _archive_filter(start, end, habit_id)
+    if not _has_archived(cursor, where, params):
+        return "habit_logs", []
+    return f"(SELECT id, habit_id, date, completed, notes FROM habit_logs UNION ALL {_archived_logs_sql(where)})", params
+
+@_timed_query
+def get_habit_logs(habit_id: int, days: int = 30, limit: int = None,
+                   after: Tuple[str, int] = None) -> List[Dict[str, Any]]:
+    """Get habit logs for last N days, newest first.
+
+    With limit, returns one keyset page; pass the (date, habit_id) of the
+    last row seen as after to get the next one. Archived logs have a NULL id.
+    """
     conn = get_connection()
     cursor = conn.cursor()
-    cursor.execute("""
+
+    start = _days_ago(days)
+    query = """
         SELECT * FROM habit_logs
-        WHERE habit_id = ? AND date >= date('now', ?)
-        ORDER BY date DESC
-    """, (habit_id, f'-{days} days'))
+        WHERE habit_id = ? AND date >= ?
+    """
+    params = [habit_id, start]
+
+    if after:
+        query += " AND date < ?"
+        params.append(after[0])
+
+    query += " ORDER BY date DESC"
+
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+
+    cursor.execute(query, params)
     logs = [dict(row) for row in cursor.fetchall()]
-    conn.close()
+
+    # Archived logs are read the same way and merged in. A full page only
+    # needs those dated from its last row on.
+    if limit is not None and len(logs) == limit:
+        start = max(start, logs[-1]['date'])
+    where, params = _archive_filter(start, habit_id=habit_id)
+    if _has_archived(cursor, where, params):
+        where += f" AND {_ARCHIVED_DATE_SQL} >= ?"
+        params.append(start)
+        if after:
+            where += f" AND a.month <= ? AND {_ARCHIVED_DATE_SQL} < ?"
+            params.extend([after[0], after[0]])
+        query = _archived_logs_sql(where) + " ORDER BY a.month DESC, date DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        cursor.execute(_with_notes_sql(query), params)
+        logs = sorted(logs + [dict(row) for row in cursor.fetchall()],
+                      key=lambda log: log['date'], reverse=True)[:limit]
     return logs
 
-def get_all_logs(days: int = 30) -> List[Dict[str, Any]]:
-    """Get all habit logs for analysis."""
+@_timed_query
+def get_all_logs(days: int = 30, limit: int = None,
+                 after: Tuple[str, int] = None) -> List[Dict[str, Any]]:
+    """Get all habit logs for analysis.
+
+    With limit, returns one keyset page ordered by (date, habit_id)
+    descending; pass the (date, habit_id) of the last row seen as after to
+    get the next one. Deep pages cost the same as the first. Archived logs
+    have a NULL id.
+    """
     conn = get_connection()
     cursor = conn.cursor()
-    cursor.execute("""
+
+    start = _days_ago(days)
+    query = """
         SELECT hl.*, h.name as habit_name, h.color as habit_color
         FROM habit_logs hl
         JOIN habits h ON hl.habit_id = h.id
-        WHERE hl.date >= date('now', ?)
-        ORDER BY hl.date DESC, h.name
-    """, (f'-{days} days',))
+        WHERE hl.date >= ?
+    """
+    params = [start]
+
+    if after:
+        query += " AND (hl.date, hl.habit_id) < (?, ?)"
+        params.extend(after)
+
+    if limit is None:
+        query += " ORDER BY hl.date DESC, h.name"
+    else:
+        query += " ORDER BY hl.date DESC, hl.habit_id DESC LIMIT ?"
+        params.append(limit)
+
+    cursor.execute(query, params)
     logs = [dict(row) for row in cursor.fetchall()]
-    conn.close()
+
+    # Archived logs are read the same way and merged in. A full page only
+    # needs those dated from its last row on.
+    if limit is not None and len(logs) == limit:
+        start = max(start, logs[-1]['date'])
+    where, params = _archive_filter(start)
+    if _has_archived(cursor, where, params):
+        # Skip deleted habits before the LIMIT, so a page is never cut short
+        where += f" AND {_ARCHIVED_DATE_SQL} >= ? AND a.habit_id IN (SELECT id FROM habits)"
+        params.append(start)
+        if after:
+            where += f" AND a.month <= ? AND ({_ARCHIVED_DATE_SQL}, a.habit_id) < (?, ?)"
+            params.extend([after[0], *after])
+        query = _archived_logs_sql(where)
+        if limit is not None:
+            query += " ORDER BY a.month DESC, date DESC, a.habit_id DESC LIMIT ?"
+            params.append(limit)
+        cursor.execute(_with_notes_sql(query), params)
+        archived = [dict(row) for row in cursor.fetchall()]
+        cursor.execute("SELECT id, name, color FROM habits")
+        habits = {row['id']: row for row in cursor.fetchall()}
+        for log in archived:
+            habit = habits.get(log['habit_id'])
+            if habit is not None:
+                logs.append(dict(log, habit_name=habit['name'], habit_color=habit['color']))
+        if limit is None:
+            logs.sort(key=lambda log: log['habit_name'])
+            logs.sort(key=lambda log: log['date'], reverse=True)
+        else:
+            logs = sorted(logs, key=lambda log: (log['date'], log['habit_id']), reverse=True)[:limit]
     return logs
 
 # Goal operations (NEW)
-def create_goal(habit_id: int, goal_date: str, target_count: int = 1, notes: str = None) -> int:
+@_write_transaction
+@_timed_query
+def create_goal(cursor, habit_id: int, goal_date: str, target_count: int = 1, notes: str = None) -> int:
     """Create a new goal."""
-    conn = get_connection()
-    cursor = conn.cursor()
     cursor.execute("""
         INSERT INTO goals (habit_id, goal_date, target_count, notes)
         VALUES (?, ?, ?, ?)
     """, (habit_id, goal_date, target_count, notes))
     goal_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+    _bump_data_version(cursor)
     return goal_id
 
+@_timed_query
 def get_goals(habit_id: int = None, start_date: str = None, end_date: str = None) -> List[Dict[str, Any]]:
     """Get goals, optionally filtered by habit and date range."""
     conn = get_connection()
@@ -175,148 +1229,579 @@ def get_goals(habit_id: int = None, start_date: str = None, end_date: str = None
 
     cursor.execute(query, params)
     goals = [dict(row) for row in cursor.fetchall()]
-    conn.close()
     return goals
 
+@_timed_query
 def delete_goal(goal_id: int) -> bool:
     """Delete a goal."""
     conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM goals WHERE id = ?", (goal_id,))
-    success = cursor.rowcount > 0
-    conn.commit()
-    conn.close()
+    with conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM goals WHERE id = ?", (goal_id,))
+        success = cursor.rowcount > 0
+        _bump_data_version(cursor)
     return success
 
-def get_goal_progress(goal_id: int) -> Dict[str, Any]:
-    """Get progress towards a goal."""
+@_timed_query
+def get_goals_progress(goal_ids: List[int] = None, start_date: str = None, end_date: str = None) -> List[Dict[str, Any]]:
+    """Get goals with their progress, computed for all of them in one query."""
     conn = get_connection()
     cursor = conn.cursor()
 
-    # Get goal details
-    cursor.execute("""
-        SELECT g.*, h.name as habit_name
+    # A goal's day may be archived
+    query = f"""
+        SELECT g.*, h.name as habit_name, h.color as habit_color,
+               COUNT(hl.id) + COALESCE({_archived_bit_sql('completed', 'g.habit_id', 'g.goal_date')}, 0) as completed
         FROM goals g
         JOIN habits h ON g.habit_id = h.id
-        WHERE g.id = ?
-    """, (goal_id,))
-    goal = dict(cursor.fetchone())
+        LEFT JOIN habit_logs hl
+               ON hl.habit_id = g.habit_id AND hl.date = g.goal_date AND hl.completed = 1
+        WHERE 1=1
+    """
+    params = []
 
-    if not goal:
-        return None
+    if goal_ids is not None:
+        if not goal_ids:
+            return []
+        query += f" AND g.id IN ({', '.join('?' for _ in goal_ids)})"
+        params.extend(goal_ids)
 
-    # Count completed logs for this habit on goal date
-    cursor.execute("""
-        SELECT COUNT(*) as completed_count
-        FROM habit_logs
-        WHERE habit_id = ? AND date = ?
-    """, (goal['habit_id'], goal['goal_date']))
+    if start_date:
+        query += " AND g.goal_date >= ?"
+        params.append(start_date)
 
-    result = cursor.fetchone()
-    completed = result['completed_count'] if result else 0
-    target = goal['target_count']
-    progress = min(completed / target, 1.0) if target > 0 else 1.0
+    if end_date:
+        query += " AND g.goal_date <= ?"
+        params.append(end_date)
+
+    query += " GROUP BY g.id ORDER BY g.goal_date ASC"
+
+    cursor.execute(query, params)
+    goals = []
+    for row in cursor.fetchall():
+        goal = dict(row)
+        completed = goal['completed']
+        target = goal['target_count']
+        progress = min(completed / target, 1.0) if target > 0 else 1.0
+        goal['target'] = target
+        goal['progress'] = round(progress, 2)
+        goal['achieved'] = completed >= target
+        goals.append(goal)
+    return goals
 
-    conn.close()
+@_timed_query
+def get_goal_progress(goal_id: int) -> Dict[str, Any]:
+    """Get progress towards a goal."""
+    goals = get_goals_progress([goal_id])
+    if not goals:
+        return None
 
+    goal = goals[0]
     return {
-        'goal': goal,
-        'completed': completed,
-        'target': target,
-        'progress': round(progress, 2),
-        'achieved': completed >= target
+        'goal': {k: v for k, v in goal.items() if k not in ('completed', 'target', 'progress', 'achieved')},
+        'completed': goal['completed'],
+        'target': goal['target'],
+        'progress': goal['progress'],
+        'achieved': goal['achieved']
     }
 
+@_timed_query
 def get_weekly_goals() -> List[Dict[str, Any]]:
     """Get goals for the current week."""
     today = date.today()
     start_of_week = today - timedelta(days=today.weekday())
     end_of_week = start_of_week + timedelta(days=6)
 
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT g.*, h.name as habit_name, h.color as habit_color
-        FROM goals g
-        JOIN habits h ON g.habit_id = h.id
-        WHERE g.goal_date >= ? AND g.goal_date <= ?
-        ORDER BY g.goal_date ASC
-    """, (start_of_week.isoformat(), end_of_week.isoformat()))
+    return get_goals_progress(start_date=start_of_week.isoformat(), end_date=end_of_week.isoformat())
 
-    goals = [dict(row) for row in cursor.fetchall()]
+STATS_ROLLUP_MIN_DAYS = 60   # get_stats counts shorter ranges straight from the logs
 
-    # Add progress to each goal
-    for i, goal in enumerate(goals):
-        progress = get_goal_progress(goal['id'])
-        goals[i]['completed'] = progress['completed']
-        goals[i]['target'] = progress['target']
-        goals[i]['progress'] = progress['progress']
-        goals[i]['achieved'] = progress['achieved']
+def _rollup_spans(start: date) -> Tuple[list, Tuple[date, date], date]:
+    """Cover the days from start onwards with as few rollup rows as possible.
 
-    conn.close()
-    return goals
+    Returns the (first, end) day ranges to count from habit_logs, the
+    (first, end) range of whole ISO weeks before the first whole month, and
+    that month's first day; every month from it on is read whole.
+    """
+    month = start if start.day == 1 else (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+    week = start + timedelta(days=-start.weekday() % 7)
+    if week >= month:
+        return [(start, month)], (month, month), month
+    weeks_end = week + timedelta(weeks=(month - week).days // 7)
+    return [(start, week), (weeks_end, month)], (week, weeks_end), month
+
+def _stats_filters(habit_id: int = None) -> Tuple[str, str, list]:
+    """WHERE terms selecting one habit, or every existing habit, in log_rollups and in habit_logs."""
+    if habit_id:
+        return "habit_id = ?", "habit_id = ?", [habit_id]
+    # Unary + keeps habit_logs on the date index instead of every habit's whole history
+    return "habit_id IN (SELECT id FROM habits)", "+habit_id IN (SELECT id FROM habits)", []
 
+@_timed_query
 def get_stats(habit_id: int = None, days: int = 30) -> Dict[str, Any]:
-    """Get habit statistics."""
+    """Get habit statistics for logs dated from `days` days ago (UTC) onwards.
+
+    For ranges of STATS_ROLLUP_MIN_DAYS or more, whole months and whole ISO
+    weeks come from log_rollups and only the days before the first whole
+    week or between the last whole week and the first whole month from
+    the logs, so long ranges cost a few rows per habit however much
+    history there is. Logs of deleted habits are not counted.
+    """
     conn = get_connection()
     cursor = conn.cursor()
+    today = utc_today()
+    start = today - timedelta(days=min(max(days, 0), (today - date.min).days))
+    habit_filter, log_filter, params = _stats_filters(habit_id)
+    count_logs = """
+        SELECT COUNT(*) AS logged, SUM(CASE WHEN completed = 1 THEN 1 ELSE 0 END) AS completed
+        FROM {source} WHERE"""
 
-    if habit_id:
-        cursor.execute("""
-            SELECT COUNT(*) as total_logs,
-                   SUM(CASE WHEN completed = 1 THEN 1 ELSE 0 END) as completed,
-                   AVG(CASE WHEN completed = 1 THEN 1.0 ELSE 0.0 END) as completion_rate
-            FROM habit_logs
-            WHERE habit_id = ? AND date >= date('now', ?)
-        """, (habit_id, f'-{days} days'))
+    if (today - start).days < STATS_ROLLUP_MIN_DAYS:
+        # Seeking every habit's rollups costs more than counting a few weeks of logs
+        source, args = _logs_source(cursor, start.isoformat(), habit_id=habit_id)
+        parts = [f"{count_logs.format(source=source)} date >= ? AND {log_filter}"]
+        args += [start.isoformat()] + params
     else:
-        cursor.execute("""
-            SELECT COUNT(*) as total_logs,
-                   SUM(CASE WHEN completed = 1 THEN 1 ELSE 0 END) as completed,
-                   AVG(CASE WHEN completed = 1 THEN 1.0 ELSE 0.0 END) as completion_rate
-            FROM habit_logs
-            WHERE date >= date('now', ?)
-        """, (f'-{days} days',))
+        day_ranges, (week_from, week_to), month_from = _rollup_spans(start)
+        source, args = _logs_source(cursor, start.isoformat(), month_from.isoformat(), habit_id)
+        day_filter = " OR ".join("(date >= ? AND date < ?)" for _ in day_ranges)
+        parts = [f"{count_logs.format(source=source)} ({day_filter}) AND {log_filter}"]
+        args += [d.isoformat() for r in day_ranges for d in r] + params
+        if week_from < week_to:
+            parts.append(f"""
+            SELECT SUM(logged), SUM(completed) FROM log_rollups
+            WHERE period = 'week' AND {habit_filter} AND start_date >= ? AND start_date < ?""")
+            args += params + [week_from.isoformat(), week_to.isoformat()]
+        # Open-ended, as logs may be dated after today
+        parts.append(f"""
+            SELECT SUM(logged), SUM(completed) FROM log_rollups
+            WHERE period = 'month' AND {habit_filter} AND start_date >= ?""")
+        args += params + [month_from.isoformat()]
+    cursor.execute(f"""
+        SELECT SUM(logged) AS total_logs, SUM(completed) AS completed
+        FROM ({" UNION ALL".join(parts)})
+    """, args)
 
     stats = dict(cursor.fetchone())
-    conn.close()
-
-    stats['completion_rate'] = round(stats['completion_rate'] or 0, 2)
+    if not stats['total_logs']:
+        stats = {'total_logs': 0, 'completed': None}
+    stats['completion_rate'] = round(stats['completed'] / stats['total_logs'], 2) if stats['total_logs'] else 0
     return stats
 
+STATS_PERIODS = ("day", "week", "month")
+
+def _period_start(day: date, period: str) -> date:
+    if period == "week":
+        return day - timedelta(days=day.weekday())
+    if period == "month":
+        return day.replace(day=1)
+    return day
+
+def _next_period(start: date, period: str) -> date:
+    if period == "week":
+        return start + timedelta(weeks=1)
+    if period == "month":
+        return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return start + timedelta(days=1)
+
+@_timed_query
+def get_stats_series(period: str, start_date: date, end_date: date, habit_id: int = None) -> List[Dict[str, Any]]:
+    """Logged and completed counts for each day, ISO week or month from start_date to end_date.
+
+    Weeks and months are read from log_rollups, one row per habit and
+    period; days are counted from the logs. Periods without logs are
+    included with zero counts. Logs of deleted habits are not counted.
+    """
+    if period not in STATS_PERIODS:
+        raise ValueError(f"period must be one of {', '.join(STATS_PERIODS)}")
+    first = _period_start(start_date, period)
+    conn = get_connection()
+    cursor = conn.cursor()
+
+    habit_filter, log_filter, params = _stats_filters(habit_id)
+    if period == "day":
+        source, source_params = _logs_source(cursor, first.isoformat(),
+                                             (end_date + timedelta(days=1)).isoformat(), habit_id)
+        cursor.execute(f"""
+            SELECT date AS start_date, COUNT(*) AS logged, SUM(CASE WHEN completed = 1 THEN 1 ELSE 0 END) AS completed
+            FROM {source}
+            WHERE date >= ? AND date <= ? AND {log_filter}
+            GROUP BY date
+        """, source_params + [first.isoformat(), end_date.isoformat()] + params)
+    else:
+        cursor.execute(f"""
+            SELECT start_date, SUM(logged) AS logged, SUM(completed) AS completed
+            FROM log_rollups
+            WHERE period = ? AND {habit_filter} AND start_date >= ? AND start_date <= ?
+            GROUP BY start_date
+        """, [period] + params + [first.isoformat(), end_date.isoformat()])
+    counts = {row['start_date']: (row['logged'], row['completed']) for row in cursor.fetchall()}
+
+    series = []
+    start = first
+    while start <= end_date:
+        logged, completed = counts.get(start.isoformat(), (0, 0))
+        series.append({
+            "start": start.isoformat(),
+            "logged": logged,
+            "completed": completed,
+            "completion_rate": round(completed / logged, 2) if logged else None
+        })
+        start = _next_period(start, period)
+    return series
+
+@_timed_query
 def get_habit_streaks() -> List[Dict[str, Any]]:
     """Get current streaks for all habits."""
     conn = get_connection()
     cursor = conn.cursor()
 
+    # A stored streak is only current if its last day is today
     cursor.execute("""
-        WITH ranked_logs AS (
-            SELECT
-                habit_id,
-                date,
-                completed,
-                ROW_NUMBER() OVER (PARTITION BY habit_id ORDER BY date DESC) as rn
-            FROM habit_logs
-            WHERE completed = 1
-        ),
-        streaks AS (
-            SELECT
-                habit_id,
-                COUNT(*) as current_streak
-            FROM ranked_logs
-            WHERE date = date('now', '-' || (rn - 1) || ' days')
-            GROUP BY habit_id
-        )
         SELECT
             h.id,
             h.name,
             h.color,
-            COALESCE(s.current_streak, 0) as current_streak
+            CASE WHEN s.last_completed_date = ? THEN s.current_streak ELSE 0 END as current_streak,
+            COALESCE(s.longest_streak, 0) as longest_streak,
+            s.last_completed_date
         FROM habits h
-        LEFT JOIN streaks s ON h.id = s.habit_id
-        ORDER BY s.current_streak DESC
-    """)
+        LEFT JOIN habit_streaks s ON h.id = s.habit_id
+        ORDER BY current_streak DESC
+    """, (date.today().isoformat(),))
 
     streaks = [dict(row) for row in cursor.fetchall()]
-    conn.close()
     return streaks
+
+@_timed_query
+def get_completion_history(days: int = 365) -> Dict[str, Any]:
+    """Get the last `days` days of completions and goals as day numbers, for feature extraction.
+
+    With days=None the window starts at the earliest day any habit was
+    tracked, but no more than MAX_HISTORY_DAYS ago.
+    """
+    end_day = date.today().toordinal()
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.row_factory = None
+
+    # A habit is tracked from its creation or its first log, whichever is earlier
+    first_archived = _archived_logs_sql(
+        "a.habit_id = h.id AND a.month = (SELECT MIN(month) FROM log_archive WHERE habit_id = h.id)")
+    cursor.execute(f"""
+        SELECT h.id, h.name,
+               MIN(CAST(julianday(h.created_at) - 1721424.5 AS INTEGER),
+                   COALESCE((SELECT {_DAY_SQL.replace('date', 'MIN(date)')} FROM habit_logs WHERE habit_id = h.id), {end_day}),
+                   COALESCE((SELECT {_DAY_SQL.replace('date', 'MIN(date)')} FROM ({first_archived})), {end_day}))
+        FROM habits h
+        ORDER BY h.name
+    """)
+    habits = cursor.fetchall()
+
+    if days is None:
+        start_day = max(min([h[2] for h in habits] + [end_day]), end_day - MAX_HISTORY_DAYS)
+    else:
+        start_day = end_day - days + 1
+    start = date.fromordinal(start_day).isoformat()
+
+    cursor.execute(f"""
+        SELECT habit_id, {_DAY_SQL} FROM habit_logs
+        WHERE date >= ? AND completed = 1
+    """, (start,))
+    completed = cursor.fetchall()
+
+    completed += _archived_completed_days(cursor, start_day, end_day)
+
+    cursor.execute(f"""
+        SELECT habit_id, {_DAY_SQL.replace('date', 'goal_date')}, target_count FROM goals
+        WHERE goal_date >= ? AND goal_date <= ?
+    """, (start, date.fromordinal(end_day).isoformat()))
+    goals = cursor.fetchall()
+
+    return {
+        "start_day": start_day,
+        "end_day": end_day,
+        "habits": habits,
+        "completed": completed,
+        "goals": goals
+    }
+
+def _archived_completed_days(cursor: sqlite3.Cursor, start_day: int, end_day: int) -> List[tuple]:
+    """(habit_id, day number) of the archived completions from start_day to end_day."""
+    where, params = _archive_filter(date.fromordinal(start_day).isoformat())
+    where += " AND a.month <= ?"
+    params.append(date.fromordinal(end_day).isoformat())
+    if not _has_archived(cursor, where, params):
+        return []
+    cursor.execute(f"""
+        SELECT a.habit_id, {_ARCHIVED_DAY_SQL} FROM log_archive a JOIN month_days d ON (a.completed >> d.n) & 1
+        WHERE {where} AND {_ARCHIVED_DAY_SQL} BETWEEN ? AND ?
+    """, params + [start_day, end_day])
+    return cursor.fetchall()
+
+@_timed_query
+def get_completed_days(start_date: str, end_date: str) -> Dict[str, Any]:
+    """Get every habit and its completions from start_date to end_date as day numbers."""
+    start_day, end_day = date.fromisoformat(start_date).toordinal(), date.fromisoformat(end_date).toordinal()
+    with read_snapshot() as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        cursor.execute("SELECT id, name, color FROM habits ORDER BY name")
+        habits = cursor.fetchall()
+        cursor.execute(f"""
+            SELECT habit_id, {_DAY_SQL} FROM habit_logs
+            WHERE date >= ? AND date <= ? AND completed = 1
+        """, (start_date, end_date))
+        completed = cursor.fetchall() + _archived_completed_days(cursor, start_day, end_day)
+    return {
+        "start_day": start_day,
+        "end_day": end_day,
+        "habits": habits,
+        "completed": completed
+    }
+
+@_timed_query
+def get_dashboard() -> Dict[str, Any]:
+    """Get everything the dashboard shows, read from a single snapshot."""
+    today = date.today().isoformat()
+    with read_snapshot():
+        habits = get_habits()
+        streaks = get_habit_streaks()
+        stats = get_stats(days=30)
+        logs = get_all_logs(days=7)  # Last 7 days
+        weekly_goals = get_weekly_goals()
+
+    return {
+        "habits": habits,
+        "streaks": streaks,
+        "stats": stats,
+        "logs": logs,
+        "today_logs": {log["habit_id"]: log for log in logs if log["date"] == today},
+        "today": today,
+        "weekly_goals": weekly_goals
+    }
+
+# Export
+EXPORT_BATCH_SIZE = 1000      # rows fetched per round trip while exporting
+EXPORT_TABLES = {
+    "habits": ("habits", ["id", "name", "color", "created_at"], None),
+    "logs": ("habit_logs", ["id", "habit_id", "date", "completed", "notes"], "date"),
+    "goals": ("goals", ["id", "habit_id", "goal_date", "target_count", "notes", "created_at"], "goal_date"),
+}
+
+def iter_export(tables: List[str], habit_id: int = None, start_date: str = None,
+                end_date: str = None) -> Iterator[Tuple[str, List[str], List[tuple]]]:
+    """Yield (table, columns, rows) batches of EXPORT_BATCH_SIZE rows for each table.
+
+    The export runs on its own connection inside one read transaction, so
+    every batch comes from the same snapshot and memory use stays bounded
+    by the batch size no matter how large the tables are.
+    """
+    # Resolve the database now; the batches may be pulled from another context
+    profile = current_profile() if PROFILING_ENABLED else None
+    return _iter_export(current_db_path(), tables, habit_id, start_date, end_date, profile)
+
+def _iter_export(path: str, tables: List[str], habit_id: int, start_date: str,
+                 end_date: str, profile=None) -> Iterator[Tuple[str, List[str], List[tuple]]]:
+    # A tenant's first request may be an export
+    if path not in _initialized_paths:
+        _initialize_path(path)
+    conn = _open_connection(path)
+    conn.row_factory = None
+    try:
+        with profile.trace_sql(conn, "iter_export") if profile else nullcontext():
+            yield from _export_batches(conn, tables, habit_id, start_date, end_date)
+    finally:
+        conn.close()
+
+def _export_batches(conn: sqlite3.Connection, tables: List[str], habit_id: int, start_date: str,
+                    end_date: str) -> Iterator[Tuple[str, List[str], List[tuple]]]:
+    conn.execute("BEGIN")
+    for table in tables:
+        table_name, columns, date_column = EXPORT_TABLES[table]
+        params = []
+        if table_name == "habit_logs":
+            # Archived logs are exported too, with an empty id
+            table_name, params = _logs_source(conn.cursor(), start_date, habit_id=habit_id)
+            if table_name != "habit_logs":
+                table_name = f"({_with_notes_sql('SELECT * FROM ' + table_name)})"
+        query = f"SELECT {', '.join(columns)} FROM {table_name} WHERE 1=1"
+
+        if habit_id:
+            query += f" AND {'id' if table == 'habits' else 'habit_id'} = ?"
+            params.append(habit_id)
+
+        if date_column and start_date:
+            query += f" AND {date_column} >= ?"
+            params.append(start_date)
+
+        if date_column and end_date:
+            query += f" AND {date_column} <= ?"
+            params.append(end_date)
+
+        query += f" ORDER BY {date_column + ', ' if date_column else ''}id"
+
+        cursor = conn.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(EXPORT_BATCH_SIZE)
+            if not rows:
+                break
+            yield table, columns, rows
+    conn.execute("COMMIT")
+
+# Streak maintenance
+#
+# streak_runs holds one row per run of consecutive completed days, so a
+# log change only touches the runs next to that day, and habit_streaks
+# caches the latest and longest run for each habit.
+def _add_streak_day(cursor: sqlite3.Cursor, habit_id: int, day: int):
+    """Mark a day completed, extending or merging the neighbouring runs."""
+    cursor.execute(
+        "SELECT start_day FROM streak_runs WHERE habit_id = ? AND end_day = ?",
+        (habit_id, day - 1)
+    )
+    before = cursor.fetchone()
+    cursor.execute(
+        "SELECT end_day FROM streak_runs WHERE habit_id = ? AND start_day = ?",
+        (habit_id, day + 1)
+    )
+    after = cursor.fetchone()
+
+    start = before['start_day'] if before else day
+    end = after['end_day'] if after else day
+    if after:
+        cursor.execute(
+            "DELETE FROM streak_runs WHERE habit_id = ? AND start_day = ?",
+            (habit_id, day + 1)
+        )
+    cursor.execute(
+        "INSERT OR REPLACE INTO streak_runs (habit_id, start_day, end_day) VALUES (?, ?, ?)",
+        (habit_id, start, end)
+    )
+    _refresh_habit_streak(cursor, habit_id)
+
+def _remove_streak_day(cursor: sqlite3.Cursor, habit_id: int, day: int):
+    """Mark a day not completed, shrinking or splitting the run containing it."""
+    cursor.execute("""
+        SELECT start_day, end_day FROM streak_runs
+        WHERE habit_id = ? AND start_day <= ?
+        ORDER BY start_day DESC LIMIT 1
+    """, (habit_id, day))
+    run = cursor.fetchone()
+    if not run or run['end_day'] < day:
+        return
+
+    start, end = run['start_day'], run['end_day']
+    cursor.execute(
+        "DELETE FROM streak_runs WHERE habit_id = ? AND start_day = ?",
+        (habit_id, start)
+    )
+    pieces = [(start, day - 1), (day + 1, end)]
+    cursor.executemany(
+        "INSERT INTO streak_runs (habit_id, start_day, end_day) VALUES (?, ?, ?)",
+        [(habit_id, s, e) for s, e in pieces if s <= e]
+    )
+    _refresh_habit_streak(cursor, habit_id)
+
+def _refresh_habit_streak(cursor: sqlite3.Cursor, habit_id: int):
+    """Recompute a habit's cached streak row from its latest and longest runs."""
+    cursor.execute("""
+        SELECT start_day, end_day FROM streak_runs
+        WHERE habit_id = ?
+        ORDER BY start_day DESC LIMIT 1
+    """, (habit_id,))
+    latest = cursor.fetchone()
+    if not latest:
+        cursor.execute("DELETE FROM habit_streaks WHERE habit_id = ?", (habit_id,))
+        return
+
+    cursor.execute("""
+        SELECT end_day - start_day + 1 as longest FROM streak_runs
+        WHERE habit_id = ?
+        ORDER BY end_day - start_day DESC LIMIT 1
+    """, (habit_id,))
+    longest = cursor.fetchone()['longest']
+    cursor.execute("""
+        INSERT OR REPLACE INTO habit_streaks (habit_id, current_streak, longest_streak, last_completed_date)
+        VALUES (?, ?, ?, ?)
+    """, (
+        habit_id,
+        latest['end_day'] - latest['start_day'] + 1,
+        longest,
+        date.fromordinal(latest['end_day']).isoformat()
+    ))
+
+@_timed_query
+def rebuild_streaks(habit_ids: Iterable[int] = None):
+    """Recompute streak state from scratch out of the logs, archived ones included (all habits by default)."""
+    habit_filter = "1=1"
+    if habit_ids is not None:
+        habit_filter = f"habit_id IN ({', '.join(str(int(h)) for h in habit_ids)})"
+    conn = get_connection()
+    try:
+        conn.executescript(
+            "BEGIN IMMEDIATE;\n"
+            + _rebuild_streaks_sql(habit_filter, _ALL_LOGS_SQL)
+            + f"\n{_BUMP_DATA_VERSION_SQL};\nCOMMIT;"
+        )
+    except Exception:
+        # executescript stops at the failing statement, inside the BEGIN
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+
+# Cold history
+@_timed_query
+def archive_cold_logs(horizon_days: int = ARCHIVE_AFTER_DAYS) -> Dict[str, Any]:
+    """Fold the logs of months that ended over horizon_days ago into log_archive.
+
+    Only whole months are archived, and only logs with well-formed dates.
+    Safe to run again at any time: logs written since for an archived month
+    are merged into its bitmaps. The freed pages are reused by later
+    writes; VACUUM to shrink the file.
+    """
+    if horizon_days < 0:
+        raise ValueError("horizon_days must not be negative")
+    before = date.fromisoformat(_days_ago(horizon_days)).replace(day=1).isoformat()
+    cold = "date < ? AND date = date(date) AND habit_id IN (SELECT id FROM habits)"
+    bit = _DAY_BIT_SQL.format(d="date")
+    conn = get_connection()
+    with conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            INSERT INTO log_archive (habit_id, month, logged, completed)
+            SELECT habit_id, date(date, 'start of month'),
+                   SUM(1 << {bit}), SUM(CASE WHEN completed = 1 THEN 1 << {bit} ELSE 0 END)
+            FROM habit_logs WHERE {cold}
+            GROUP BY habit_id, date(date, 'start of month')
+            ON CONFLICT (habit_id, month) DO UPDATE
+            SET logged = logged | excluded.logged, completed = completed | excluded.completed
+        """, (before,))
+        months = cursor.rowcount
+        cursor.execute(f"""
+            INSERT OR REPLACE INTO log_archive_notes (habit_id, date, notes)
+            SELECT habit_id, date, notes FROM habit_logs WHERE {cold} AND notes IS NOT NULL
+        """, (before,))
+        cursor.execute(f"DELETE FROM habit_logs WHERE {cold}", (before,))
+        archived = cursor.rowcount
+        if archived:
+            _bump_data_version(cursor)
+    return {"archived_logs": archived, "months": months, "before": before}
+
+if __name__ == "__main__":
+    import sys
+
+    if sys.argv[1:] == ["rebuild-streaks"]:
+        init_db()
+        rebuild_streaks()
+        print("Streaks rebuilt.")
+    elif sys.argv[1:2] == ["archive-logs"] and len(sys.argv) <= 3:
+        init_db()
+        result = archive_cold_logs(int(sys.argv[2]) if len(sys.argv) == 3 else ARCHIVE_AFTER_DAYS)
+        get_connection().execute("VACUUM")
+        print(f"Archived {result['archived_logs']} logs dated before {result['before']} "
+              f"into {result['months']} habit-months.")
+    else:
+        print("Usage: python database.py rebuild-streaks")
+        print("       python database.py archive-logs [HORIZON_DAYS]")
+        sys.exit(1)
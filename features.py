@@ -0,0 +1,247 @@
+import os
+from itertools import chain
+from typing import List, Dict, Any, Tuple
+
+import numpy as np
+
+# Feature extraction settings
+FEATURE_HISTORY_DAYS = int(os.getenv("FEATURE_HISTORY_DAYS", "365"))  # days of history analysed
+TREND_DAYS = 90               # the trend slope is fitted over this many recent days
+MIN_TREND_DAYS = 14           # fewer tracked days than this gives no trend
+WEEKDAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+
+def completion_matrix(history: Dict[str, Any]) -> Tuple[np.ndarray, np.ndarray]:
+    """Build habits×days (completed, tracked) boolean matrices from get_completion_history().
+
+    Rows follow history["habits"]; column 0 is start_day. A habit is tracked
+    from its first day onwards.
+    """
+    start_day, end_day = history["start_day"], history["end_day"]
+    n_days = end_day - start_day + 1
+    habits = history["habits"]
+    ids = np.array([h[0] for h in habits], dtype=np.int64)
+    first_day = np.array([h[2] for h in habits], dtype=np.int64)
+
+    days = start_day + np.arange(n_days)
+    tracked = days[None, :] >= first_day[:, None]
+
+    completed = completed_days_matrix(ids, history["completed"], start_day, n_days)
+    return completed & tracked, tracked
+
+
+def completed_days_matrix(ids: np.ndarray, completed: List[tuple], start_day: int, n_days: int) -> np.ndarray:
+    """Build a habits×days boolean matrix with each fetched (habit_id, day) row set.
+
+    Rows follow ids; column 0 is start_day. Unknown habits and days outside
+    the range are dropped.
+    """
+    matrix = np.zeros((len(ids), n_days), dtype=bool)
+    if len(ids) and completed:
+        rows, cols, _ = _cells(ids, _int_array(completed, 2), start_day, n_days)
+        matrix[rows, cols] = True
+    return matrix
+
+
+def _int_array(rows: List[tuple], width: int) -> np.ndarray:
+    """Turn fetched rows of integers into an (n, width) array without per-row conversion."""
+    flat = np.fromiter(chain.from_iterable(rows), dtype=np.int64, count=len(rows) * width)
+    return flat.reshape(-1, width)
+
+
+def _cells(ids: np.ndarray, pairs: np.ndarray, start_day: int, n_days: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Map (habit_id, day, ...) rows to matrix (row, column), dropping unknown habits and days.
+
+    Also returns the mask of input rows that were kept.
+    """
+    order = np.argsort(ids)
+    pos = np.searchsorted(ids, pairs[:, 0], sorter=order).clip(max=len(ids) - 1)
+    rows = order[pos]
+    cols = pairs[:, 1] - start_day
+    valid = (ids[rows] == pairs[:, 0]) & (cols >= 0) & (cols < n_days)
+    return rows[valid], cols[valid], valid
+
+
+def ratio(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+    """Element-wise numerator / denominator, NaN where the denominator is zero."""
+    return np.divide(numerator, denominator, out=np.full(np.shape(denominator), np.nan),
+                     where=denominator > 0)
+
+
+def completion_rate(done: np.ndarray, tracked: np.ndarray) -> np.ndarray:
+    """Completed over tracked days along the last axis; NaN where nothing was tracked."""
+    return ratio(done.sum(axis=-1), tracked.sum(axis=-1))
+
+
+def rolling_sum(values: np.ndarray, window: int) -> np.ndarray:
+    """Sum of each trailing `window`-day span along the days axis."""
+    csum = np.concatenate([np.zeros((values.shape[0], 1)), values.cumsum(axis=1)], axis=1)
+    start = np.maximum(np.arange(1, values.shape[1] + 1) - window, 0)
+    return csum[:, 1:] - csum[:, start]
+
+
+def round_floats(values: np.ndarray, digits: int = 3) -> List[Any]:
+    """Round to plain floats for JSON, with None in place of NaN."""
+    return [None if v != v else v for v in np.round(values, digits).tolist()]
+
+
+def extract_features(history: Dict[str, Any]) -> Dict[str, Any]:
+    """Derive completion rates, weekday profiles, trends and goal hit rates for every habit.
+
+    All habits are processed together on the habits×days matrix, so the
+    cost grows with the history length rather than with per-habit queries.
+    """
+    done, tracked = completion_matrix(history)
+    start_day = history["start_day"]
+    n_habits, n_days = done.shape
+    done_f, tracked_f = done.astype(np.float64), tracked.astype(np.float64)
+
+    # Rolling 7/30-day rates, read at today and 30 days earlier
+    rolling = {}
+    for window in (7, 30):
+        rolling[window] = ratio(rolling_sum(done_f, window), rolling_sum(tracked_f, window))
+    rate_30_prev = rolling[30][:, -31] if n_days > 30 else np.full(n_habits, np.nan)
+
+    # Weekday profile; day numbers are ordinals, and ordinal 1 was a Monday
+    weekday = (start_day + np.arange(n_days) - 1) % 7
+    onehot = (weekday[:, None] == np.arange(7)).astype(np.float64)
+    done_by_weekday, tracked_by_weekday = done_f @ onehot, tracked_f @ onehot
+    weekday_rates = ratio(done_by_weekday, tracked_by_weekday)
+    overall_weekday = ratio(done_by_weekday.sum(axis=0), tracked_by_weekday.sum(axis=0))
+
+    # Trend: least-squares slope of daily completion over tracked recent days, per week
+    x = np.arange(n_days)[-TREND_DAYS:] / 7.0
+    mask, y = tracked_f[:, -TREND_DAYS:], done_f[:, -TREND_DAYS:]
+    count = mask.sum(axis=1)
+    safe_count = np.maximum(count, 1)
+    dx = (x[None, :] - ((mask * x).sum(axis=1) / safe_count)[:, None]) * mask
+    dy = (y - (y.sum(axis=1) / safe_count)[:, None]) * mask
+    var = (dx * dx).sum(axis=1)
+    trend = np.divide((dx * dy).sum(axis=1), var, out=np.full(n_habits, np.nan),
+                      where=(count >= MIN_TREND_DAYS) & (var > 0))
+
+    # Goals settle at the end of their day; today's count once met
+    goals_set = np.zeros(n_habits, dtype=np.int64)
+    goals_hit = np.zeros(n_habits, dtype=np.int64)
+    if n_habits and history["goals"]:
+        goals = _int_array(history["goals"], 3)
+        ids = np.array([h[0] for h in history["habits"]], dtype=np.int64)
+        rows, cols, kept = _cells(ids, goals, start_day, n_days)
+        hit = done[rows, cols] >= goals[kept, 2]
+        settled = hit | (cols < n_days - 1)
+        goals_set = np.bincount(rows[settled], minlength=n_habits)
+        goals_hit = np.bincount(rows[settled & hit], minlength=n_habits)
+
+    rate_7, rate_30 = rolling[7][:, -1], rolling[30][:, -1]
+    rate_all = completion_rate(done, tracked)
+    tracked_30 = tracked[:, -30:].sum(axis=1)
+    columns = {
+        "rate_7": round_floats(rate_7), "rate_30": round_floats(rate_30), "rate_30_prev": round_floats(rate_30_prev),
+        "rate_all": round_floats(rate_all), "trend": round_floats(trend, 4),
+    }
+    habits = []
+    for i, (habit_id, name, _) in enumerate(history["habits"]):
+        habit = {"id": habit_id, "name": name, "tracked_days": int(tracked[i].sum()),
+                 "tracked_30": int(tracked_30[i])}
+        habit.update({key: values[i] for key, values in columns.items()})
+        habit["weekday_rates"] = round_floats(weekday_rates[i])
+        habit["goals_set"], habit["goals_hit"] = int(goals_set[i]), int(goals_hit[i])
+        habits.append(habit)
+
+    return {
+        "days": n_days,
+        "habits": habits,
+        "weekday_rates": round_floats(overall_weekday)
+    }
+
+
+# Prompt summary
+def estimate_tokens(text: str) -> int:
+    """Rough token count; about four characters per token for English text."""
+    return len(text) // 4 + 1
+
+
+def _pct(rate: float) -> str:
+    return "n/a" if rate is None else f"{rate * 100:.0f}%"
+
+
+def _weekday_extremes(rates: List[float]) -> str:
+    known = [(rate, day) for rate, day in zip(rates, WEEKDAYS) if rate is not None]
+    if len(known) < 7:
+        return ""
+    best, worst = max(known), min(known)
+    if best[0] - worst[0] < 0.1:
+        return "; even across weekdays"
+    return f"; best {best[1]} {_pct(best[0])}, worst {worst[1]} {_pct(worst[0])}"
+
+
+def _habit_line(habit: Dict[str, Any], streak: Dict[str, Any]) -> str:
+    line = f"- {habit['name']}: 30d {_pct(habit['rate_30'])} (7d {_pct(habit['rate_7'])}"
+    if habit["rate_30_prev"] is not None:
+        line += f", prior 30d {_pct(habit['rate_30_prev'])}"
+    line += f", {habit['tracked_days']}d overall {_pct(habit['rate_all'])})"
+    if habit["trend"] is not None:
+        line += f"; trend {habit['trend'] * 100:+.1f} pts/week"
+    line += _weekday_extremes(habit["weekday_rates"])
+    if streak:
+        line += f"; streak {streak.get('current_streak', 0)} (longest {streak.get('longest_streak', 0)})"
+    if habit["goals_set"]:
+        line += f"; goals hit {habit['goals_hit']}/{habit['goals_set']}"
+    return line + "\n"
+
+
+def summarize_habit_data(habit_data: Dict[str, Any], max_tokens: int) -> str:
+    """Summarise habit data for the insight prompt within roughly max_tokens tokens.
+
+    Lines are added in priority order: the overview, this week's goals, one
+    line per habit (most recently active first), then open goals; whatever
+    no longer fits is dropped or folded into a one-line remainder.
+    """
+    features = habit_data.get("features") or {"days": 0, "habits": [], "weekday_rates": [None] * 7}
+    stats = habit_data.get("stats", {})
+    streaks = {s["id"]: s for s in habit_data.get("streaks", [])}
+    weekly_goals = habit_data.get("weekly_goals", [])
+
+    parts: List[str] = []
+    used = 0
+
+    def add(text: str) -> bool:
+        nonlocal used
+        cost = estimate_tokens(text)
+        if used + cost > max_tokens:
+            return False
+        parts.append(text)
+        used += cost
+        return True
+
+    habits = features["habits"]
+    add(f"{len(habits)} habits tracked; rates are completed days over tracked days, "
+        f"history covers the last {features['days']} days.\n")
+    if stats.get("total_logs"):
+        add(f"Last 30 days: {stats.get('completed') or 0} of {stats['total_logs']} logged "
+            f"activities completed ({_pct(stats.get('completion_rate', 0))}).\n")
+    if any(rate is not None for rate in features["weekday_rates"]):
+        add("Completion by weekday: " + ", ".join(
+            f"{day} {_pct(rate)}" for day, rate in zip(WEEKDAYS, features["weekday_rates"])) + ".\n")
+    if weekly_goals:
+        achieved = sum(1 for g in weekly_goals if g.get("achieved"))
+        add(f"This week's goals: {achieved} of {len(weekly_goals)} achieved so far.\n")
+
+    if habits:
+        add("\nPer habit:\n")
+        ranked = sorted(habits, key=lambda h: (-h["tracked_30"], -(h["rate_30"] or 0), h["name"]))
+        for shown, habit in enumerate(ranked):
+            if not add(_habit_line(habit, streaks.get(habit["id"]))):
+                rest = [h["rate_30"] for h in ranked[shown:] if h["rate_30"] is not None]
+                average = sum(rest) / len(rest) if rest else None
+                add(f"- ...and {len(ranked) - shown} more habits, averaging {_pct(average)} over 30d\n")
+                break
+
+    open_goals = [g for g in weekly_goals if not g.get("achieved")]
+    if open_goals and add("\nOpen goals this week:\n"):
+        for goal in open_goals:
+            if not add(f"- {goal.get('goal_date', '')}: {goal.get('habit_name', 'Unknown')} "
+                       f"({goal.get('completed', 0)}/{goal.get('target', 0)})\n"):
+                break
+
+    return "".join(parts)
@@ -1,18 +1,36 @@
-from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi import FastAPI, HTTPException, Request, Query
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse, Response
 from fastapi.staticfiles import StaticFiles
+from starlette.routing import Match
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
-from typing import List, Optional
-from datetime import date, timedelta
+from typing import List, Dict, Any, Optional, AsyncIterator
+from datetime import date, datetime, timedelta, timezone
 import os
+import io
+import csv
+import json
+import time
+import hashlib
+import base64
+import asyncio
 
 from database import (
-    init_db, create_habit, get_habits, delete_habit,
-    log_habit, get_habit_logs, get_all_logs, get_stats, get_habit_streaks,
-    create_goal, get_goals, delete_goal, get_goal_progress, get_weekly_goals
+    init_db, close_connections, run_db, shutdown_db_workers, create_habit, get_habits, delete_habit,
+    log_habit, bulk_log_habits, rebuild_streaks, BULK_CHUNK_SIZE, get_habit_logs, get_all_logs, get_stats, get_habit_streaks,
+    get_stats_series, STATS_PERIODS,
+    create_goal, get_goals, delete_goal, get_goal_progress, get_goals_progress,
+    get_weekly_goals, get_dashboard, read_snapshot, get_data_version, iter_export, EXPORT_TABLES,
+    get_latest_insights, save_latest_insights, get_completion_history,
+    GROUP_COMMIT, start_group_commit, stop_group_commit, group_commit_metrics,
+    TENANT_DIR, use_tenant, current_db_path, utc_today
 )
-from ai import get_ai_client, get_active_provider
+from features import extract_features, FEATURE_HISTORY_DAYS
+import analytics
+import metrics
+from metrics import http_request_seconds
+from profiling import PROFILING_ENABLED, ProfileMiddleware
+from ai import get_ai_client, get_active_provider, close_ai_client, insights_cache, SingleFlight, StreamFlight, INSIGHTS_UNAVAILABLE
 
 # Initialize app
 app = FastAPI(title="Habit Tracker AI")
@@ -26,7 +44,135 @@ templates = Jinja2Templates(directory="templates")
 # Initialize database on startup
 @app.on_event("startup")
 def startup_event():
-    init_db()
+    if not TENANT_DIR:
+        init_db()  # Tenant databases are initialized on first access
+    if GROUP_COMMIT:
+        start_group_commit()
+
+@app.on_event("startup")
+async def open_ai_client():
+    global _insights_scheduler_task
+    try:
+        client = get_ai_client()
+    except ValueError:
+        return  # No provider configured; /api/insights reports it
+    await client.open()
+    # The scheduler keeps one database warm; tenants rely on refresh-on-request
+    if INSIGHTS_REFRESH_POLL > 0 and not TENANT_DIR:
+        _insights_scheduler_task = asyncio.create_task(_insights_scheduler(client))
+
+@app.on_event("shutdown")
+def shutdown_event():
+    stop_group_commit()
+    shutdown_db_workers()
+    close_connections()
+
+@app.on_event("shutdown")
+async def shutdown_ai_client():
+    if _insights_scheduler_task is not None:
+        _insights_scheduler_task.cancel()
+    await close_ai_client()
+
+# Conditional GET: every write bumps the data version, so a GET response
+# stays valid while the version and the day are unchanged. Streaks are
+# relative to the local date and the `days` windows to the UTC date, so
+# the tag carries both. A matching If-None-Match gets a 304
+# before any query runs. Registered before route_tenant so it runs inside it.
+_NOT_CONDITIONAL = ("/static/", "/api/insights", "/api/export", "/metrics")
+
+def _data_etag(data_version: int) -> str:
+    tag = f"{data_version}-{date.today().isoformat()}-{utc_today().isoformat()}"
+    if TENANT_DIR:
+        tag = f"{hashlib.sha256(current_db_path().encode()).hexdigest()[:12]}-{tag}"
+    return f'"{tag}"'
+
+def _etag_matches(etag: str, if_none_match: Optional[str]) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [c.strip() for c in if_none_match.split(",")]
+    return "*" in candidates or any((c[2:] if c.startswith("W/") else c) == etag for c in candidates)
+
+@app.middleware("http")
+async def conditional_get(request: Request, call_next):
+    if request.method != "GET" or request.url.path.startswith(_NOT_CONDITIONAL):
+        return await call_next(request)
+    # Read the version before the endpoint reads the data, so a tag is never newer than its body
+    etag = _data_etag(await run_db(get_data_version))
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if _etag_matches(etag, request.headers.get("if-none-match")):
+        return Response(status_code=304, headers=headers)
+    response = await call_next(request)
+    if response.status_code == 200:
+        response.headers.update(headers)
+    return response
+
+# Multi-tenant routing: an authenticating proxy in front of the app sets
+# TENANT_HEADER to the signed-in user, and each user gets their own database
+TENANT_HEADER = os.getenv("TENANT_HEADER", "X-Forwarded-User")
+
+@app.middleware("http")
+async def route_tenant(request: Request, call_next):
+    if not TENANT_DIR or request.url.path.startswith("/static/") or request.url.path == "/metrics":
+        return await call_next(request)
+    tenant_id = request.headers.get(TENANT_HEADER)
+    if not tenant_id:
+        return JSONResponse({"detail": "Not authenticated"}, status_code=401)
+    with use_tenant(tenant_id):
+        return await call_next(request)
+
+# Request timing for /metrics. Added after the app's other middlewares, so
+# it runs outside them and the time they spend is included; only
+# ProfileMiddleware, when enabled, wraps it.
+class MetricsMiddleware:
+    """ASGI middleware timing every HTTP request into http_request_seconds.
+
+    Requests are labelled by route template (/api/habits/{habit_id}), not by
+    raw path, so the number of series stays bounded. It is a plain ASGI
+    class rather than an @app.middleware function so that it adds no task
+    per request and times streamed bodies until their last chunk.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._paths = None  # endpoint -> route path, built on first use
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = 500
+
+        async def send_timed(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_timed)
+        finally:
+            http_request_seconds.observe(time.perf_counter() - started,
+                                         scope["method"], self._route(scope), str(status))
+
+    def _route(self, scope) -> str:
+        routes = scope["app"].routes
+        if self._paths is None:
+            self._paths = {getattr(route, "endpoint", getattr(route, "app", None)): route.path for route in routes}
+        path = self._paths.get(scope.get("endpoint"))
+        if path is not None:
+            return path
+        # Answered before routing (e.g. a 304); match the route ourselves
+        for route in routes:
+            if route.matches(scope)[0] == Match.FULL:
+                return route.path
+        return "unmatched"
+
+app.add_middleware(MetricsMiddleware)
+
+# Opt-in request profiling (see profiling.py); outermost, so it sees the whole request
+if PROFILING_ENABLED:
+    app.add_middleware(ProfileMiddleware)
 
 # Models
 class HabitCreate(BaseModel):
@@ -48,17 +194,7 @@ class GoalCreate(BaseModel):
 @app.get("/", response_class=HTMLResponse)
 async def index(request: Request):
     """Render main dashboard."""
-    habits = get_habits()
-    streaks = get_habit_streaks()
-    stats = get_stats(days=30)
-    logs = get_all_logs(days=7)  # Last 7 days
-
-    # Get today's logs
-    today = date.today().isoformat()
-    today_logs = {log["habit_id"]: log for log in logs if log["date"] == today}
-
-    # Get weekly goals
-    weekly_goals = get_weekly_goals()
+    dashboard = await run_db(get_dashboard)
 
     # Get calendar data for this week
     today_date = date.today()
@@ -67,32 +203,31 @@ async def index(request: Request):
 
     return templates.TemplateResponse("index.html", {
         "request": request,
-        "habits": habits,
-        "streaks": streaks,
-        "stats": stats,
-        "logs": logs,
-        "today_logs": today_logs,
-        "today": today,
-        "weekly_goals": weekly_goals,
+        **dashboard,
         "week_dates": week_dates
     })
 
+@app.get("/api/dashboard")
+async def get_dashboard_endpoint():
+    """Get all dashboard data in one consistent snapshot."""
+    return await run_db(get_dashboard)
+
 # API Routes - Habits
 @app.post("/api/habits")
 async def create_habit_endpoint(habit: HabitCreate):
     """Create a new habit."""
-    habit_id = create_habit(habit.name, habit.color)
+    habit_id = await run_db(create_habit, habit.name, habit.color)
     return {"id": habit_id, "name": habit.name, "color": habit.color}
 
 @app.get("/api/habits")
 async def get_habits_endpoint():
     """Get all habits."""
-    return {"habits": get_habits()}
+    return {"habits": await run_db(get_habits)}
 
 @app.delete("/api/habits/{habit_id}")
 async def delete_habit_endpoint(habit_id: int):
     """Delete a habit."""
-    success = delete_habit(habit_id)
+    success = await run_db(delete_habit, habit_id)
     if not success:
         raise HTTPException(status_code=404, detail="Habit not found")
     return {"success": True}
@@ -101,35 +236,144 @@ async def delete_habit_endpoint(habit_id: int):
 @app.post("/api/logs")
 async def log_habit_endpoint(log: HabitLog):
     """Log a habit completion."""
-    log_habit(log.habit_id, log.completed, log.notes)
+    try:
+        await run_db(log_habit, log.habit_id, log.completed, log.date, log.notes)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     return {"success": True}
 
+MAX_REPORTED_ERRORS = 1000  # per-row errors returned by /api/logs/bulk
+
+async def _ndjson_lines(request: Request):
+    """Yield the non-empty lines of a streamed NDJSON request body."""
+    buffer = b""
+    async for data in request.stream():
+        buffer += data
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield line
+    if buffer.strip():
+        yield buffer
+
+@app.post("/api/logs/bulk")
+async def bulk_log_endpoint(request: Request):
+    """Import many logs from a JSON array or a streamed NDJSON body."""
+    result = {"written": 0, "failed": 0, "errors": []}
+    habit_ids = set()
+
+    async def write(rows, first_row):
+        outcome = await run_db(bulk_log_habits, rows, first_row, habit_ids)
+        result["written"] += outcome["written"]
+        result["failed"] += len(outcome["errors"])
+        add_errors(outcome["errors"])
+
+    def add_errors(errors):
+        room = MAX_REPORTED_ERRORS - len(result["errors"])
+        result["errors"].extend(errors[:max(room, 0)])
+
+    content_type = request.headers.get("content-type", "")
+    try:
+        if "ndjson" in content_type or "jsonl" in content_type:
+            chunk, first_row, index = [], 0, 0
+            async for line in _ndjson_lines(request):
+                try:
+                    chunk.append(json.loads(line))
+                except ValueError:
+                    # Write what we have so row numbers stay aligned past the bad line
+                    if chunk:
+                        await write(chunk, first_row)
+                    chunk, first_row = [], index + 1
+                    result["failed"] += 1
+                    add_errors([{"row": index, "error": "invalid JSON"}])
+                index += 1
+                if len(chunk) >= BULK_CHUNK_SIZE:
+                    await write(chunk, first_row)
+                    chunk, first_row = [], index
+            if chunk:
+                await write(chunk, first_row)
+        else:
+            try:
+                rows = json.loads(await request.body())
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Body must be a JSON array or NDJSON")
+            if not isinstance(rows, list):
+                raise HTTPException(status_code=400, detail="Body must be a JSON array or NDJSON")
+            await write(rows, 0)
+    finally:
+        # Chunks committed before a disconnect or error still need their streaks rebuilt
+        if habit_ids:
+            await run_db(rebuild_streaks, habit_ids)
+    return result
+
+def _encode_cursor(log: dict) -> str:
+    """Build an opaque next-page token from the last log on a page."""
+    raw = json.dumps([log["date"], log["habit_id"]]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+def _decode_cursor(token: Optional[str]):
+    """Turn a next-page token back into a (date, habit_id) keyset position."""
+    if token is None:
+        return None
+    try:
+        log_date, habit_id = json.loads(base64.urlsafe_b64decode(token.encode()))
+        return str(log_date), int(habit_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def _log_page(logs: list, limit: int) -> dict:
+    """Trim a limit + 1 fetch to one page and attach the next-page token."""
+    page = logs[:limit]
+    next_cursor = _encode_cursor(page[-1]) if len(logs) > limit else None
+    return {"logs": page, "next_cursor": next_cursor}
+
+@app.get("/api/logs")
+async def get_logs_endpoint(days: int = 30, limit: int = Query(100, ge=1, le=1000), after: Optional[str] = None):
+    """Get logs for all habits, one page at a time."""
+    logs = await run_db(get_all_logs, days, limit + 1, _decode_cursor(after))
+    return _log_page(logs, limit)
+
 @app.get("/api/habits/{habit_id}/logs")
-async def get_habit_logs_endpoint(habit_id: int, days: int = 30):
-    """Get habit logs."""
-    return {"logs": get_habit_logs(habit_id, days)}
+async def get_habit_logs_endpoint(habit_id: int, days: int = 30, limit: int = Query(100, ge=1, le=1000), after: Optional[str] = None):
+    """Get habit logs, one page at a time."""
+    logs = await run_db(get_habit_logs, habit_id, days, limit + 1, _decode_cursor(after))
+    return _log_page(logs, limit)
 
 # API Routes - Goals (NEW)
 @app.post("/api/goals")
 async def create_goal_endpoint(goal: GoalCreate):
     """Create a new goal."""
-    goal_id = create_goal(goal.habit_id, goal.goal_date, goal.target_count, goal.notes)
+    goal_id = await run_db(create_goal, goal.habit_id, goal.goal_date, goal.target_count, goal.notes)
     return {"id": goal_id, "message": "Goal created successfully"}
 
 @app.get("/api/goals")
 async def get_goals_endpoint(habit_id: Optional[int] = None, start_date: Optional[str] = None, end_date: Optional[str] = None):
     """Get goals, optionally filtered."""
-    return {"goals": get_goals(habit_id, start_date, end_date)}
+    return {"goals": await run_db(get_goals, habit_id, start_date, end_date)}
 
 @app.get("/api/goals/weekly")
 async def get_weekly_goals_endpoint():
     """Get goals for current week."""
-    return {"goals": get_weekly_goals()}
+    return {"goals": await run_db(get_weekly_goals)}
+
+def _parse_ids(ids: Optional[str], name: str) -> Optional[List[int]]:
+    """Parse a comma-separated id list query parameter; None when absent."""
+    if ids is None:
+        return None
+    try:
+        return [int(i) for i in ids.split(",") if i.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{name} must be comma-separated integers")
+
+@app.get("/api/goals/progress")
+async def get_goals_progress_endpoint(ids: Optional[str] = None, start_date: Optional[str] = None, end_date: Optional[str] = None):
+    """Get progress for many goals at once, by comma-separated ids and/or date range."""
+    return {"goals": await run_db(get_goals_progress, _parse_ids(ids, "ids"), start_date, end_date)}
 
 @app.get("/api/goals/{goal_id}/progress")
 async def get_goal_progress_endpoint(goal_id: int):
     """Get progress for a specific goal."""
-    progress = get_goal_progress(goal_id)
+    progress = await run_db(get_goal_progress, goal_id)
     if not progress:
         raise HTTPException(status_code=404, detail="Goal not found")
     return progress
@@ -137,38 +381,235 @@ async def get_goal_progress_endpoint(goal_id: int):
 @app.delete("/api/goals/{goal_id}")
 async def delete_goal_endpoint(goal_id: int):
     """Delete a goal."""
-    success = delete_goal(goal_id)
+    success = await run_db(delete_goal, goal_id)
     if not success:
         raise HTTPException(status_code=404, detail="Goal not found")
     return {"success": True}
 
+# API Routes - Export
+def _export_ndjson(batches):
+    """Encode export batches as NDJSON, one record per line tagged with its type."""
+    for table, columns, rows in batches:
+        record_type = table[:-1]
+        lines = []
+        for row in rows:
+            record = dict(zip(columns, row))
+            if "completed" in record:
+                record["completed"] = bool(record["completed"])
+            lines.append(json.dumps({"type": record_type, **record}))
+        yield "\n".join(lines) + "\n"
+
+def _export_csv(batches):
+    """Encode export batches of a single table as CSV with one header row."""
+    header_written = False
+    for _, columns, rows in batches:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if not header_written:
+            writer.writerow(columns)
+            header_written = True
+        writer.writerows(rows)
+        yield buffer.getvalue()
+
+@app.get("/api/export")
+async def export_endpoint(format: str = "ndjson", tables: str = "habits,logs,goals",
+                          habit_id: Optional[int] = None, start_date: Optional[str] = None,
+                          end_date: Optional[str] = None):
+    """Stream habits, logs and goals as NDJSON or CSV."""
+    table_list = [t.strip() for t in tables.split(",") if t.strip()]
+    if not table_list or any(t not in EXPORT_TABLES for t in table_list):
+        raise HTTPException(status_code=400, detail=f"tables must be a subset of {', '.join(EXPORT_TABLES)}")
+
+    batches = iter_export(table_list, habit_id, start_date, end_date)
+    if format == "ndjson":
+        return StreamingResponse(
+            _export_ndjson(batches),
+            media_type="application/x-ndjson",
+            headers={"Content-Disposition": "attachment; filename=habits-export.ndjson"}
+        )
+    if format == "csv":
+        if len(table_list) != 1:
+            raise HTTPException(status_code=400, detail="CSV export takes exactly one table")
+        return StreamingResponse(
+            _export_csv(batches),
+            media_type="text/csv",
+            headers={"Content-Disposition": f"attachment; filename={table_list[0]}.csv"}
+        )
+    raise HTTPException(status_code=400, detail="format must be ndjson or csv")
+
+# API Routes - Analytics (answered from the in-memory habit matrix)
+@app.get("/api/analytics/rates")
+async def get_analytics_rates(days: int = Query(30, ge=1), habit_ids: Optional[str] = None):
+    """Get per-habit completion rates over the last `days` days."""
+    return {"days": days, "habits": await run_db(analytics.completion_rates, days, _parse_ids(habit_ids, "habit_ids"))}
+
+@app.get("/api/analytics/heatmap")
+async def get_analytics_heatmap(year: Optional[int] = Query(None, ge=1, le=9999), habit_id: Optional[int] = None):
+    """Get completions per day of a year, for one habit or all of them."""
+    return await run_db(analytics.year_heatmap, year or date.today().year, habit_id)
+
+@app.get("/api/analytics/rolling")
+async def get_analytics_rolling(window: int = Query(7, ge=1, le=365), days: int = Query(90, ge=1, le=3660),
+                                habit_ids: Optional[str] = None):
+    """Get each habit's trailing-window completion rate for every recent day."""
+    return await run_db(analytics.rolling_rates, window, days, _parse_ids(habit_ids, "habit_ids"))
+
+@app.get("/api/analytics/weekdays")
+async def get_analytics_weekdays(days: Optional[int] = Query(None, ge=1), habit_ids: Optional[str] = None):
+    """Get completion rates by day of week, per habit and overall."""
+    return await run_db(analytics.weekday_profile, days, _parse_ids(habit_ids, "habit_ids"))
+
+@app.get("/api/analytics/correlations")
+async def get_analytics_correlations(days: int = Query(90, ge=1), habit_ids: Optional[str] = None,
+                                     limit: int = Query(20, ge=1, le=1000)):
+    """Get the most strongly correlated pairs of habits by daily completion."""
+    return await run_db(analytics.correlations, days, _parse_ids(habit_ids, "habit_ids"), limit)
+
+CALENDAR_MAX_DAYS = 3660
+
+@app.get("/api/calendar")
+async def get_calendar(start: str, end: str):
+    """Get per-habit completion bitmaps for a date range (base64, one bit per day)."""
+    try:
+        start_day, end_day = date.fromisoformat(start), date.fromisoformat(end)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="start and end must be YYYY-MM-DD")
+    if not 0 <= (end_day - start_day).days < CALENDAR_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"end must be on or after start and within {CALENDAR_MAX_DAYS} days")
+    return await run_db(analytics.calendar_bitmaps, start_day, end_day)
+
 # API Routes - Stats & Insights
 @app.get("/api/stats")
 async def get_stats_endpoint(habit_id: Optional[int] = None, days: int = 30):
     """Get statistics."""
-    return get_stats(habit_id, days)
+    return await run_db(get_stats, habit_id, days)
+
+STATS_SERIES_DEFAULT_DAYS = {"day": 29, "week": 7 * 11, "month": 334}  # 30 days, 12 weeks, 12 months
+STATS_SERIES_MAX_DAYS = 3660
+
+@app.get("/api/stats/{period}")
+async def get_stats_series_endpoint(period: str, habit_id: Optional[int] = None,
+                                    start_date: Optional[str] = None, end_date: Optional[str] = None):
+    """Get logged and completed counts per day, ISO week or month (defaults to the last 30 days, 12 weeks or 12 months)."""
+    if period not in STATS_PERIODS:
+        raise HTTPException(status_code=404, detail=f"period must be one of {', '.join(STATS_PERIODS)}")
+    try:
+        end = date.fromisoformat(end_date) if end_date else date.today()
+        start = date.fromisoformat(start_date) if start_date else end - timedelta(days=STATS_SERIES_DEFAULT_DAYS[period])
+    except ValueError:
+        raise HTTPException(status_code=400, detail="start_date and end_date must be YYYY-MM-DD")
+    if not 0 <= (end - start).days < STATS_SERIES_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"end_date must be on or after start_date and within {STATS_SERIES_MAX_DAYS} days")
+    return {"period": period, "series": await run_db(get_stats_series, period, start, end, habit_id)}
 
 @app.get("/api/streaks")
 async def get_streaks_endpoint():
     """Get current streaks."""
-    return {"streaks": get_habit_streaks()}
-
-@app.get("/api/insights")
-async def get_insights_endpoint():
-    """Get AI-powered insights."""
-    try:
-        client = get_glm_client()
+    return {"streaks": await run_db(get_habit_streaks)}
 
-        # Gather data for AI analysis
-        habit_data = {
+def _gather_habit_data():
+    """Collect the data the AI analyses, and its data version, in one snapshot."""
+    with read_snapshot():
+        return get_data_version(), {
             "habits": get_habits(),
             "stats": get_stats(days=30),
-            "logs": get_all_logs(days=30),
+            "features": extract_features(get_completion_history(FEATURE_HISTORY_DAYS)),
             "streaks": get_habit_streaks(),
             "weekly_goals": get_weekly_goals()
         }
 
-        insights = await client.get_habit_insights(habit_data)
+# Coalesces concurrent /api/insights requests for the same data version
+insights_flight = SingleFlight()
+
+# Background precomputation: regenerate after this many writes, or once the
+# stored answer is this old; the scheduler checks every poll interval (0 disables it)
+INSIGHTS_REFRESH_WRITES = int(os.getenv("INSIGHTS_REFRESH_WRITES", "20"))
+INSIGHTS_REFRESH_INTERVAL = float(os.getenv("INSIGHTS_REFRESH_INTERVAL", str(24 * 3600)))
+INSIGHTS_REFRESH_POLL = float(os.getenv("INSIGHTS_REFRESH_POLL", "60"))
+
+_insights_scheduler_task = None
+_background_refreshes = set()
+
+async def _compute_insights(client) -> str:
+    """Gather habit data, ask the AI client about it, and store the answer as the latest."""
+    data_version, habit_data = await run_db(_gather_habit_data)
+    insights = await client.get_habit_insights(habit_data, data_version)
+    if insights != INSIGHTS_UNAVAILABLE:
+        await run_db(save_latest_insights, insights, data_version, time.time())
+    return insights
+
+def _refresh_insights(client, data_version: int):
+    """Start regenerating insights in the background unless already under way."""
+    task = asyncio.ensure_future(insights_flight.do(
+        (current_db_path(), client.provider, client.model, data_version),
+        lambda: _compute_insights(client)
+    ))
+    _background_refreshes.add(task)
+    task.add_done_callback(_background_refreshes.discard)
+    return task
+
+def _latest_is_stale(latest: Dict[str, Any], data_version: int) -> bool:
+    """Stored insights are stale once anything was written or the day has turned, locally or in UTC."""
+    generated_at = latest["generated_at"]
+    return (
+        latest["data_version"] != data_version
+        or date.fromtimestamp(generated_at) != date.today()
+        or datetime.fromtimestamp(generated_at, timezone.utc).date() != utc_today()
+    )
+
+def _latest_is_due(latest: Dict[str, Any], data_version: int) -> bool:
+    """Whether the scheduler should regenerate without waiting for a request."""
+    if latest is None:
+        return True
+    return (
+        data_version - latest["data_version"] >= INSIGHTS_REFRESH_WRITES
+        or time.time() - latest["generated_at"] >= INSIGHTS_REFRESH_INTERVAL
+    )
+
+async def _insights_scheduler(client):
+    """Keep the stored insights warm so /api/insights rarely waits on the provider."""
+    while True:
+        await asyncio.sleep(INSIGHTS_REFRESH_POLL)
+        try:
+            data_version = await run_db(get_data_version)
+            latest = await run_db(get_latest_insights)
+            if _latest_is_due(latest, data_version):
+                await _refresh_insights(client, data_version)
+        except Exception as e:
+            print(f"Error precomputing insights: {e}")
+
+def _latest_response(latest: Dict[str, Any], stale: bool) -> Dict[str, Any]:
+    return {
+        "insights": latest["insights"],
+        "generated_at": datetime.fromtimestamp(latest["generated_at"]).isoformat(timespec="seconds"),
+        "stale": stale
+    }
+
+@app.get("/api/insights")
+async def get_insights_endpoint():
+    """Get AI-powered insights."""
+    try:
+        client = get_ai_client()
+
+        # Nothing written since the last answer: skip gathering data entirely
+        data_version = await run_db(get_data_version)
+        insights = insights_cache.get_for_version(client.provider, client.model, data_version)
+        if insights is not None:
+            return {"insights": insights}
+
+        # Serve the stored answer at once; a stale one is refreshed in the background
+        latest = await run_db(get_latest_insights)
+        if latest is not None:
+            stale = _latest_is_stale(latest, data_version)
+            if stale:
+                _refresh_insights(client, data_version)
+            return _latest_response(latest, stale)
+
+        # Nothing stored yet; concurrent requests for the same data share one computation
+        insights = await insights_flight.do(
+            (current_db_path(), client.provider, client.model, data_version),
+            lambda: _compute_insights(client)
+        )
         return {"insights": insights}
     except Exception as e:
         return {
@@ -176,6 +617,88 @@ async def get_insights_endpoint():
             "error": str(e)
         }
 
+# Coalesces concurrent /api/insights/stream requests for the same data version
+insights_streams = StreamFlight()
+
+async def _stream_insights(client) -> AsyncIterator[str]:
+    """Gather habit data and stream the AI client's answer, storing it as the latest once complete."""
+    data_version, habit_data = await run_db(_gather_habit_data)
+    async for text in client.stream_habit_insights(habit_data, data_version):
+        yield text
+    # Only a completed answer is remembered for the version
+    insights = insights_cache.get_for_version(client.provider, client.model, data_version)
+    if insights is not None:
+        await run_db(save_latest_insights, insights, data_version, time.time())
+
+def _sse(data: dict, event: str = None) -> str:
+    """Format one Server-Sent Events message."""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+@app.get("/api/insights/stream")
+async def stream_insights_endpoint():
+    """Stream AI insights as Server-Sent Events while the provider generates them."""
+    async def events():
+        try:
+            client = get_ai_client()
+            data_version = await run_db(get_data_version)
+            insights = insights_cache.get_for_version(client.provider, client.model, data_version)
+            latest = None if insights is not None else await run_db(get_latest_insights)
+            if insights is not None:
+                yield _sse({"text": insights})
+            elif latest is not None:
+                # Same stale-while-revalidate rule as /api/insights
+                if _latest_is_stale(latest, data_version):
+                    _refresh_insights(client, data_version)
+                yield _sse({"text": latest["insights"]})
+            else:
+                # Concurrent streams for the same data share one gather and upstream stream
+                key = (current_db_path(), client.provider, client.model, data_version)
+                async for text in insights_streams.stream(key, lambda: _stream_insights(client)):
+                    yield _sse({"text": text})
+        except Exception as e:
+            yield _sse({"error": str(e)}, event="error")
+        yield _sse({}, event="done")
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/api/insights/metrics")
+async def get_insights_metrics_endpoint():
+    """Get request-coalescing counters for the insights path."""
+    return {
+        "requests": insights_flight.metrics(),
+        "upstream": insights_cache.flight.metrics(),
+        "stream_requests": insights_streams.metrics(),
+        "upstream_streams": insights_cache.streams.metrics()
+    }
+
+# Metrics
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Expose route, query and AI timings and the coalescing counters in the Prometheus text format."""
+    flights = (("requests", insights_flight.metrics()), ("upstream", insights_cache.flight.metrics()),
+               ("stream_requests", insights_streams.metrics()), ("upstream_streams", insights_cache.streams.metrics()))
+    text = metrics.render()
+    text += metrics.format_samples(
+        "habit_insights_calls_total", "counter", "Insight calls made, by coalescing layer.",
+        [({"flight": name}, counts["calls"]) for name, counts in flights])
+    text += metrics.format_samples(
+        "habit_insights_executions_total", "counter", "Insight calls actually run after coalescing, by layer.",
+        [({"flight": name}, counts["executions"]) for name, counts in flights])
+    group_commit = group_commit_metrics()
+    if group_commit is not None:
+        text += metrics.format_samples(
+            "habit_group_commit_commits_total", "counter", "Transactions committed by the group-commit writer.",
+            [({}, group_commit["commits"])])
+        text += metrics.format_samples(
+            "habit_group_commit_writes_total", "counter", "Writes committed by the group-commit writer.",
+            [({}, group_commit["writes"])])
+    return Response(text, media_type="text/plain; version=0.0.4; charset=utf-8")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,137 @@
+import threading
+from bisect import bisect_left
+from typing import List, Dict, Any, Tuple
+
+# In-process metrics in the Prometheus text format.
+#
+# Every thread records into its own shard (a dict of label values -> cells),
+# so observing takes no lock and threads never write to the same list;
+# render() sums the shards. Shards of finished threads are kept, so counts
+# only ever go up, as Prometheus expects.
+
+# Latency bucket upper bounds, in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+UPSTREAM_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+_registry: List["_Metric"] = []
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._shards: Dict[int, Dict[tuple, list]] = {}
+        _registry.append(self)
+
+    def _cell(self, label_values: tuple) -> list:
+        shard = self._shards.get(threading.get_ident())
+        if shard is None:
+            shard = self._shards[threading.get_ident()] = {}
+        cell = shard.get(label_values)
+        if cell is None:
+            cell = shard[label_values] = self._new_cell()
+        return cell
+
+    def _totals(self) -> Dict[tuple, list]:
+        """Cells summed over all threads' shards."""
+        totals: Dict[tuple, list] = {}
+        for shard in list(self._shards.values()):
+            for label_values, cell in list(shard.items()):
+                total = totals.get(label_values)
+                if total is None:
+                    totals[label_values] = list(cell)
+                else:
+                    for i, value in enumerate(cell):
+                        total[i] += value
+        return totals
+
+    def _label_text(self, label_values: tuple, extra: str = "") -> str:
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labels, label_values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for label_values, cell in sorted(self._totals().items()):
+            lines.extend(self._samples(label_values, cell))
+        return lines
+
+
+class Histogram(_Metric):
+    """Observations counted into fixed buckets, plus their count and sum."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_cell(self) -> list:
+        # One count per bucket, one for +Inf, then the sum and the count
+        return [0] * (len(self.buckets) + 3)
+
+    def observe(self, value: float, *label_values):
+        cell = self._cell(label_values)
+        cell[bisect_left(self.buckets, value)] += 1
+        cell[-2] += value
+        cell[-1] += 1
+
+    def _samples(self, label_values: tuple, cell: list) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), cell):
+            cumulative += count
+            le = 'le="+Inf"' if bound == float("inf") else f'le="{_number(bound)}"'
+            lines.append(f"{self.name}_bucket{self._label_text(label_values, le)} {cumulative}")
+        lines.append(f"{self.name}_sum{self._label_text(label_values)} {_number(cell[-2])}")
+        lines.append(f"{self.name}_count{self._label_text(label_values)} {cell[-1]}")
+        return lines
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def format_samples(name: str, kind: str, help: str, samples: List[Tuple[Dict[str, Any], float]]) -> str:
+    """Render values kept elsewhere (e.g. existing counters) as one metric family."""
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        text = ",".join(f'{key}="{_escape(val)}"' for key, val in labels.items())
+        lines.append(f"{name}{{{text}}} {_number(value)}" if text else f"{name} {_number(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def render() -> str:
+    """Every registered metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# Metrics recorded by the app
+http_request_seconds = Histogram(
+    "habit_http_request_duration_seconds", "Time to serve a request, until the last body byte is sent.",
+    ("method", "route", "status"))
+db_call_seconds = Histogram(
+    "habit_db_call_duration_seconds", "Time spent in each data-access function called through run_db.",
+    ("function",))
+db_query_seconds = Histogram(
+    "habit_db_query_duration_seconds",
+    "Time spent in each data-access function, including calls made inside other data-access functions.",
+    ("function",))
+ai_insights_seconds = Histogram(
+    "habit_ai_insights_duration_seconds", "Time to answer get_habit_insights, cache hits included.",
+    ("provider",), UPSTREAM_BUCKETS)
+ai_upstream_seconds = Histogram(
+    "habit_ai_upstream_duration_seconds", "Time of each call to the AI provider's API.",
+    ("provider", "outcome"), UPSTREAM_BUCKETS)
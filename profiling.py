@@ -0,0 +1,217 @@
+import os
+import re
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import List, Dict, Any, Optional
+
+# Opt-in per-request profiling. With PROFILING=1 on the server, a request
+# carrying an X-Profile header or a profile query parameter (equal to
+# PROFILE_TOKEN when one is set, else "1") runs under a sampling profiler.
+# The stacks are written to PROFILE_DIR in the folded format read by
+# flamegraph.pl and speedscope, with a JSON file of the request's SQL
+# statements beside them. With PROFILING unset nothing is installed.
+PROFILING_ENABLED = os.getenv("PROFILING", "0") == "1"
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "1"))
+PROFILE_MAX_STATEMENTS = 5000  # SQL statements kept per profile
+
+PROFILE_HEADER = "x-profile"
+PROFILE_PARAM = "profile"
+
+# The profile of the request being handled; copied into DB worker calls by run_db
+_active_profile: ContextVar["RequestProfile"] = ContextVar("active_profile", default=None)
+
+
+def current_profile() -> Optional["RequestProfile"]:
+    return _active_profile.get()
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    name = f"{getattr(code, 'co_qualname', code.co_name)} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    return name.replace(";", ":")
+
+
+class RequestProfile:
+    """Samples the event loop thread, and DB workers while they run this request's calls.
+
+    Every PROFILE_INTERVAL_MS a sampler thread records each watched thread's
+    stack, weighted by the microseconds since the previous sample. Other
+    requests the event loop serves meanwhile show up in its stacks too;
+    `concurrent_requests` says whether that happened.
+    """
+
+    def __init__(self, name: str, interval_ms: float = PROFILE_INTERVAL_MS):
+        self.name = name
+        self.interval = interval_ms / 1000
+        self.stacks: Dict[str, int] = {}
+        self.statements: List[Dict[str, Any]] = []
+        self.dropped_statements = 0
+        self.db_calls: List[Dict[str, Any]] = []
+        self.concurrent_requests = 0
+        self.samples = 0
+        self._threads: Dict[int, str] = {threading.get_ident(): "event-loop"}
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self):
+        # Threads holding the GIL must yield it often enough for the sampler to run
+        self._switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(min(self._switch_interval, self.interval / 2))
+        self._started = time.perf_counter()
+        self._sampler.start()
+
+    def stop(self):
+        self._stop.set()
+        self._sampler.join()
+        self.duration = time.perf_counter() - self._started
+        sys.setswitchinterval(self._switch_interval)
+
+    def _run(self):
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            weight, last = int((now - last) * 1_000_000), now
+            frames = sys._current_frames()
+            for ident, label in list(self._threads.items()):
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                names = []
+                while frame is not None:
+                    names.append(_frame_name(frame))
+                    frame = frame.f_back
+                names.append(label)
+                stack = ";".join(reversed(names))
+                self.stacks[stack] = self.stacks.get(stack, 0) + weight
+                self.samples += 1
+
+    @contextmanager
+    def db_call(self, conn, function: str):
+        """Sample the calling DB worker thread and trace its SQL while the block runs."""
+        ident = threading.get_ident()
+        self._threads[ident] = "db-worker"
+        try:
+            with self.trace_sql(conn, function):
+                yield
+        finally:
+            del self._threads[ident]
+
+    @contextmanager
+    def trace_sql(self, conn, function: str):
+        """Record the statements conn runs while the block runs, from any thread.
+
+        A statement's duration is the time until the next one started (or
+        the block ended), so it includes any Python work in between.
+        """
+        started = time.perf_counter()
+        traced = []
+        conn.set_trace_callback(lambda sql: traced.append((time.perf_counter(), sql)))
+        try:
+            yield
+        finally:
+            conn.set_trace_callback(None)
+            ended = time.perf_counter()
+            self.db_calls.append({"function": function, "ms": round((ended - started) * 1000, 3)})
+            for i, (at, sql) in enumerate(traced):
+                if len(self.statements) >= PROFILE_MAX_STATEMENTS:
+                    self.dropped_statements += len(traced) - i
+                    break
+                until = traced[i + 1][0] if i + 1 < len(traced) else ended
+                self.statements.append({"function": function, "sql": sql.strip(),
+                                        "ms": round((until - at) * 1000, 3)})
+
+    def folded(self) -> str:
+        """Stacks in the folded format: frames joined by ';', then a space and the weight in microseconds."""
+        return "".join(f"{stack} {weight}\n" for stack, weight in sorted(self.stacks.items()))
+
+    def save(self, directory: str, request: Dict[str, Any]):
+        """Write <name>.folded and <name>.json to directory."""
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f"{self.name}.folded"), "w") as f:
+            f.write(self.folded())
+        summary = dict(
+            request,
+            duration_ms=round(self.duration * 1000, 3),
+            interval_ms=self.interval * 1000,
+            samples=self.samples,
+            concurrent_requests=self.concurrent_requests,
+            db_calls=self.db_calls,
+            sql=self.statements,
+            dropped_statements=self.dropped_statements,
+        )
+        with open(os.path.join(directory, f"{self.name}.json"), "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+def _requested(scope) -> bool:
+    expected = PROFILE_TOKEN or "1"
+    for key, value in scope["headers"]:
+        if key == PROFILE_HEADER.encode():
+            return value.decode("latin-1") == expected
+    query = scope.get("query_string", b"").decode("latin-1")
+    return any(part == f"{PROFILE_PARAM}={expected}" for part in query.split("&"))
+
+
+class ProfileMiddleware:
+    """ASGI middleware running requests that ask for it under a RequestProfile.
+
+    One request is profiled at a time; others, and requests that do not ask,
+    pass straight through. The response carries the profile's name in an
+    X-Profile header.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._profile: Optional[RequestProfile] = None
+        self._in_flight = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        self._in_flight += 1
+        try:
+            if self._profile is not None:
+                self._profile.concurrent_requests += 1
+            elif _requested(scope):
+                await self._profiled(scope, receive, send)
+                return
+            await self.app(scope, receive, send)
+        finally:
+            self._in_flight -= 1
+
+    async def _profiled(self, scope, receive, send):
+        slug = re.sub(r"[^A-Za-z0-9_.]+", "-", scope["path"]).strip("-.") or "index"
+        name = f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{scope['method']}-{slug}"
+        profile = self._profile = RequestProfile(name)
+        profile.concurrent_requests = self._in_flight - 1
+        status = 500
+
+        async def send_named(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message = dict(message, headers=list(message.get("headers", [])) + [(b"x-profile", name.encode())])
+            await send(message)
+
+        token = _active_profile.set(profile)
+        profile.start()
+        try:
+            await self.app(scope, receive, send_named)
+        finally:
+            profile.stop()
+            _active_profile.reset(token)
+            self._profile = None
+            profile.save(PROFILE_DIR, {
+                "method": scope["method"],
+                "path": scope["path"],
+                "query": scope.get("query_string", b"").decode("latin-1"),
+                "status": status,
+            })
@@ -39,7 +39,7 @@ let isInitialized = false;
 document.addEventListener('DOMContentLoaded', () => {
     console.log('DOM Loaded');
     loadInsights();
-    fetchHabits().then(() => {
+    refreshDashboard().then(() => {
         renderMyHabits();
         navigateToWeek(0);
         setupEventListeners();
@@ -60,6 +60,20 @@ async function fetchHabits() {
     }
 }
 
+// Fetch habits, streaks and today's logs in one round trip
+async function refreshDashboard() {
+    try {
+        const response = await fetch(`${API_BASE}/dashboard`);
+        const data = await response.json();
+        habits = data.habits || [];
+        window.streaks = data.streaks || [];
+        window.todayLogs = data.today_logs || {};
+        console.log('Dashboard loaded:', data);
+    } catch (error) {
+        console.error('Error fetching dashboard:', error);
+    }
+}
+
 // Render My Habits section
 function renderMyHabits() {
     if (!myHabitsList) {
@@ -272,9 +286,12 @@ async function navigateToWeek(offset) {
     // Rebuild calendar grid with new dates
     rebuildCalendarGrid(weekDates);
 
+    // Mark each day with the habits completed on it
+    loadCompletions(startDateStr, endDateStr);
+
     // Fetch and display goals
     try {
-        const response = await fetch(`${API_BASE}/goals?start_date=${startDateStr}&end_date=${endDateStr}`);
+        const response = await fetch(`${API_BASE}/goals/progress?start_date=${startDateStr}&end_date=${endDateStr}`);
         const data = await response.json();
         console.log('Goals loaded:', data.goals);
 
@@ -297,6 +314,45 @@ async function navigateToWeek(offset) {
     }
 }
 
+// Decode a bit-packed calendar payload: each habit's `completed` becomes a Set of dates
+function decodeCalendar(payload) {
+    const origin = new Date(`${payload.start}T00:00:00Z`);
+    return payload.habits.map(habit => {
+        const bytes = Uint8Array.from(atob(habit.completed), c => c.charCodeAt(0));
+        const completed = new Set();
+        for (let day = 0; day < payload.days; day++) {
+            if (bytes[day >> 3] & (1 << (day & 7))) {
+                const date = new Date(origin);
+                date.setUTCDate(origin.getUTCDate() + day);
+                completed.add(date.toISOString().split('T')[0]);
+            }
+        }
+        return { ...habit, completed };
+    });
+}
+
+// Show a dot per completed habit on each day of the calendar
+async function loadCompletions(startDateStr, endDateStr) {
+    try {
+        const response = await fetch(`${API_BASE}/calendar?start=${startDateStr}&end=${endDateStr}`);
+        const calendar = decodeCalendar(await response.json());
+
+        document.querySelectorAll('.day-completions').forEach(day => {
+            const dateStr = day.id.replace('day-completions-', '');
+            day.innerHTML = '';
+            calendar.filter(habit => habit.completed.has(dateStr)).forEach(habit => {
+                const dot = document.createElement('span');
+                dot.className = 'completion-dot';
+                dot.style.backgroundColor = habit.color;
+                dot.title = habit.name;
+                day.appendChild(dot);
+            });
+        });
+    } catch (error) {
+        console.error('Error loading completions:', error);
+    }
+}
+
 // Rebuild calendar grid with new dates
 function rebuildCalendarGrid(weekDates) {
     console.log('Rebuilding calendar grid for dates:', weekDates);
@@ -319,8 +375,13 @@ function rebuildCalendarGrid(weekDates) {
         dayDateEl.className = 'day-date';
         dayDateEl.textContent = date.toLocaleDateString('en-US', { month: 'numeric', day: 'numeric' });
 
+        const dayCompletions = document.createElement('div');
+        dayCompletions.className = 'day-completions';
+        dayCompletions.id = `day-completions-${date.toISOString().split('T')[0]}`;
+
         dayHeader.appendChild(dayName);
         dayHeader.appendChild(dayDateEl);
+        dayHeader.appendChild(dayCompletions);
 
         const dayGoals = document.createElement('div');
         dayGoals.className = 'day-goals';
@@ -378,7 +439,8 @@ async function openDayGoals(dateStr) {
 
     // Load goals for this date
     try {
-        const goalsResponse = await fetch(`${API_BASE}/goals?start_date=${dateStr}&end_date=${dateStr}`);
+        // Goals come back with their progress already attached
+        const goalsResponse = await fetch(`${API_BASE}/goals/progress?start_date=${dateStr}&end_date=${dateStr}`);
         const goalsData = await goalsResponse.json();
 
         // Clear existing goals
@@ -388,18 +450,7 @@ async function openDayGoals(dateStr) {
         if (goalsData.goals.length === 0) {
             dayGoalsList.innerHTML = '<p class="empty-state">No goals for this day</p>';
         } else {
-            // Add goal progress to each goal
-            const goalsWithProgress = await Promise.all(goalsData.goals.map(async goal => {
-                try {
-                    const progressResp = await fetch(`${API_BASE}/goals/${goal.id}/progress`);
-                    const progressData = await progressResp.json();
-                    return { ...goal, ...progressData };
-                } catch {
-                    return goal;
-                }
-            }));
-
-            goalsWithProgress.forEach(goal => {
+            goalsData.goals.forEach(goal => {
                 const goalCard = createGoalCard(goal, true);
                 dayGoalsList.appendChild(goalCard);
             });
@@ -478,7 +529,7 @@ async function addHabit() {
         if (response.ok) {
             addHabitForm.reset();
             addHabitModal.classList.remove('active');
-            fetchHabits().then(() => {
+            refreshDashboard().then(() => {
                 renderMyHabits();
             });
         } else {
@@ -641,7 +692,50 @@ async function deleteGoal(goalId) {
     }
 }
 
-async function loadInsights() {
+// Format insights with markdown-like styling
+function formatInsights(text) {
+    return text
+        .replace(/\*\*(.*?)\*\*/g, '<strong>$1</strong>')
+        .replace(/^- /gm, '• ');
+}
+
+// Stream insights as they are generated, falling back to a single request
+function loadInsights() {
+    if (!window.EventSource) {
+        return loadInsightsOnce();
+    }
+
+    insightsBox.innerHTML = 'Loading insights...';
+    let text = '';
+    const source = new EventSource(`${API_BASE}/insights/stream`);
+
+    source.onmessage = (e) => {
+        const data = JSON.parse(e.data);
+        if (data.text) {
+            text += data.text;
+            insightsBox.innerHTML = formatInsights(text);
+        }
+    };
+
+    source.addEventListener('done', () => {
+        source.close();
+        if (!text) {
+            insightsBox.innerHTML = 'Unable to load insights. Please try again.';
+        }
+    });
+
+    source.addEventListener('error', (e) => {
+        source.close();
+        if (e.data) {
+            console.error('Error streaming insights:', e.data);
+        }
+        if (!text) {
+            loadInsightsOnce();
+        }
+    });
+}
+
+async function loadInsightsOnce() {
     insightsBox.innerHTML = 'Loading insights...';
 
     try {
@@ -649,12 +743,7 @@ async function loadInsights() {
         const data = await response.json();
 
         if (data.insights) {
-            // Format insights with markdown-like styling
-            let formatted = data.insights
-                .replace(/\*\*(.*?)\*\*/g, '<strong>$1</strong>')
-                .replace(/^- /gm, '• ');
-
-            insightsBox.innerHTML = formatted;
+            insightsBox.innerHTML = formatInsights(data.insights);
         } else {
             insightsBox.innerHTML = 'Unable to load insights. Please try again.';
         }
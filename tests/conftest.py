@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """A fresh, fully migrated database used by every data-access call in the test; yields its connection."""
+    monkeypatch.setattr(database, "DB_PATH", str(tmp_path / "habits.db"))
+    database.init_db()
+    yield database.get_connection()
+    database.close_connections()
@@ -0,0 +1,153 @@
+import random
+from datetime import date, timedelta
+
+import pytest
+
+import database
+from database import (create_habit, delete_habit, log_habit, bulk_log_habits, rebuild_streaks, archive_cold_logs,
+                      get_habit_logs, get_all_logs, get_stats, get_stats_series, get_habit_streaks,
+                      get_completion_history, get_completed_days, iter_export, init_db, use_database)
+
+
+def _day(days_ago: int) -> str:
+    return (date.today() - timedelta(days=days_ago)).isoformat()
+
+
+def _without_ids(rows):
+    return sorted(tuple(sorted((k, v) for k, v in row.items() if k != "id")) for row in rows)
+
+
+def _pages(read, limit):
+    """Every (date, habit_id, completed, notes) returned by walking read()'s keyset pages."""
+    keys, after = [], None
+    while True:
+        page = read(limit, after)
+        if not page:
+            return keys
+        keys += [(row["date"], row["habit_id"], row["completed"], row["notes"]) for row in page]
+        after = page[-1]["date"], page[-1]["habit_id"]
+
+
+def _snapshot(habit_ids):
+    """What every reader returns, with log ids dropped since archived logs have none."""
+    snapshot = {}
+    for habit_id in habit_ids[:3]:
+        for days in (30, 200, 400, 1000):
+            snapshot["habit_logs", habit_id, days] = _without_ids(get_habit_logs(habit_id, days))
+        snapshot["habit_pages", habit_id] = _pages(lambda limit, after: get_habit_logs(habit_id, 1000, limit, after), 37)
+    for days in (7, 300, 1000):
+        snapshot["all_logs", days] = _without_ids(get_all_logs(days))
+    snapshot["all_pages"] = _pages(lambda limit, after: get_all_logs(1000, limit, after), 97)
+    for habit_id in [None] + habit_ids[:2]:
+        for days in (0, 10, 59, 60, 100, 365, 800, 3000):
+            snapshot["stats", habit_id, days] = get_stats(habit_id, days)
+    for period in ("day", "week", "month"):
+        snapshot["series", period] = get_stats_series(period, date.today() - timedelta(days=950),
+                                                      date.today() + timedelta(days=10))
+    snapshot["streaks"] = get_habit_streaks()
+    history = get_completion_history(None)
+    snapshot["history"] = history["start_day"], history["habits"], sorted(history["completed"])
+    completed_days = get_completed_days(_day(950), _day(-10))
+    snapshot["completed_days"] = completed_days["habits"], sorted(completed_days["completed"])
+    snapshot["export"] = sorted(row[1:] for _, _, rows in iter_export(["logs"]) for row in rows)
+    return snapshot
+
+
+def _random_logs(rng, habit_ids, count):
+    return [{"habit_id": rng.choice(habit_ids), "completed": rng.random() < 0.6,
+             "date": _day(rng.randrange(-5, 900)), "notes": rng.choice([None, None, "note"])}
+            for _ in range(count)]
+
+
+def _assert_merged_logs_consistent(conn):
+    """Each log lives in exactly one of habit_logs and log_archive, and log_rollups counts both."""
+    duplicates = conn.execute(f"""
+        SELECT habit_id, date FROM {database._ALL_LOGS_SQL} GROUP BY habit_id, date HAVING COUNT(*) > 1
+    """).fetchall()
+    assert duplicates == []
+    recount = set(map(tuple, conn.execute(f"""
+        SELECT p.period, l.habit_id,
+               CASE p.period WHEN 'week' THEN date(l.date, 'weekday 0', '-6 days')
+                             ELSE date(l.date, 'start of month') END,
+               COUNT(*), SUM(l.completed = 1)
+        FROM {database._ALL_LOGS_SQL} l, (SELECT 'week' AS period UNION ALL SELECT 'month') p
+        WHERE l.habit_id IN (SELECT id FROM habits)
+        GROUP BY 1, 2, 3
+    """)))
+    rollups = set(map(tuple, conn.execute("""
+        SELECT period, habit_id, start_date, logged, completed FROM log_rollups
+        WHERE logged != 0 AND habit_id IN (SELECT id FROM habits)
+    """)))
+    assert rollups == recount
+
+
+@pytest.fixture
+def habits(db):
+    ids = [create_habit(f"habit {i}") for i in range(4)]
+    bulk_log_habits(_random_logs(random.Random(25), ids, 3000))
+    rebuild_streaks()
+    return ids
+
+
+def test_archiving_leaves_every_reader_unchanged(db, habits):
+    before = _snapshot(habits)
+    result = archive_cold_logs(180)
+    assert result["archived_logs"] > 0
+    assert db.execute("SELECT COUNT(*) FROM habit_logs WHERE date < ?", (result["before"],)).fetchone()[0] == 0
+    assert _snapshot(habits) == before
+    _assert_merged_logs_consistent(db)
+
+    rebuild_streaks()
+    assert _snapshot(habits) == before
+
+
+def test_writes_into_archived_months_match_a_database_never_archived(db, habits, tmp_path):
+    twin = str(tmp_path / "twin.db")
+    with use_database(twin):
+        init_db()
+        assert [create_habit(f"habit {i}") for i in range(4)] == habits
+        bulk_log_habits(_random_logs(random.Random(25), habits, 3000))
+        rebuild_streaks()
+    archive_cold_logs(180)
+
+    def write(rng):
+        for _ in range(300):
+            log_habit(rng.choice(habits), rng.random() < 0.5, _day(rng.randrange(-5, 900)), rng.choice([None, "edit"]))
+        bulk_log_habits(_random_logs(rng, habits, 1000))
+        rebuild_streaks()
+
+    write(random.Random(7))
+    with use_database(twin):
+        write(random.Random(7))
+        expected = _snapshot(habits)
+    assert _snapshot(habits) == expected
+    _assert_merged_logs_consistent(db)
+
+    # A second run merges the logs written since into the existing bitmaps
+    archive_cold_logs(30)
+    assert _snapshot(habits) == expected
+    _assert_merged_logs_consistent(db)
+
+
+def test_delete_habit_removes_its_archive(db, habits):
+    archive_cold_logs(180)
+    assert db.execute("SELECT COUNT(*) FROM log_archive_notes WHERE habit_id = ?", (habits[0],)).fetchone()[0] > 0
+    delete_habit(habits[0])
+    for table in ("habit_logs", "log_archive", "log_archive_notes", "log_rollups"):
+        assert db.execute(f"SELECT COUNT(*) FROM {table} WHERE habit_id = ?", (habits[0],)).fetchone()[0] == 0
+    _assert_merged_logs_consistent(db)
+
+
+def test_orphaned_logs_are_not_archived(db, habits):
+    # Logs left behind by a habit deleted outside delete_habit
+    with db:
+        db.execute("DELETE FROM habits WHERE id = ?", (habits[1],))
+    expected = get_all_logs(1000)
+    archive_cold_logs(180)
+
+    for table in ("log_archive", "log_archive_notes"):
+        assert db.execute(f"SELECT COUNT(*) FROM {table} WHERE habit_id = ?", (habits[1],)).fetchone()[0] == 0
+    unpaged = get_all_logs(1000)
+    assert _without_ids(unpaged) == _without_ids(expected)
+    assert _pages(lambda limit, after: get_all_logs(1000, limit, after), 7) == sorted(
+        ((row["date"], row["habit_id"], row["completed"], row["notes"]) for row in unpaged), reverse=True)
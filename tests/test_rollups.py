@@ -0,0 +1,100 @@
+import random
+from datetime import date, timedelta
+
+import pytest
+
+import database
+from database import (create_habit, delete_habit, log_habit, bulk_log_habits, get_stats, get_stats_series,
+                      utc_today, STATS_ROLLUP_MIN_DAYS)
+
+_RECOUNT = """
+    SELECT p.period, l.habit_id,
+           CASE p.period WHEN 'week' THEN date(l.date, 'weekday 0', '-6 days')
+                         ELSE date(l.date, 'start of month') END,
+           COUNT(*), SUM(l.completed = 1)
+    FROM {source} l, (SELECT 'week' AS period UNION ALL SELECT 'month') p
+    WHERE l.habit_id IN (SELECT id FROM habits)
+    GROUP BY 1, 2, 3
+"""
+
+
+def assert_rollups_match_logs(conn, source="habit_logs"):
+    """log_rollups must equal a recount of the logs in `source`, ignoring emptied rows."""
+    recount = set(map(tuple, conn.execute(_RECOUNT.format(source=source))))
+    rollups = set(map(tuple, conn.execute("""
+        SELECT period, habit_id, start_date, logged, completed FROM log_rollups
+        WHERE logged != 0 AND habit_id IN (SELECT id FROM habits)
+    """)))
+    assert rollups == recount
+    assert conn.execute("SELECT COUNT(*) FROM log_rollups WHERE logged < 0 OR completed < 0").fetchone()[0] == 0
+
+
+def _day(days_ago: int) -> str:
+    return (date.today() - timedelta(days=days_ago)).isoformat()
+
+
+@pytest.fixture
+def habits(db):
+    rng = random.Random(24)
+    ids = [create_habit(f"habit {i}") for i in range(5)]
+    bulk_log_habits({"habit_id": rng.choice(ids), "completed": rng.random() < 0.6,
+                     "date": _day(rng.randrange(-5, 900))} for _ in range(4000))
+    return ids
+
+
+def test_rollups_follow_every_kind_of_write(db, habits):
+    rng = random.Random(1)
+    assert_rollups_match_logs(db)
+
+    for _ in range(500):
+        log_habit(rng.choice(habits), rng.random() < 0.7, _day(rng.randrange(-5, 900)))
+    assert_rollups_match_logs(db)
+
+    # Date moves across weeks and months, flips and deletes made outside database.py
+    random_rows = "id IN (SELECT id FROM habit_logs ORDER BY random() LIMIT 200)"
+    with db:
+        db.execute(f"UPDATE OR IGNORE habit_logs SET date = date(date, '-40 days') WHERE {random_rows}")
+        db.execute(f"UPDATE habit_logs SET completed = 1 - completed WHERE {random_rows}")
+        db.execute(f"UPDATE OR IGNORE habit_logs SET habit_id = ? WHERE {random_rows}", (habits[0],))
+        db.execute(f"DELETE FROM habit_logs WHERE {random_rows}")
+    assert_rollups_match_logs(db)
+
+    delete_habit(habits[1])
+    assert_rollups_match_logs(db)
+    assert db.execute("SELECT COUNT(*) FROM log_rollups WHERE habit_id = ?", (habits[1],)).fetchone()[0] == 0
+
+
+def test_migration_backfill_matches_triggers(db, habits):
+    backfill, = (s for m in database.MIGRATIONS for s in database._script_statements(m)
+                 if s.lstrip().startswith("INSERT OR REPLACE INTO log_rollups"))
+    maintained = sorted(map(tuple, db.execute("SELECT * FROM log_rollups WHERE logged != 0")))
+    with db:
+        db.execute("DELETE FROM log_rollups")
+        db.execute(backfill)
+    assert sorted(map(tuple, db.execute("SELECT * FROM log_rollups"))) == maintained
+
+
+@pytest.mark.parametrize("days", [0, 1, 6, 13, 30, STATS_ROLLUP_MIN_DAYS - 1, STATS_ROLLUP_MIN_DAYS,
+                                  STATS_ROLLUP_MIN_DAYS + 1, 100, 365, 800, 3000])
+def test_stats_match_a_count_of_the_logs(db, habits, days):
+    start = (utc_today() - timedelta(days=days)).isoformat()
+    for habit_id in (None, habits[2]):
+        logged, completed = db.execute("""
+            SELECT COUNT(*), SUM(completed = 1) FROM habit_logs
+            WHERE habit_id IN (SELECT id FROM habits) AND (? IS NULL OR habit_id = ?) AND date >= ?
+        """, (habit_id, habit_id, start)).fetchone()
+        stats = get_stats(habit_id, days)
+        assert (stats["total_logs"], stats["completed"] or 0) == (logged, completed or 0)
+
+
+@pytest.mark.parametrize("period", ["week", "month"])
+def test_stats_series_match_the_daily_series(db, habits, period):
+    # Past the latest log, so the last period is not cut short in the daily series
+    end = date.today() + timedelta(days=10)
+    start = database._period_start(end - timedelta(days=400), period)
+    daily = get_stats_series("day", start, end, habits[3])
+    for point in get_stats_series(period, start, end, habits[3]):
+        days = [d for d in daily if point["start"] <= d["start"] < database._next_period(
+            date.fromisoformat(point["start"]), period).isoformat()]
+        assert point["logged"] == sum(d["logged"] for d in days)
+        assert point["completed"] == sum(d["completed"] for d in days)
@@ -0,0 +1,64 @@
+import random
+from datetime import date, timedelta
+
+from database import create_habit, log_habit, bulk_log_habits, rebuild_streaks, get_habit_streaks
+
+
+def _streak_state(conn):
+    runs = sorted(map(tuple, conn.execute("SELECT habit_id, start_day, end_day FROM streak_runs")))
+    streaks = sorted(map(tuple, conn.execute(
+        "SELECT habit_id, current_streak, longest_streak, last_completed_date FROM habit_streaks")))
+    return runs, streaks
+
+
+def _day(days_ago: int) -> str:
+    return (date.today() - timedelta(days=days_ago)).isoformat()
+
+
+def test_streaks_count_consecutive_days(db):
+    habit = create_habit("read")
+    for days_ago in (0, 1, 2, 5, 6):
+        log_habit(habit, True, _day(days_ago))
+
+    streak, = get_habit_streaks()
+    assert (streak["current_streak"], streak["longest_streak"]) == (3, 3)
+
+    log_habit(habit, False, _day(1))
+    streak, = get_habit_streaks()
+    assert (streak["current_streak"], streak["longest_streak"]) == (1, 2)
+
+    log_habit(habit, True, _day(4))
+    log_habit(habit, True, _day(3))
+    log_habit(habit, True, _day(1))
+    streak, = get_habit_streaks()
+    assert (streak["current_streak"], streak["longest_streak"]) == (7, 7)
+
+
+def test_incremental_streaks_match_rebuild(db):
+    rng = random.Random(4)
+    habits = [create_habit(f"habit {i}") for i in range(4)]
+    for _ in range(3000):
+        log_habit(rng.choice(habits), rng.random() < 0.7, _day(rng.randrange(90)))
+
+    incremental = _streak_state(db)
+    rebuild_streaks()
+    assert _streak_state(db) == incremental
+
+
+def test_rebuild_after_bulk_import_matches_incremental(db):
+    rng = random.Random(6)
+    habits = [create_habit(f"habit {i}") for i in range(3)]
+    rows = [{"habit_id": rng.choice(habits), "completed": rng.random() < 0.6, "date": _day(rng.randrange(120))}
+            for _ in range(1500)]
+    result = bulk_log_habits(rows)
+    rebuild_streaks(result["habit_ids"])
+    rebuilt = _streak_state(db)
+
+    # The same rows written one by one, where later rows win as in the bulk upsert
+    for habit in habits:
+        db.execute("DELETE FROM habit_logs WHERE habit_id = ?", (habit,))
+    db.commit()
+    rebuild_streaks()
+    for row in rows:
+        log_habit(row["habit_id"], row["completed"], row["date"])
+    assert _streak_state(db) == rebuilt